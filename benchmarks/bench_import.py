@@ -0,0 +1,65 @@
+"""
+Import time benchmark
+=====================
+
+- **File name**: bench_import.py
+- **Arthor**: Luke Du
+- **Purpose**: Check import time of package against budget.
+
+Short jobs (one file per process) pay the import time of this package every
+time. This benchmark runs `python -X importtime` in a new process several
+times, takes the best cumulative time of each module and compares it to its
+budget (milliseconds).
+
+Run under upper folder of `benchmarks`
+
+`python -B benchmarks/bench_import.py`
+
+The exit code is 1 when any module is over budget.
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+# module -> import time budget in milliseconds
+BUDGET_MS = {
+    "jsonparse": 5,
+    "jsonparse.jsonutils": 40,
+}
+
+def import_time_us(module, root):
+    """
+    *cumulative import time of module in microsecond*
+
+    * run `python -X importtime -c "import module"` in *root* folder
+    * the last line of importtime output is the module itself
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([root, env.get("PYTHONPATH", "")])
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd = root, env = env, stderr = subprocess.PIPE, stdout = subprocess.DEVNULL,
+                          universal_newlines = True, check = True)
+    for line in reversed(proc.stderr.splitlines()):
+        fields = [e.strip() for e in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1])
+    raise RuntimeError(f"no importtime output for {module}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = "Check import time against budget")
+    parser.add_argument("--repeat", type = int, default = 5, help = "runs per module, best one is used")
+    parser.add_argument("--scale", type = float, default = 1.0, help = "multiply budget (slow machine)")
+    args = parser.parse_args(argv)
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    over_budget = False
+    for module, budget in BUDGET_MS.items():
+        best_ms = min(import_time_us(module, root) for _ in range(args.repeat)) / 1000
+        limit = budget * args.scale
+        status = "ok" if best_ms <= limit else "OVER BUDGET"
+        over_budget = over_budget or best_ms > limit
+        print(f"{module:<24} {best_ms:8.2f} ms (budget {limit:.1f} ms) {status}")
+    return 1 if over_budget else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
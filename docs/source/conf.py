@@ -12,6 +12,7 @@
 #
 import os
 import sys
+sys.path.insert(0, os.path.abspath('../..'))
 sys.path.insert(0, os.path.abspath('../../jsonparse'))
 sys.path.insert(0, os.path.abspath('../../tests'))
 
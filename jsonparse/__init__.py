@@ -0,0 +1,59 @@
+"""
+The jsonparse package
+=====================
+
+- **File name**: __init__.py
+- **Arthor**: Luke Du
+- **Purpose**: Light package entry. The classes and functions are imported at first use.
+
+`import jsonparse` only loads this file. The module which defines a name
+(and the modules it needs, like logzero) is imported when the name is used:
+
+* `from jsonparse import JsonUtils` imports jsonutils module
+* `from jsonparse import MapCache` imports mapcache module only
+"""
+import sys
+
+__version__ = '1.0.1'
+
+# public name -> module defining it
+_LAZY_NAMES = {
+    "JsonUtils": "jsonparse.jsonutils",
+    "compile_map": "jsonparse.jsonutils",
+    "get_paths": "jsonparse.jsonutils",
+    "get_path_pool": "jsonparse.jsonutils",
+    "project_map": "jsonparse.jsonutils",
+    "RecordFilter": "jsonparse.jsonutils",
+    "split_wide_tables": "jsonparse.jsonutils",
+    "MapCache": "jsonparse.mapcache",
+    "schema_fingerprint": "jsonparse.mapcache",
+    "logger": "jsonparse.log",
+    "JsonParseError": "jsonparse.errors",
+    "DecodeError": "jsonparse.errors",
+    "MapError": "jsonparse.errors",
+    "MapMismatchError": "jsonparse.errors",
+    "UnmappedPathError": "jsonparse.errors",
+    "UnmappedArrayError": "jsonparse.errors",
+    "UnsupportedDepthError": "jsonparse.errors",
+}
+
+__all__ = sorted(_LAZY_NAMES)
+
+def __getattr__(name):
+    """
+    *import name at first use* (PEP 562)
+    """
+    module_name = _LAZY_NAMES.get(name, None)
+    if module_name is None:
+        raise AttributeError(f"module 'jsonparse' has no attribute '{name}'")
+    import importlib
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value # next time no need to call this function
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
+
+if sys.version_info < (3, 7): # no module __getattr__, import all names now
+    for _name in _LAZY_NAMES:
+        globals()[_name] = __getattr__(_name)
@@ -0,0 +1,8 @@
+"""
+* `python -m jsonparse` runs the command line tool (see cli.py)
+"""
+import sys
+
+from jsonparse.cli import main
+
+sys.exit(main())
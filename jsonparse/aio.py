@@ -0,0 +1,139 @@
+"""
+The asyncio pipeline
+====================
+
+- **File name**: aio.py
+- **Arthor**: Luke Du
+- **Purpose**: Parse records from asyncio sources and load into asyncio sinks (like PostgreSQL), overlapping I/O and parsing.
+
+**parse_async** takes an async iterator of raw records (JSON strings), and:
+
+* collects records into chunks
+* parses chunks (stream.ChunkParser) in executor: thread (default) or process pool (**process_executor**)
+* sends encoded rows of each table to its async sink, chunk by chunk in input order
+
+Chunks waiting for parse or sink are in a bounded queue: when sinks are slow,
+reading of records waits (backpressure), and memory is bounded. When reading
+stops by error or cancel, the reader does not wait for room in the queue: the
+sending loop also stops when the reader is done and the queue is empty.
+
+Example, load into PostgreSQL with asyncpg::
+
+    chunk_parser = ChunkParser(ju.map, fmt = 'csv', csv_delim = ',')
+    sinks = {nm: asyncpg_copy_sink(conn, nm, schema_name = 'gap') for nm in chunk_parser.table_names}
+    await parse_async(records, chunk_parser, sinks, executor = process_executor(chunk_parser, 4))
+
+Functions
+---------
+"""
+import asyncio
+import threading
+
+from jsonparse.stream import _init_worker, _parse_in_worker, worker_context
+
+def process_executor(chunk_parser, workers=2):
+    """
+    *process pool for parse_async*
+
+    * each worker process gets *chunk_parser* once (not with each chunk); forked where it can be, so it
+      inherits the map (see stream.worker_context)
+    * statistics and unmapped paths of workers are added into *chunk_parser* by **parse_async**
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(workers, mp_context = worker_context(), initializer = _init_worker,
+                               initargs = (chunk_parser,))
+
+def asyncpg_copy_sink(conn, table_name, schema_name=None, fmt='csv', csv_delim=',', columns=None):
+    """
+    *sink which loads lines into PostgreSQL table with asyncpg COPY*
+
+    * *conn* is asyncpg connection (asyncpg is not needed by jsonparse itself)
+    * *fmt* and *csv_delim* must be same as **ChunkParser** ('csv' or 'text')
+    * *columns*: column names of table, like stream.table_columns; None for all columns in DDL order
+    """
+    import io
+    async def sink(lines):
+        data = ''.join(f"{line}\n" for line in lines).encode('utf-8')
+        await conn.copy_to_table(table_name, source = io.BytesIO(data), schema_name = schema_name,
+                                 columns = columns, format = fmt, delimiter = csv_delim)
+    return sink
+
+async def parse_async(records, chunk_parser, sinks, chunk_size=1000, executor=None, queue_size=4,
+                      default_sink=None, first_index=0):
+    """
+    *parse async iterator of records into async sinks*
+
+    * *records*: async iterator of JSON strings (or bytes), one record each
+    * *chunk_parser*: stream.ChunkParser
+    * *sinks*: {table name: coroutine function(lines)}; table not in *sinks* goes to *default_sink*
+      (coroutine function(table name, lines)), or ValueError if it is None
+    * *executor*: None for default thread pool of loop, or other thread pool: one chunk is parsed at a time
+      (ChunkParser is not thread safe), but I/O of event loop goes on; **process_executor**: chunks in parallel
+    * at most *queue_size* chunks are parsed or wait for sinks; sinks of one chunk run at the same time,
+      chunks are sent in input order
+    * *first_index*: index of first record (for txn id with txn seed)
+    * return number of records
+    """
+    loop = asyncio.get_running_loop()
+    # by class name: no import of multiprocessing when executor is thread pool
+    in_process = executor is not None and type(executor).__name__ == 'ProcessPoolExecutor'
+    pending = asyncio.Queue(maxsize = queue_size) # futures of parsed chunks, in input order
+    count = [first_index]
+    lock = threading.Lock()
+
+    def parse_in_thread(lines, idx):
+        with lock:
+            return (chunk_parser(lines, idx), None)
+
+    async def submit(chunk):
+        if in_process:
+            fut = loop.run_in_executor(executor, _parse_in_worker, chunk, count[0])
+        else:
+            fut = loop.run_in_executor(executor, parse_in_thread, chunk, count[0])
+        count[0] += len(chunk)
+        await pending.put(fut)
+
+    async def read():
+        try:
+            chunk = []
+            async for raw in records:
+                chunk.append(raw)
+                if len(chunk) >= chunk_size:
+                    await submit(chunk)
+                    chunk = []
+            if len(chunk) > 0:
+                await submit(chunk)
+        except BaseException:
+            # error or cancel: no wait for room in full queue, send loop sees reader is done
+            if not pending.full():
+                pending.put_nowait(None)
+            raise
+        await pending.put(None) # end of records
+
+    async def send(tblIdx, lines):
+        tbl_name = chunk_parser.table_names[tblIdx]
+        sink = sinks.get(tbl_name, None)
+        if sink is not None:
+            await sink(lines)
+        elif default_sink is not None:
+            await default_sink(tbl_name, lines)
+        else:
+            raise ValueError(f"no sink for table {tbl_name}")
+
+    reader = asyncio.ensure_future(read())
+    try:
+        while not (reader.done() and pending.empty()):
+            fut = await pending.get()
+            if fut is None:
+                break
+            (parsed, report) = await fut
+            if report is not None:
+                parsed = chunk_parser.merge_report(report, parsed)
+            with chunk_parser.stats.stage('write'):
+                await asyncio.gather(*(send(tblIdx, lines) for tblIdx, lines in parsed.items() if len(lines) > 0))
+        await reader # raise error of reading
+    finally:
+        if not reader.done():
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions = True)
+    return count[0] - first_index
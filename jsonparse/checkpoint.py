@@ -0,0 +1,126 @@
+"""
+The parse checkpoint
+====================
+
+- **File name**: checkpoint.py
+- **Arthor**: Luke Du
+- **Purpose**: Resume a long streaming parse where it stopped.
+
+A checkpoint file (JSON) is written after every few chunks of the streaming
+parse (see stream.parse_stream). It keeps:
+
+* position of input: index of input file and byte offset after last parsed line
+* number of parsed records: the next txn id (uuid) is generated from it
+* seed of txn id generator (see stream.txn_id)
+* size of each table output file
+* unmapped paths with count
+* with deduplication, name of file of seen keys (see dedup.Deduplicator.save), written before the checkpoint
+
+Output files are flushed to disk before the checkpoint file is replaced
+(write temporary file, then rename), so the checkpoint always points to
+complete output. When the run is started again with same checkpoint file,
+rows written after the last checkpoint are cut off, input is read from the
+saved offset, and the output is same as one run without stop.
+
+Checkpoint CLASS
+----------------
+"""
+import os
+import json
+
+CHECKPOINT_VERSION = 1
+
+class Checkpoint(object):
+    """
+    **variable member initialization in __init__ function**
+
+    - **path**: checkpoint file
+    - **inputs**: input file names; resume with other inputs is error
+    - **every**: save checkpoint after this number of chunks
+    - **position**: (input file index, byte offset) where parsing starts
+    - **records**: number of records before **position**
+    - **txn_seed**: seed of txn id generator
+    - **tables**: table name to size of output file
+    - **unmapped**: unmapped paths with count
+    - **dedup_file**: file of seen keys of deduplication at **position**, None if run has no deduplication
+    - **done**: whole input is parsed
+    """
+    def __init__(self, path, inputs, every=10, txn_seed=None):
+        if '-' in inputs:
+            raise ValueError("standard input can not be resumed, checkpoint needs input files")
+        self.path = path
+        self.inputs = list(inputs)
+        self.every = every
+        self.position = (0, 0)
+        self.records = 0
+        self.txn_seed = txn_seed
+        self.tables = dict()
+        self.unmapped = dict()
+        self.dedup_file = None
+        self.done = False
+
+    def load(self):
+        """
+        *load checkpoint file if it exists*
+
+        * return True when resume from checkpoint, False for new run
+        * new run without *txn_seed* gets random seed
+        """
+        if not os.path.exists(self.path):
+            if self.txn_seed is None:
+                import uuid
+                self.txn_seed = str(uuid.uuid4())
+            return False
+        with open(self.path, 'r') as f:
+            state = json.load(f)
+        if state.get("version", None) != CHECKPOINT_VERSION:
+            raise ValueError(f"checkpoint {self.path} has unknown version {state.get('version', None)}")
+        if state["inputs"] != self.inputs:
+            raise ValueError(f"checkpoint {self.path} is for inputs {state['inputs']}, not {self.inputs}")
+        if self.txn_seed is not None and self.txn_seed != state["txnSeed"]:
+            raise ValueError(f"checkpoint {self.path} has txn seed {state['txnSeed']}, not {self.txn_seed}")
+        self.position = tuple(state["position"])
+        self.records = state["records"]
+        self.txn_seed = state["txnSeed"]
+        self.tables = state["tables"]
+        self.unmapped = state["unmapped"]
+        self.dedup_file = state.get("dedupFile", None)
+        self.done = state["done"]
+        return True
+
+    def commit(self, writer, position, records, unmapped, done=False, dedup=None):
+        """
+        *save checkpoint*
+
+        * flush output files of *writer* (stream.TableWriter) to disk first
+        * *dedup* (dedup.Deduplicator): save its seen keys into new file (name has *records*), checkpoint refers to it
+        * then replace checkpoint file in one step (rename); file of seen keys of previous checkpoint is removed
+        """
+        self.tables = writer.sync()
+        old_dedup_file = self.dedup_file
+        if dedup is not None:
+            self.dedup_file = f"{self.path}.dedup.{records}"
+            dedup.save(self.dedup_file)
+        self.position = tuple(position)
+        self.records = records
+        self.unmapped = dict(unmapped)
+        self.done = done
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "inputs": self.inputs,
+            "position": list(self.position),
+            "records": self.records,
+            "txnSeed": self.txn_seed,
+            "tables": self.tables,
+            "unmapped": self.unmapped,
+            "dedupFile": self.dedup_file,
+            "done": self.done,
+        }
+        tmp_file = f"{self.path}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f, indent = 4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.path)
+        if old_dedup_file is not None and old_dedup_file != self.dedup_file and os.path.exists(old_dedup_file):
+            os.remove(old_dedup_file)
@@ -0,0 +1,471 @@
+"""
+The command line tool
+=====================
+
+- **File name**: cli.py
+- **Arthor**: Luke Du
+- **Purpose**: Run map generation, map update and parsing from shell.
+
+The command `jsonparse` (or `python -m jsonparse`) has sub commands:
+
+* **plan**: go through data, write map (JSON, CSV or binary format) and postgres DDL
+* **evolve**: add new paths in data to existing map
+* **parse**: parse JSON lines from files or standard input into one output per table
+* **serve**: long running parse service, maps and worker pools stay warm between batches (see service module)
+
+Map format is decided by file extension: '.csv' for CSV map, '.bin' for binary map,
+others for JSON map. Input file '-' is standard input; '.gz' files are decompressed;
+folder and glob pattern give sorted file list (see ingest.expand_inputs).
+
+Examples::
+
+    jsonparse plan --map ex.map --ddl ex.sql --schema gap --prefix ex_ data.jsonl
+    jsonparse evolve --map ex.map --out ex_v2.map new.jsonl
+    zcat data.jsonl.gz | jsonparse parse --map ex.map --out-dir parsed --workers 4
+    jsonparse serve --feed sales=ex.map --socket /tmp/jsonparse.sock
+
+Functions
+---------
+"""
+import sys
+import argparse
+
+def load_map(ju, map_file):
+    """
+    *load map into JsonUtils by file extension*
+    """
+    if map_file.endswith('.csv'):
+        ju.map_import_csv(map_csv = map_file)
+    elif map_file.endswith('.bin'):
+        ju.map_import_bin(map_bin = map_file)
+    else:
+        ju.json_map_import(map_file = map_file)
+
+def save_map(ju, map_file):
+    """
+    *save map of JsonUtils by file extension*
+    """
+    if map_file.endswith('.csv'):
+        ju.map_export_csv(map_csv = map_file)
+    elif map_file.endswith('.bin'):
+        ju.map_export_bin(map_bin = map_file)
+    else:
+        ju.json_map_export(map_file = map_file)
+
+def write_ddl(ju, args):
+    """
+    *save DDL of map if --ddl is given*
+    """
+    if args.ddl is not None:
+        ju.postgres_ddl(sql_file = args.ddl, schema_name = args.schema, primary_key = args.primary_key,
+                        parent_index = args.parent_index, post_load_file = args.post_load_ddl, unlogged = args.unlogged)
+    if args.delta_sql is not None:
+        ju.postgres_delta_sql(sql_file = args.delta_sql, schema_name = args.schema, staging_schema = args.staging_schema)
+
+def cmd_plan(args):
+    """
+    *sub command plan*
+
+    * compute all paths chunk by chunk, create map, save map and DDL
+    """
+    from jsonparse.jsonutils import JsonUtils
+    from jsonparse.stream import iter_records, stream_paths
+    ju = JsonUtils(csv_delim = args.delim, table_name_prefix = args.prefix)
+    records = iter_records(args.inputs, args.input_format, args.readahead, args.readahead_mb * 1024 * 1024)
+    dynamic = set()
+    (ju.pathlist, ju.arraylist) = stream_paths(records, ju.flag_json_array, args.chunk_size,
+                                               array_lengths = ju.array_max_length, key_threshold = args.dynamic_keys,
+                                               max_memory_paths = args.spill_paths, dynamic = dynamic)
+    ju.dynamiclist = sorted(dynamic)
+    ju.table_plan_json(extras_column = args.extras_column, flatten = parse_flatten(args.flatten),
+                       max_positions = args.max_positions)
+    ju.split_wide_tables(max_columns = args.max_columns)
+    save_map(ju, args.map)
+    for map_file in args.also_map or []:
+        save_map(ju, map_file)
+    write_ddl(ju, args)
+    return 0
+
+def cmd_evolve(args):
+    """
+    *sub command evolve*
+
+    * add new paths in data to map; new array (table) is not supported
+    """
+    from jsonparse.jsonutils import JsonUtils
+    from jsonparse.stream import iter_records, stream_paths
+    from jsonparse.log import logger
+    ju = JsonUtils(csv_delim = args.delim)
+    load_map(ju, args.map)
+    ju.map_to_allpath()
+    records = iter_records(args.inputs, args.input_format, args.readahead, args.readahead_mb * 1024 * 1024)
+    (pathlist, arraylist) = stream_paths(records, ju.flag_json_array, args.chunk_size,
+                                         key_threshold = args.dynamic_keys, max_memory_paths = args.spill_paths,
+                                         dynamic = set(ju.dynamiclist))
+    new_arrays = [a for a in arraylist if a not in set(ju.map_array)]
+    if len(new_arrays) > 0:
+        logger.error(f"New arrays in data, please run plan again: {new_arrays}")
+        return 1
+    map_path = set(ju.map_path)
+    new_paths = [p for p in pathlist if p not in map_path]
+    logger.info(f"Add {len(new_paths)} new paths to map.")
+    ju.add_new_path_to_map(new_paths)
+    ju.split_wide_tables(max_columns = args.max_columns)
+    save_map(ju, args.out or args.map)
+    write_ddl(ju, args)
+    return 0
+
+def cmd_parse(args):
+    """
+    *sub command parse*
+
+    * read JSON lines chunk by chunk, parse in *workers* processes, write each table to its own file
+    * with *args.checkpoint*, save checkpoint while parsing; run again to resume (see checkpoint.Checkpoint)
+    """
+    from jsonparse.jsonutils import JsonUtils
+    from jsonparse.stream import ChunkParser, TableWriter, PartitionedWriter, parse_stream
+    ju = JsonUtils(csv_delim = args.delim, table_name_prefix = args.prefix)
+    if args.stats is not None or args.profile:
+        ju.enable_stats(profile = args.profile)
+    load_map(ju, args.map)
+    columns = parse_columns(args.columns)
+    checkpoint = None
+    txn_seed = args.txn_seed
+    if args.checkpoint is not None:
+        from jsonparse.checkpoint import Checkpoint
+        checkpoint = Checkpoint(args.checkpoint, args.inputs, every = args.checkpoint_every, txn_seed = txn_seed)
+        if checkpoint.load():
+            from jsonparse.log import logger
+            logger.info(f"Resume from checkpoint {args.checkpoint}: {checkpoint.records} records done.")
+        txn_seed = checkpoint.txn_seed
+    delta = None
+    if args.delta_index is not None:
+        from jsonparse.delta import DeltaFilter
+        with UsageCheck():
+            delta = DeltaFilter(args.delta_index, args.delta_key)
+    dedup = None
+    if args.dedup is not None:
+        from jsonparse.dedup import Deduplicator
+        with UsageCheck():
+            dedup = Deduplicator(key_paths = [p for p in args.dedup if p != 'content'], method = args.dedup_method,
+                                 capacity = args.dedup_capacity, error_rate = args.dedup_error_rate)
+    with UsageCheck():
+        chunk_parser = ChunkParser(ju.map, ju.get_map_index(), fmt = args.format, csv_delim = args.delim,
+                                   stats = ju.stats, unmapped = args.unmapped, overflow_table = ju.overflow_table_name(),
+                                   tables = args.tables, columns = columns,
+                                   record_filter = ju.make_record_filter(parse_where(args.where)), txn_seed = txn_seed,
+                                   on_error = args.on_error, dead_letter_table = ju.dead_letter_table_name(),
+                                   partition_by = args.partition_by, delta = delta)
+    writer_options = dict(fmt = args.format, csv_delim = args.delim, header = args.header,
+                          overflow_table = ju.overflow_table_name(), tables = args.tables, columns = columns,
+                          dead_letter_table = ju.dead_letter_table_name())
+    if args.partition_by is None:
+        writer = TableWriter(args.out_dir, ju.map, **writer_options)
+    else:
+        writer = PartitionedWriter(args.out_dir, ju.map, partition_name = ju.root_column_name(args.partition_by),
+                                   max_file_bytes = args.max_file_mb * 1024 * 1024,
+                                   max_open_files = args.max_open_files, **writer_options)
+    with writer:
+        parse_stream(args.inputs, chunk_parser, writer, chunk_size = args.chunk_size, workers = args.workers,
+                     checkpoint = checkpoint, stats = ju.stats, readahead = args.readahead,
+                     max_bytes = args.readahead_mb * 1024 * 1024, dedup = dedup, start_method = args.start_method,
+                     chunk_bytes = args.chunk_bytes, chunk_rows = args.chunk_rows)
+    if delta is not None:
+        delta.close()
+    write_stats(ju.stats, args)
+    if len(chunk_parser.unmapped) > 0:
+        from jsonparse.log import logger
+        logger.warning(f"{len(chunk_parser.unmapped)} paths not in map: {chunk_parser.unmapped}")
+    return 0
+
+def cmd_serve(args):
+    """
+    *sub command serve*
+
+    * answer batch requests on standard input (default) or *args.socket* until shutdown request or end of input
+    """
+    from jsonparse.service import ParseService
+    feeds = dict(feed.split('=', 1) for feed in args.feeds or [])
+    stats = None
+    if args.stats is not None:
+        from jsonparse.stats import ParseStats
+        stats = ParseStats()
+    with UsageCheck():
+        service = ParseService(feeds, max_maps = args.max_maps, workers = args.workers, fmt = args.format,
+                               csv_delim = args.delim, chunk_size = args.chunk_size, start_method = args.start_method,
+                               unmapped = args.unmapped, on_error = args.on_error, stats = stats,
+                               out_root = args.out_root)
+    with service:
+        if args.socket is None:
+            service.serve()
+        else:
+            service.serve_socket(args.socket, allow_remote = args.allow_remote)
+    if stats is not None:
+        write_stats(stats, args)
+    return 0
+
+def parse_flatten(flatten_args):
+    """
+    *flattened arrays from command line*
+
+    * each of *flatten_args* is 'array.path=mode' (mode positional, delimited or json)
+    * return {array path: mode}, or None
+    """
+    if not flatten_args:
+        return None
+    flatten = dict()
+    for e in flatten_args:
+        (path, sep, mode) = e.rpartition('=')
+        if len(sep) == 0:
+            raise ValueError(f"--flatten needs array.path=mode, not {e}")
+        from jsonparse.jsonutils import FLATTEN_MODES
+        if mode not in FLATTEN_MODES:
+            raise ValueError(f"--flatten mode must be one of {FLATTEN_MODES}, not {mode}")
+        flatten[path] = mode
+    return flatten
+
+def option_type(parse):
+    """
+    *argparse type of one value of repeated option, checked by* parse *(like* **parse_where** *)*
+
+    * ValueError of *parse* is usage error of argparse (exit code 2); value is kept as string
+    """
+    import argparse
+    def check(value):
+        try:
+            parse([value])
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+        return value
+    return check
+
+class UsageError(Exception):
+    """
+    *bad option value found when sub command is set up (like where path not in map)*
+
+    * **main** reports it with usage, exit code 2
+    """
+
+class UsageCheck(object):
+    """
+    *context of sub command set up*
+
+    * ValueError (other than JsonParseError of data or map) raised inside is raised as **UsageError**
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        from jsonparse.errors import JsonParseError
+        if exc_type is not None and issubclass(exc_type, ValueError) and not issubclass(exc_type, JsonParseError):
+            raise UsageError(str(exc_value)) from exc_value
+        return False
+
+def parse_columns(column_args):
+    """
+    *selected columns from command line*
+
+    * each of *column_args* is 'table:column1,column2'
+    * return {table name: list of column names}, or None
+    """
+    if not column_args:
+        return None
+    columns = dict()
+    for e in column_args:
+        (tbl_name, sep, clm_names) = e.partition(':')
+        if len(sep) == 0:
+            raise ValueError(f"--columns must be table:column1,column2, not {e}")
+        columns.setdefault(tbl_name, []).extend(c for c in clm_names.split(',') if len(c) > 0)
+    return columns
+
+def parse_where(where_args):
+    """
+    *record filter conditions from command line*
+
+    * each of *where_args* is 'path operator value', like 'store==3', 'date>=2021-07-01', 'store in [1,2]'
+    * operator is one of FILTER_OPERATORS of jsonutils ('=' is same as '==')
+    * value is JSON (number, list, quoted string), or string if it is not JSON
+    * return list of (path, operator, value), or None
+    """
+    if not where_args:
+        return None
+    import re
+    import json
+    where = []
+    for e in where_args:
+        m = re.match(r'^\s*([^\s=!<>]+)\s*(==|!=|<=|>=|=|<|>|\snot\s+in\s|\sin\s)\s*(.*?)\s*$', e)
+        if m is None:
+            raise ValueError(f"--where must be like 'store==3', not {e}")
+        (path, op, value) = m.groups()
+        op = ' '.join(op.split())
+        op = '==' if op == '=' else op
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass # plain string
+        where.append((path, op, value))
+    return where
+
+def write_stats(stats, args):
+    """
+    *write statistics and profile report*
+
+    * *args.stats* file: Prometheus text format if ends with '.prom', else JSON
+    * *args.profile*: cProfile report to standard error
+    """
+    if args.stats is not None:
+        mystr = stats.to_prometheus() if args.stats.endswith('.prom') else stats.to_json(indent = 4)
+        with open(args.stats, 'w') as f:
+            f.write(mystr)
+    if args.profile:
+        sys.stderr.write(stats.profile_report())
+
+def build_parser():
+    """
+    *argument parser of command line*
+    """
+    parser = argparse.ArgumentParser(prog = 'jsonparse', description = 'Parse JSON data into tables using JSON format map.')
+    sub = parser.add_subparsers(dest = 'command')
+
+    def add_common(p):
+        p.add_argument('inputs', nargs = '*', default = ['-'],
+                       help = "input files, folders or glob patterns (sorted), '-' for standard input (default)")
+        p.add_argument('--map', required = True, help = "map file (.map/.json, .csv or .bin)")
+        p.add_argument('--chunk-size', type = int, default = 1000, help = "records per chunk (default 1000)")
+        p.add_argument('--delim', default = '|', help = "column delimiter of output (default '|')")
+        p.add_argument('--readahead', type = int, default = 0, help = "read this number of next files in threads (default 0: off)")
+        p.add_argument('--readahead-mb', type = int, default = 256, help = "size limit of files read ahead in MB (default 256)")
+
+    def add_ddl(p):
+        p.add_argument('--ddl', help = "postgres DDL file")
+        p.add_argument('--schema', default = 'default_schema', help = "schema name in DDL")
+        p.add_argument('--max-columns', type = int, default = 1600,
+                       help = "split wider tables into tables sharing uuid and sequence keys (default 1600, PostgreSQL limit)")
+        p.add_argument('--primary-key', action = 'store_true', help = "primary key (uuid, seq_...) of each table")
+        p.add_argument('--parent-index', action = 'store_true', help = "index on parent key of child tables (without --primary-key)")
+        p.add_argument('--post-load-ddl', help = "write keys and indexes into this file, to run after bulk load")
+        p.add_argument('--unlogged', action = 'store_true', help = "create UNLOGGED (staging) tables")
+        p.add_argument('--delta-sql', help = "write delta load script (delete + insert by txn id) into this file")
+        p.add_argument('--staging-schema', default = 'staging', help = "schema of staging tables in delta load script")
+
+    def add_discover(p):
+        p.add_argument('--dynamic-keys', type = int,
+                       help = "object with more distinct keys than this is key/value table (default: off)")
+        p.add_argument('--spill-paths', type = int, help = "spill distinct paths to disk over this number (default: off)")
+
+    p = sub.add_parser('plan', help = 'create map and DDL from data')
+    add_common(p)
+    p.add_argument('--input-format', choices = ('ndjson', 'json'), default = 'ndjson', help = "JSON lines or JSON list")
+    p.add_argument('--also-map', action = 'append', help = "save map also to this file (other format), can repeat")
+    p.add_argument('--prefix', default = '', help = "table name prefix")
+    add_ddl(p)
+    add_discover(p)
+    p.add_argument('--flatten', action = 'append', type = option_type(parse_flatten),
+                   help = "array.path=mode: array as columns of parent table (positional, delimited or json); can repeat")
+    p.add_argument('--max-positions', type = int, help = "at most this number of positions for positional arrays")
+    p.add_argument('--extras-column', help = "add jsonb column with this name to each table for values not in map")
+    p.set_defaults(func = cmd_plan)
+
+    p = sub.add_parser('evolve', help = 'add new paths in data to map')
+    add_common(p)
+    p.add_argument('--input-format', choices = ('ndjson', 'json'), default = 'ndjson', help = "JSON lines or JSON list")
+    p.add_argument('--out', help = "new map file (default: overwrite --map)")
+    add_ddl(p)
+    add_discover(p)
+    p.set_defaults(func = cmd_evolve)
+
+    p = sub.add_parser('parse', help = 'parse JSON lines into table files')
+    add_common(p)
+    p.add_argument('--out-dir', default = '-', help = "output folder, '-' for standard output (default)")
+    p.add_argument('--format', choices = ('text', 'csv', 'jsonl'), default = 'text', help = "output format (default text)")
+    p.add_argument('--header', action = 'store_true', help = "column names as first line of csv output")
+    p.add_argument('--workers', type = int, default = 1, help = "worker processes (default 1)")
+    p.add_argument('--start-method', choices = ('fork', 'spawn', 'forkserver'),
+                   help = "start method of worker processes (default fork where it can be used: workers inherit map)")
+    chunk_by = p.add_mutually_exclusive_group()
+    chunk_by.add_argument('--chunk-bytes', type = int,
+                          help = "also cut chunk at this size of lines, so huge records make small chunks (default: off)")
+    chunk_by.add_argument('--chunk-rows', type = int,
+                          help = "also cut chunk at this number of estimated rows (objects in lines) (default: off)")
+    p.add_argument('--unmapped', choices = ('fail', 'skip', 'overflow'), default = 'fail',
+                   help = "data path not in map: stop, ignore, or store into overflow table (default fail)")
+    p.add_argument('--on-error', choices = ('raise', 'quarantine'), default = 'raise',
+                   help = "bad record (invalid JSON, path not in map with --unmapped fail): stop, or put into dead letter table")
+    p.add_argument('--prefix', default = '', help = "table name prefix of overflow and dead letter tables")
+    p.add_argument('--table', dest = 'tables', action = 'append', help = "parse this table only (default all tables); can repeat")
+    p.add_argument('--columns', action = 'append', type = option_type(parse_columns), help = "parse these columns only, table:column1,column2; can repeat")
+    p.add_argument('--where', action = 'append', type = option_type(parse_where), help = "parse records with this root table condition only, like 'store==3'; can repeat")
+    p.add_argument('--partition-by', help = "root table path (like date): write table/<column>=<value>/part-N files")
+    p.add_argument('--max-file-mb', type = int, default = 128, help = "with --partition-by, start next part file after this size (default 128)")
+    p.add_argument('--max-open-files', type = int, default = 64, help = "with --partition-by, open files at most (default 64)")
+    p.add_argument('--delta-index', help = "SQLite hash index: parse new and changed records only (needs --delta-key)")
+    p.add_argument('--delta-key', action = 'append', help = "path of record key for --delta-index, like txn.id; can repeat")
+    p.add_argument('--dedup', action = 'append',
+                   help = "drop records with same value of this path (like txn.id; can repeat), 'content' for same line")
+    p.add_argument('--dedup-method', choices = ('exact', 'bloom'), default = 'exact',
+                   help = "exact set (default), or Bloom filter with fixed memory for large runs")
+    p.add_argument('--dedup-capacity', type = int, default = 10_000_000, help = "records expected by Bloom filter (default 10000000)")
+    p.add_argument('--dedup-error-rate', type = float, default = 1e-6, help = "false positive rate of Bloom filter (default 1e-6)")
+    p.add_argument('--txn-seed', help = "uuid as seed of txn ids: same ids in each run (default random ids)")
+    p.add_argument('--checkpoint', help = "checkpoint file: save progress, resume when run again (needs --out-dir)")
+    p.add_argument('--checkpoint-every', type = int, default = 10, help = "save checkpoint after this number of chunks (default 10)")
+    p.add_argument('--stats', help = "write timers and counters to this file (.prom: Prometheus text, else JSON)")
+    p.add_argument('--profile', action = 'store_true', help = "run stages under cProfile, report to standard error")
+    p.set_defaults(func = cmd_parse)
+
+    p = sub.add_parser('serve', help = 'parse batch requests with maps and workers kept warm')
+    p.add_argument('--feed', dest = 'feeds', action = 'append',
+                   help = "name=map_file of feed; can repeat (requests can use these feeds only)")
+    p.add_argument('--socket', help = "Unix socket path or host:port to listen on (default: standard input/output)")
+    p.add_argument('--allow-remote', action = 'store_true',
+                   help = "TCP socket can listen on other than loopback address (requests are not authenticated)")
+    p.add_argument('--out-root', help = "folder of out_dir of requests (default: requests can not write files)")
+    p.add_argument('--max-maps', type = int, default = 8, help = "maps kept warm, least recently used are closed (default 8)")
+    p.add_argument('--chunk-size', type = int, default = 1000, help = "records per chunk (default 1000)")
+    p.add_argument('--delim', default = '|', help = "column delimiter of output (default '|')")
+    p.add_argument('--format', choices = ('text', 'csv', 'jsonl'), default = 'csv', help = "output format, 'text' is not escaped for COPY (default csv)")
+    p.add_argument('--workers', type = int, default = 1, help = "worker processes of each warm map (default 1)")
+    p.add_argument('--start-method', choices = ('fork', 'spawn', 'forkserver'),
+                   help = "start method of worker processes (default fork where it can be used: workers inherit map)")
+    p.add_argument('--unmapped', choices = ('fail', 'skip', 'overflow'), default = 'fail',
+                   help = "data path not in map: fail batch, ignore, or store into overflow table (default fail)")
+    p.add_argument('--on-error', choices = ('raise', 'quarantine'), default = 'raise',
+                   help = "bad record: fail batch, or put into dead letter table")
+    p.add_argument('--stats', help = "at shutdown, write timers and counters to this file (.prom: Prometheus text, else JSON)")
+    p.set_defaults(func = cmd_serve, profile = False)
+    return parser
+
+def main(argv=None):
+    """
+    *entry of command line tool*
+
+    * return exit code; 1 when JsonParseError (see errors module) is raised
+    * bad option values exit with code 2 and usage (argparse), also those found when sub command is set up
+      (**UsageError**)
+    """
+    from jsonparse.errors import JsonParseError
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    if getattr(args, 'delta_index', None) is not None and not args.delta_key:
+        parser.error("--delta-index needs --delta-key")
+    if getattr(args, 'dedup', None) is not None and 'content' in args.dedup and len(args.dedup) > 1:
+        parser.error("--dedup content can not be used with key paths")
+    if any('=' not in feed for feed in getattr(args, 'feeds', None) or []):
+        parser.error("--feed should be name=map_file")
+    from jsonparse.ingest import expand_inputs
+    if hasattr(args, 'inputs'):
+        args.inputs = expand_inputs(args.inputs)
+    try:
+        return args.func(args)
+    except UsageError as e:
+        parser.error(str(e))
+    except JsonParseError as e:
+        from jsonparse.log import logger
+        logger.error(f"{type(e).__name__}: {e}")
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
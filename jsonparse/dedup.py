@@ -0,0 +1,205 @@
+"""
+The record deduplication
+========================
+
+- **File name**: dedup.py
+- **Arthor**: Luke Du
+- **Purpose**: Drop duplicated records before parsing.
+
+Records sent twice by upstream would be parsed twice, with different txn ids
+(uuid), so the duplicates can not be found in database later.
+**Deduplicator** drops a record when its key was seen before in this run:
+
+* key is value of key paths (like 'txn.id'), or hash of whole content when no key path is given
+* method 'exact': set of key hashes (16 bytes each), no false positive; for small runs
+* method 'bloom': **BloomFilter**, fixed memory for *capacity* keys; a new record is dropped with
+  probability *error_rate* (false positive), duplicates are always dropped; for runs of hundreds of
+  millions of records
+* dropped records are counted as 'duplicates' in statistics
+
+Used by **JsonUtils.parse_use_pool**, **JsonUtils.parse_to_csv** and
+stream.parse_stream (command line option --dedup). In streaming parse it runs
+in main process on lines: content hash is of the line text (no decode), key
+paths need decode of each line. With a checkpoint, seen keys are saved with
+it (see **Deduplicator.save**, checkpoint.Checkpoint.commit), so a resumed run
+drops the same records as one run without stop.
+
+Functions and CLASS
+-------------------
+"""
+import os
+import math
+import hashlib
+
+DEDUP_METHODS = ('exact', 'bloom')
+
+class ExactSet(object):
+    """
+    *set of key hashes*
+
+    * **add**: add hash, return True if it was in set already
+    """
+    def __init__(self):
+        self.keys = set()
+
+    def add(self, digest):
+        if digest in self.keys:
+            return True
+        self.keys.add(digest)
+        return False
+
+    def __len__(self):
+        return len(self.keys)
+
+class BloomFilter(object):
+    """
+    *Bloom filter of key hashes*
+
+    * *capacity*: expected number of distinct keys; *error_rate*: false positive rate at *capacity*
+    * bits: -capacity * ln(error_rate) / ln(2)^2, bytes are bits / 8; hash functions: bits / capacity * ln(2)
+    * positions come from 16 bytes hash (two 64 bit numbers, double hashing)
+    * **add**: add hash, return True if it was probably added before
+    """
+    def __init__(self, capacity=10_000_000, error_rate=1e-6):
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError("capacity must be positive and error_rate between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bit_count = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.bit_count / capacity * math.log(2))))
+        self.bits = bytearray((self.bit_count + 7) // 8)
+        self.count = 0
+
+    def add(self, digest):
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        bits = self.bits
+        seen = True
+        for i in range(self.hash_count):
+            pos = (h1 + i * h2) % self.bit_count
+            mask = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask:
+                bits[pos >> 3] |= mask
+                seen = False
+        if not seen:
+            self.count += 1
+        return seen
+
+    def __len__(self):
+        return self.count
+
+class Deduplicator(object):
+    """
+    **variable member initialization in __init__ function**
+
+    - **key_paths**: dotted paths of record key, None for hash of whole record
+    - **method**: one of DEDUP_METHODS
+    - **seen**: **ExactSet** or **BloomFilter** by **method**
+    - **duplicate_count**: number of dropped records
+    """
+    def __init__(self, key_paths=None, method='exact', capacity=10_000_000, error_rate=1e-6):
+        if method not in DEDUP_METHODS:
+            raise ValueError(f"method must be one of {DEDUP_METHODS}, not {method}")
+        self.key_paths = list(key_paths) if key_paths else None
+        self.key_tags = None if self.key_paths is None else [p.split('.') for p in self.key_paths]
+        self.method = method
+        self.seen = ExactSet() if method == 'exact' else BloomFilter(capacity, error_rate)
+        self.duplicate_count = 0
+
+    def record_digest(self, record):
+        """
+        * hash of key (or whole content) of JSON record; None if record has no key (never dropped)
+        """
+        from jsonparse.delta import record_digest, record_key
+        if self.key_tags is None:
+            return record_digest(record)
+        key = record_key(record, self.key_tags)
+        if key is None:
+            return None
+        return hashlib.blake2b(key.encode('utf-8'), digest_size = 16).digest()
+
+    def line_digest(self, line):
+        """
+        * hash of key (or whole line text) of JSON line; None if line has no key or is not valid JSON
+        """
+        if self.key_tags is None:
+            data = line.strip()
+            return hashlib.blake2b(data if isinstance(data, bytes) else data.encode('utf-8'), digest_size = 16).digest()
+        import json
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None # parser decides what to do
+        return self.record_digest(record)
+
+    def check(self, digest):
+        """
+        * True if *digest* was seen (record is dropped and counted), else remember it
+        """
+        if digest is None or not self.seen.add(digest):
+            return False
+        self.duplicate_count += 1
+        return True
+
+    def is_duplicate(self, record):
+        """
+        * True if key of JSON *record* was seen before
+        """
+        return self.check(self.record_digest(record))
+
+    def is_duplicate_line(self, line):
+        """
+        * True if key of JSON *line* was seen before
+        """
+        return self.check(self.line_digest(line))
+
+    def header(self):
+        """
+        * options and counts of state, first line of file of **save**
+        """
+        header = {"method": self.method, "keyPaths": self.key_paths, "keys": len(self.seen),
+                  "duplicates": self.duplicate_count}
+        if self.method == 'bloom':
+            header.update(capacity = self.seen.capacity, errorRate = self.seen.error_rate)
+        return header
+
+    def save(self, path):
+        """
+        *write seen keys to file*
+
+        * first line is JSON of **header**, then 16 bytes of each key ('exact') or bits of filter ('bloom')
+        * written to temporary file, flushed to disk, then renamed to *path*
+        """
+        import json
+        tmp_file = f"{path}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write((json.dumps(self.header()) + '\n').encode('utf-8'))
+            if self.method == 'exact':
+                for digest in self.seen.keys:
+                    f.write(digest)
+            else:
+                f.write(self.seen.bits)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+
+    def load(self, path):
+        """
+        *read seen keys from file of* **save**
+
+        * method, key paths (and size of Bloom filter) must be same as this one, else ValueError
+        """
+        import json
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline())
+            mine = self.header()
+            for k in ("method", "keyPaths", "capacity", "errorRate"):
+                if header.get(k, None) != mine.get(k, None):
+                    raise ValueError(f"dedup state {path} has {k} {header.get(k, None)}, not {mine.get(k, None)}")
+            data = f.read()
+        if self.method == 'exact':
+            self.seen.keys = set(data[i:i + 16] for i in range(0, len(data), 16))
+        else:
+            self.seen.bits = bytearray(data)
+            self.seen.count = header["keys"]
+        self.duplicate_count = header["duplicates"]
@@ -0,0 +1,265 @@
+"""
+The delta load
+==============
+
+- **File name**: delta.py
+- **Arthor**: Luke Du
+- **Purpose**: Parse only new and changed records when the same transactions are received again.
+
+Data often comes in overlapping windows: most records of today are same as
+yesterday. **DeltaFilter** keeps a hash of each record by its key (like
+'txn.id') in a local SQLite file, and before a record is parsed:
+
+* record hash is computed from canonical JSON (sorted keys), so order of keys does not matter
+* record with same hash as in the hash index is skipped (not parsed)
+* new and changed records are parsed; their txn id (uuid) comes from the key, same in each run
+* record without key is always parsed, with normal txn id
+
+Load with delete + insert: rows of a changed record replace all old rows with
+the same txn id (see **JsonUtils.postgres_delta_sql**). Hashes of parsed
+records are saved by **DeltaFilter.commit**, after the output is written
+(stream.parse_stream does it, with checkpoint too): if the run stops before,
+the records are parsed again in next run. Only records which gave rows are
+saved (see **DeltaFilter.confirm**): a record rejected by a where filter or put
+into dead letter table is not 'parsed', it is checked again in next run.
+
+One key must have one version in the output of a run (its rows share one
+txn id, the delete + insert replaces them all):
+
+* same key more than once in one call of **DeltaFilter.select** (whole data of **parse_use_pool**, or one
+  chunk of stream): only the last version is parsed, the others are 'superseded'
+* key already parsed in this run (earlier chunk, or other worker process, see stream.ChunkParser.merge_report):
+  its rows are written already, so the later version is 'repeated' and not parsed; the saved hash is of the
+  parsed version, so the later version is 'changed' when it comes again in next run
+
+Used by **JsonUtils.parse_use_pool** and stream.ChunkParser (command line
+option --delta-index and --delta-key).
+
+Functions and CLASS
+-------------------
+"""
+import json
+import uuid
+import hashlib
+
+DELTA_NAMESPACE = uuid.UUID('6f1c3e52-8d0b-5a8e-9c4f-2a7d1e0b6c93') # txn ids of keys
+DELTA_STATUSES = ('new', 'changed', 'unchanged', 'unkeyed', 'superseded', 'repeated')
+DELTA_SKIPPED = ('unchanged', 'superseded', 'repeated') # statuses of records which must not be parsed
+LOOKUP_BATCH = 500 # keys in one SQLite query
+
+def record_digest(record):
+    """
+    *stable hash of JSON record, as 16 bytes*
+
+    * hash of canonical JSON: sorted keys, no spaces; same record with other key order has same hash
+    """
+    data = json.dumps(record, sort_keys = True, separators = (',', ':'), ensure_ascii = False)
+    return hashlib.blake2b(data.encode('utf-8'), digest_size = 16).digest()
+
+def record_hash(record):
+    """
+    * **record_digest** as hex string
+    """
+    return record_digest(record).hex()
+
+def record_key(record, key_tags):
+    """
+    *key of record*
+
+    * *key_tags*: list of paths, each is list of keys
+    * return JSON list of values as string, None if any path is not in record (or value is null)
+    """
+    values = []
+    for tags in key_tags:
+        v = record
+        for tag in tags:
+            if not isinstance(v, dict) or tag not in v:
+                return None
+            v = v[tag]
+        if v is None:
+            return None
+        values.append(v)
+    return json.dumps(values, separators = (',', ':'), ensure_ascii = False)
+
+def key_txn_id(key):
+    """
+    * txn id (uuid) of record key, same in each run
+    """
+    return str(uuid.uuid5(DELTA_NAMESPACE, key))
+
+class DeltaFilter(object):
+    """
+    **variable member initialization in __init__ function**
+
+    - **index_path**: SQLite file of hash index (created if not exists)
+    - **key_paths**: dotted paths of record key, like ['txn.id'] or ['store', 'txn.no']
+    - **selected**: {position: (key, hash)} of new and changed records of last **select**, not confirmed yet
+    - **pending**: {key: hash} of records parsed (see **confirm**), not saved yet (see **commit**)
+    - **parsed_keys**: keys of records selected to parse in this run (until **commit** at end of run)
+
+    Can be sent to worker process: SQLite connection is opened in each process
+    at first use, and **pending** is not sent (see stream.ChunkParser.take_report).
+    """
+    def __init__(self, index_path, key_paths):
+        if len(key_paths) == 0:
+            raise ValueError("delta needs key paths of record")
+        self.index_path = index_path
+        self.key_paths = list(key_paths)
+        self.key_tags = [p.split('.') for p in key_paths]
+        self.selected = dict()
+        self.pending = dict()
+        self.parsed_keys = set()
+        self._conn = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_conn"] = None
+        state["selected"] = dict()
+        state["pending"] = dict()
+        state["parsed_keys"] = set()
+        return state
+
+    def connect(self):
+        """
+        * SQLite connection of this process, hash table is created at first use
+        """
+        if self._conn is None:
+            import sqlite3
+            self._conn = sqlite3.connect(self.index_path)
+            self._conn.execute("pragma journal_mode=wal") # readers in workers do not wait for writer
+            self._conn.execute("create table if not exists delta_hash (key text primary key, hash text not null)")
+            self._conn.commit()
+        return self._conn
+
+    def lookup(self, keys):
+        """
+        * saved hashes of *keys*: {key: hash}, keys not in index are not in it
+        """
+        conn = self.connect()
+        keys = list(keys)
+        found = dict()
+        for start in range(0, len(keys), LOOKUP_BATCH):
+            batch = keys[start:start + LOOKUP_BATCH]
+            marks = ','.join('?' * len(batch))
+            found.update(conn.execute(f"select key, hash from delta_hash where key in ({marks})", batch).fetchall())
+        return found
+
+    def select(self, records):
+        """
+        *check records against hash index*
+
+        * *records*: list of JSON records (None for record which can not be checked)
+        * return list of (status, txn id) by record: status is one of DELTA_STATUSES, txn id is None
+          for record without key; record with status in DELTA_SKIPPED must not be parsed
+        * same key and hash again in this process (before **commit**) is 'unchanged'
+        * same key again in *records*: the last one is checked, others are 'superseded'; key parsed before
+          in this run (**parsed_keys**) with other hash is 'repeated'
+        * hashes of 'new' and 'changed' records go to **selected**; call **confirm** with those which gave
+          rows, the others are dropped at next **select**
+        """
+        keyed = []
+        last = dict() # key -> index of its last record
+        for idx, js in enumerate(records):
+            key = None if js is None else record_key(js, self.key_tags)
+            if key is not None:
+                last[key] = idx
+            keyed.append(key)
+        keys = set(key for key in last if key not in self.pending)
+        saved = self.lookup(keys)
+        self.selected = dict()
+        result = []
+        for idx, key in enumerate(keyed):
+            if key is None:
+                result.append(('unkeyed', None))
+                continue
+            if last[key] != idx:
+                result.append(('superseded', key_txn_id(key)))
+                continue
+            hash_val = record_hash(records[idx])
+            old_hash = self.pending.get(key, None) or saved.get(key, None)
+            if old_hash == hash_val:
+                result.append(('unchanged', key_txn_id(key)))
+            elif key in self.parsed_keys:
+                result.append(('repeated', key_txn_id(key)))
+            else:
+                result.append(('new' if old_hash is None else 'changed', key_txn_id(key)))
+                self.selected[idx] = (key, hash_val)
+        return result
+
+    def confirm(self, positions):
+        """
+        *records of last* **select** *which are parsed*
+
+        * *positions*: indexes in records of **select** of records which gave rows; their hashes go to
+          **pending** and keys to **parsed_keys**
+        * other selected records (rejected by filter, put into dead letter table) are dropped: not saved,
+          checked again in next run
+        * return number of confirmed records
+        """
+        cnt = 0
+        for idx in positions:
+            if idx in self.selected:
+                (key, hash_val) = self.selected[idx]
+                self.pending[key] = hash_val
+                self.parsed_keys.add(key)
+                cnt += 1
+        self.selected = dict()
+        return cnt
+
+    def merge_pending(self, pending):
+        """
+        *add pending hashes of other process (like worker) into* **pending**
+
+        * keys parsed before in this run (by other chunk) keep their hash: return these keys ('repeated',
+          their rows must be dropped from output, see stream.ChunkParser.merge_report)
+        """
+        repeated = set()
+        for key, hash_val in pending.items():
+            if key in self.parsed_keys:
+                repeated.add(key)
+                continue
+            self.pending[key] = hash_val
+            self.parsed_keys.add(key)
+        return repeated
+
+    def take_pending(self):
+        """
+        * return **pending** and start new one (send from worker process to main process)
+        """
+        pending = self.pending
+        self.selected = dict()
+        self.pending = dict()
+        return pending
+
+    def commit(self, end_of_run=True):
+        """
+        *save hashes of parsed records into hash index*
+
+        * call after output of the records is written
+        * *end_of_run* False (like checkpoint of stream): keys parsed are still known to this run
+          (**parsed_keys**); True: next records are a new run
+        * return number of saved hashes
+        """
+        conn = self.connect()
+        conn.executemany("insert or replace into delta_hash (key, hash) values (?, ?)", self.pending.items())
+        conn.commit()
+        cnt = len(self.pending)
+        self.selected = dict()
+        self.pending = dict()
+        if end_of_run:
+            self.parsed_keys = set()
+        return cnt
+
+    def close(self):
+        """
+        * close SQLite connection (**pending** is not saved)
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
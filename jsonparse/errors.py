@@ -0,0 +1,71 @@
+"""
+The jsonparse errors
+====================
+
+- **File name**: errors.py
+- **Arthor**: Luke Du
+- **Purpose**: Exceptions raised by map generation and parsing.
+
+Errors are raised (not `exit()`), so a long running process (like a worker
+service) can catch them, keep going, and put the bad record aside (see
+*on_error* 'quarantine' of **JsonUtils.parse_use_pool**)::
+
+    JsonParseError (ValueError)
+    +-- DecodeError            data is not valid JSON
+    +-- MapError               map file can not be loaded, or map does not fit data
+    |   +-- MapMismatchError   data path does not belong to any table of map
+    |       +-- UnmappedPathError    data path is not in map (parse)
+    |           +-- UnmappedArrayError   array is not table of map
+    +-- UnsupportedDepthError  array level (or nesting) too deep for the method
+
+Exception CLASS
+---------------
+"""
+
+class JsonParseError(ValueError):
+    """
+    *base of jsonparse errors*
+
+    * **record_index**: index (from 0) of the record in this run, None if unknown
+    * **path**: data path (dotted), None if unknown
+    * **source**: file name or other source, None if unknown
+    """
+    def __init__(self, message, record_index=None, path=None, source=None):
+        self.record_index = record_index
+        self.path = path
+        self.source = source
+        super().__init__(message)
+
+class DecodeError(JsonParseError):
+    """
+    *data is not valid JSON*
+    """
+
+class MapError(JsonParseError):
+    """
+    *map file can not be loaded, or map does not fit data*
+    """
+
+class MapMismatchError(MapError):
+    """
+    *data path does not belong to any table of map*
+    """
+
+class UnmappedPathError(MapMismatchError):
+    """
+    *data path is not in map*
+
+    * raised when parse with *unmapped* 'fail'
+    """
+    def __init__(self, path, record_index=None):
+        super().__init__(f"path '{path}' of record {record_index} is not in map", record_index = record_index, path = path)
+
+class UnmappedArrayError(UnmappedPathError):
+    """
+    *array in data is not table of map*
+    """
+
+class UnsupportedDepthError(JsonParseError):
+    """
+    *array level or nesting of data is too deep for the method*
+    """
@@ -0,0 +1,139 @@
+"""
+The file ingestion
+==================
+
+- **File name**: ingest.py
+- **Arthor**: Luke Du
+- **Purpose**: Read many input files (like a folder of daily files) with read ahead in threads.
+
+Reading and decompressing files one by one leaves the CPU idle while waiting
+for disk. **Prefetcher** reads (and decodes) the next files in a thread pool
+while the current file is parsed:
+
+* files come out in the given (sorted) order, same result as reading one by one
+* *readahead*: number of files read at the same time
+* *max_bytes*: files waiting to be used are at most this size in memory, decompressed (at least one file is read)
+
+Used by **JsonUtils.load_from_files** and stream.iter_lines_at (command line option --readahead).
+
+Functions and CLASS
+-------------------
+"""
+import os
+import json
+
+from jsonparse.errors import DecodeError
+
+INPUT_PATTERNS = ('*.json', '*.jsonl', '*.ndjson', '*.json.gz', '*.jsonl.gz', '*.ndjson.gz') # files taken from folder
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+def expand_inputs(inputs, patterns=INPUT_PATTERNS):
+    """
+    *input file list from file names, folders and glob patterns*
+
+    * folder: files in it matching *patterns*, sorted by name
+    * name with '*', '?' or '[': glob pattern, sorted by name
+    * other names (and '-' for standard input) are kept
+    """
+    import glob
+    files = []
+    for e in inputs:
+        if e != '-' and os.path.isdir(e):
+            found = set()
+            for p in patterns:
+                found.update(glob.glob(os.path.join(e, p)))
+            files += sorted(found)
+        elif any(c in e for c in '*?['):
+            files += sorted(glob.glob(e))
+        else:
+            files.append(e)
+    return files
+
+def read_input_bytes(fn):
+    """
+    *whole file content as bytes*
+
+    * '.gz' file is decompressed
+    """
+    if fn.endswith('.gz'):
+        import gzip
+        with gzip.open(fn, 'rb') as f:
+            return f.read()
+    with open(fn, 'rb') as f:
+        return f.read()
+
+def input_size(fn):
+    """
+    *size of file content in memory (as read by read_input_bytes)*
+
+    * '.gz' file: decompressed size from gzip trailer (size modulo 4 GiB of the last member, so
+      at least size on disk is taken); others: file size
+    """
+    size = os.path.getsize(fn)
+    if fn.endswith('.gz') and size >= 18: # smallest gzip file
+        with open(fn, 'rb') as f:
+            f.seek(-4, os.SEEK_END)
+            size = max(size, int.from_bytes(f.read(4), 'little'))
+    return size
+
+def load_json_records(fn):
+    """
+    *JSON records of file as list*
+
+    * JSON list (*[]*) file, or JSON lines (one record per line) file
+    * raise DecodeError if file is not valid JSON
+    """
+    data = read_input_bytes(fn)
+    try:
+        if data.lstrip().startswith(b'['):
+            return json.loads(data)
+        return [json.loads(line) for line in data.splitlines() if len(line.strip()) > 0]
+    except ValueError as e:
+        raise DecodeError(f"{fn} is not valid JSON: {e}", source = fn) from e
+
+class Prefetcher(object):
+    """
+    *read files ahead in thread pool*
+
+    * iterate to get (file name, *load*(file name)), same order as *files*
+    * *load*: function of one file name, like **read_input_bytes** or **load_json_records**; runs in threads
+    * *readahead*: number of files loaded at the same time (and thread number)
+    * *max_bytes*: total size of files loaded but not used yet; one file is always allowed
+    * size of file is taken by **input_size** (decompressed size of '.gz') before it is loaded, and
+      replaced by bytes read when loaded content is bytes
+    """
+    def __init__(self, files, load=read_input_bytes, readahead=4, max_bytes=DEFAULT_MAX_BYTES):
+        self.files = list(files)
+        self.load = load
+        self.readahead = max(1, readahead)
+        self.max_bytes = max_bytes
+
+    def __iter__(self):
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(self.readahead)
+        pending = deque() # [file name, future, size, size is counted from content]
+        next_idx = 0
+        try:
+            while next_idx < len(self.files) or len(pending) > 0:
+                for entry in pending:
+                    if not entry[3] and entry[1].done() and entry[1].exception() is None:
+                        content = entry[1].result()
+                        if isinstance(content, (bytes, str)):
+                            entry[2] = len(content)
+                        entry[3] = True
+                ahead_bytes = sum(entry[2] for entry in pending)
+                while next_idx < len(self.files) and len(pending) < self.readahead:
+                    fn = self.files[next_idx]
+                    size = input_size(fn)
+                    if len(pending) > 0 and ahead_bytes + size > self.max_bytes:
+                        break # memory cap: wait until a file is used
+                    pending.append([fn, pool.submit(self.load, fn), size, False])
+                    ahead_bytes += size
+                    next_idx += 1
+                (fn, fut, size, counted) = pending.popleft()
+                yield (fn, fut.result())
+        finally:
+            for entry in pending:
+                entry[1].cancel()
+            pool.shutdown(wait = True)
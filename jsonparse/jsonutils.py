@@ -15,19 +15,43 @@ JsonUtils CLASS
 ---------------
 """
 import os
-from datetime import datetime
-import traceback # Python error trace
-import logzero
-from logzero import logger
 import json
-
-import uuid # random string generator
-
-import csv
+# logzero is imported at first use of logger (import time)
+try:
+    from jsonparse.log import logger
+    from jsonparse.stats import NULL_STATS, timed_stage
+    from jsonparse.errors import JsonParseError, DecodeError, MapError, MapMismatchError, UnmappedPathError, \
+        UnmappedArrayError, UnsupportedDepthError
+    from jsonparse.pathstore import DYNAMIC_KEY_TAG, DYNAMIC_VALUE_TAG
+except ImportError: # run as script: python jsonparse/jsonutils.py
+    from log import logger
+    from stats import NULL_STATS, timed_stage
+    from errors import JsonParseError, DecodeError, MapError, MapMismatchError, UnmappedPathError, \
+        UnmappedArrayError, UnsupportedDepthError
+    from pathstore import DYNAMIC_KEY_TAG, DYNAMIC_VALUE_TAG
 
 # get full path
 # from https://stackoverflow.com/questions/51488240/python-get-json-keys-as-full-path
-import collections
+import collections.abc
+
+# The modules below are imported inside functions which use them (import time):
+# uuid (random string generator), csv (CSV map), pickle (binary map)
+
+UNMAPPED_POLICIES = ('fail', 'skip', 'overflow') # what to do when data path is not in map
+ERROR_POLICIES = ('raise', 'quarantine') # what to do when parsing a record raises JsonParseError
+DEAD_LETTER_COLUMNS = ["record_index", "error", "path", "message", "record"] # columns of dead letter table
+OVERFLOW_COLUMNS = ["uuid", "table_name", "seq", "path", "value"] # columns of overflow table
+
+FLATTEN_MODES = ('positional', 'delimited', 'json') # array in columns of parent table, see JsonUtils.flatten_array
+
+FILTER_OPERATORS = ('==', '!=', '<', '<=', '>', '>=', 'in', 'not in') # operators of RecordFilter conditions
+
+PG_MAX_COLUMNS = 1600        # column limit of PostgreSQL table
+
+MAP_INDEX_VERSION = 6        # version of lookup indexes from compile_map
+MAP_BIN_MAGIC = b'JSONPMAP'  # first bytes of binary map file
+MAP_BIN_VERSION = 1          # binary map format version
+MAP_BIN_PROTOCOL = 5         # pickle protocol, or highest protocol of this Python if lower
 
 class JsonUtils(object):
     """ 
@@ -56,6 +80,9 @@ class JsonUtils(object):
     - **json_data**: data loaded in json format using json module
     - **pathlist**: all path in data, columns in table later
     - **arraylist**: all array in data, tables later
+    - **array_max_length**: array path to max length found in data (by self.compute_all_paths), for flattening
+    - **dynamiclist**: paths of dynamic-key objects (in **arraylist** too), they are key/value tables
+      (see pathstore.discover_paths)
     - **map**:
     
       * JSON format map                                                       
@@ -67,8 +94,20 @@ class JsonUtils(object):
     
         
     - **parsed_tables**: parsed cvs tables
+    - **unmapped_summary**: paths not in map, with count, found by last self.parse_use_pool
+    - **dead_letters**: records put aside by last self.parse_use_pool with *on_error* 'quarantine'
+      (list of dictionaries, keys are DEAD_LETTER_COLUMNS)
     - **map_path**: path list from map
     - **map_array**: array list from map
+    - **map_index**:
+
+      * lookup indexes compiled from **map** by self.compile_map
+      * can be loaded together with map from binary file by self.map_import_bin
+      * set to None when map changed by method of this class; call self.compile_map after editing **map** directly
+    - **stats**:
+
+      * timers and counters (see stats.ParseStats); switched off (NULL_STATS) by default
+      * switch on by self.enable_stats
     """
 
     def __init__(self, 
@@ -84,35 +123,61 @@ class JsonUtils(object):
         self.json_data = None
         self.pathlist = None
         self.arraylist = None
+        self.array_max_length = dict()
+        self.dynamiclist = []
         self.map = None
         self.map_path = None
+        self.map_index = None
+        self.stats = NULL_STATS
+        self.unmapped_summary = dict()
+        self.dead_letters = []
+
+    def enable_stats(self, profile=False):
+        """
+        *switch on statistics*
+
+        * timers of stages, counters and peak memory are collected into **stats**
+        * *profile*: True (all stages) or list of stage names to run under cProfile
+        * return **stats**
+        """
+        from jsonparse.stats import ParseStats
+        self.stats = ParseStats(profile = profile)
+        return self.stats
+
+    def disable_stats(self):
+        """
+        *switch off statistics*
+        """
+        self.stats = NULL_STATS
 
+    @timed_stage('decode')
     def load_from_file(self, df=None):
         """ 
         *load JSON data from file*
 
         * Valid JSON data can be JSON list(*[]*). The JSON lines (one line per JSON transaction) may not work.
         * JSON data stored into **json_data**
+        * raise DecodeError if file is not valid JSON
         """
-        try:
-            with open(df, 'r') as f:
+        with open(df, 'r') as f:
+            try:
                 self.json_data = json.load(f)
-        except:
-            print(f"{traceback.format_exc()}")
-            exit(1)
+            except ValueError as e:
+                raise DecodeError(f"{df} is not valid JSON: {e}", source = df) from e
 
+    @timed_stage('decode')
     def load_from_string(self, jstr=None):
         """ 
         *load JSON data from string*
         
         * Valid JSON data can be JSON list(*[]*). The JSON lines (one line per JSON transaction) may not work.
         * JSON data stored into **json_data**
+        * raise DecodeError if string is not valid JSON
         """
         try:
             self.json_data = json.loads(jstr)
-        except:
-            print(f"{traceback.format_exc()}")
-            exit(1)
+        except ValueError as e:
+            raise DecodeError(f"string is not valid JSON: {e}") from e
 
     def load_from_list(self, jsonlist=None):
         """ 
@@ -124,6 +189,25 @@ class JsonUtils(object):
         jstr = f"[{mystr}]"
         self.load_from_string(jstr = jstr)
 
+    @timed_stage('decode')
+    def load_from_files(self, files=None, readahead=4, max_bytes=None):
+        """
+        *load JSON data from many files*
+
+        * *files*: file names, folders and glob patterns (see ingest.expand_inputs), in sorted order
+        * each file is JSON list (*[]*) or JSON lines, '.gz' files are decompressed
+        * next *readahead* files are read and decoded in threads, at most *max_bytes* (file size) waiting
+          (see ingest.Prefetcher)
+        * records of all files are stored into **json_data** in file order
+        * raise DecodeError if a file is not valid JSON
+        """
+        from jsonparse.ingest import expand_inputs, load_json_records, Prefetcher, DEFAULT_MAX_BYTES
+        self.json_data = []
+        prefetcher = Prefetcher(expand_inputs(files), load_json_records, readahead = readahead,
+                                max_bytes = max_bytes or DEFAULT_MAX_BYTES)
+        for (fn, records) in prefetcher:
+            self.json_data.extend(records)
+
     def append_from_list(self, jsonlist=None):
         """ 
         *Append to JSON data from JSON list*
@@ -138,13 +222,26 @@ class JsonUtils(object):
         """
         return len(self.json_data)
 
-    def compute_all_paths(self, use_pool=False):
+    @timed_stage('discover')
+    def compute_all_paths(self, use_pool=False, key_threshold=None, max_memory_paths=None):
         """ 
         *Compute all paths in JSON data*
 
         * call **get_paths** out of this class (see below), work on **json_data**
-        * Store output into **arraylist** (table) and **pathlist**
+        * Store output into **arraylist** (table) and **pathlist**, max length of arrays into **array_max_length**
+        * raise UnsupportedDepthError if data is nested too deep for recursive **get_paths** (use *use_pool*)
+        * *key_threshold*: object with more distinct keys is dynamic, collapsed into key/value table
+          (stored into **dynamiclist**); *max_memory_paths*: spill paths to disk over this number;
+          see pathstore.discover_paths
         """
+        if key_threshold is not None or max_memory_paths is not None or len(self.dynamiclist) > 0:
+            from jsonparse.pathstore import discover_paths
+            dynamic = set(self.dynamiclist)
+            self.array_max_length = dict()
+            (self.pathlist, self.arraylist) = discover_paths(self.json_data, self.flag_json_array, key_threshold,
+                                                             max_memory_paths, dynamic, self.array_max_length)
+            self.dynamiclist = sorted(dynamic)
+            return
         try:
             if use_pool:
                 allpathlist = get_path_pool(self.json_data, self.flag_json_array)
@@ -152,35 +249,21 @@ class JsonUtils(object):
                 allpathlist = get_paths(self.json_data, self.flag_json_array)
             # logger.debug(allpathlist)
             # can multithread do so
-        except:
-            print(f"{traceback.format_exc()}")
-            exit(1)
-        pathset = set()
-        arrset = set()
-        for path in allpathlist:
-            if self.flag_json_array in path:
-                path.remove(self.flag_json_array)
-                if len(path) > 0:
-                    arrset.add('.'.join(path))
-            else:
-                pathset.add('.'.join(path))
-        pathlist = list(sorted(pathset))
-        self.arraylist = list(sorted(arrset))
-        #self.pathlist = [x for x in pathlist if x not in self.arraylist]
-        valid_list = []
-        for x in reversed(pathlist):
-            if x not in self.arraylist and len(valid_list) == 0:
-                valid_list.append(x)
-            elif x not in self.arraylist and x not in valid_list[-1]:
-                valid_list.append(x) # remove object
-        self.pathlist = sorted(valid_list)
-
-    def table_plan_json(self):
+        except RecursionError as e:
+            raise UnsupportedDepthError("JSON data is nested too deep for get_paths, use use_pool=True") from e
+        (self.pathlist, self.arraylist) = split_paths(allpathlist, self.flag_json_array)
+        self.array_max_length = array_max_lengths(self.json_data)
+
+    @timed_stage('plan')
+    def table_plan_json(self, extras_column=None, flatten=None, max_positions=None):
         """ 
         *create map in json format*
 
         * Based on **arraylist** and **pathlist**, compute map in Python dictionary
         * Store map (python dictionary) into **map**
+        * *extras_column*: if given, all tables get extras column with this name (see **add_extras_column**)
+        * *flatten*: {array path: mode}, these arrays are columns of parent table instead of tables
+          (see **flatten_array**); 'positional' arrays get at most *max_positions* positions
         """
         table_name_list = []
         total_path = self.pathlist.copy()
@@ -197,12 +280,16 @@ class JsonUtils(object):
             # j_tbl["seqList"] = [{"columnName":f"seq_{p}"} for p in path.split('.')]
             j_tbl["seqList"] = table_seq_list(path, self.arraylist)
             logger.info(f"Collect paths for {idx}-th table {table_name}...")
-            table_path = [p for p in total_path if path in p]
+            table_path = [p for p in total_path if p.startswith(f"{path}.")]
             j_clmlist = list()
             table_column = []
+            if path in self.dynamiclist: # key/value table of dynamic-key object
+                j_tbl["dynamicKeys"] = True
+                table_column.append("key")
+                j_clmlist.append({"columnName": "key", "relativePath": DYNAMIC_KEY_TAG})
             for p in table_path:
                 j_clm = dict()
-                clm = name_from_path(p, table_column)
+                clm = name_from_path(column_name_path(p), table_column)
                 table_column.append(clm)
                 j_clm["columnName"] = clm
                 j_clm["relativePath"] = p[len(path)+1:]
@@ -236,6 +323,110 @@ class JsonUtils(object):
         # logger.info(f"DEBUG:\n{mystr}")
 
         self.map = j_map
+        self.map_index = None
+        # inner arrays first: array with sub arrays can be flattened as json only
+        for path in sorted(flatten or dict(), key = lambda p: -p.count('.')):
+            max_length = self.array_max_length.get(path, None)
+            if flatten[path] == 'positional' and max_positions is not None and max_length is not None:
+                max_length = min(max_length, max_positions)
+            self.flatten_array(path, flatten[path], max_length = max_length)
+        if extras_column is not None:
+            self.add_extras_column(column_name = extras_column)
+
+    def add_extras_column(self, column_name='extras', table_names=None):
+        """
+        *add extras column to tables in map*
+
+        * extras column (postgres type jsonb) keeps values of the table which are not in map, as compact JSON
+        * key of the JSON object is relative path, like *{"promo.code": "A", "coupon": {"id": 1}}*
+        * later a path can be added as real column (**add_new_path_to_map**) without parse old data again
+        * *table_names*: list of table names, None for all tables
+        * filled by **parse_use_pool**; **parse_to_csv** leaves it empty
+        """
+        for tbl in self.map["tableList"]:
+            if table_names is None or tbl["tableName"] in table_names:
+                tbl["extrasColumn"] = column_name
+        self.map_index = None
+
+    def flatten_array(self, array_path, mode='positional', max_length=None, delimiter=','):
+        """
+        *put array into columns of its parent table, instead of its own table*
+
+        * *array_path*: root path of array table in **map**; the parent table is the table of nearest array
+          around it (or root table); parent table keeps the setting in "flatArrays"
+        * *mode* (one of FLATTEN_MODES):
+
+          * 'positional': columns for elements 1 to *max_length* (default: **array_max_length**),
+            like item_1_sku, item_2_sku; longer array: elements after *max_length* are not in map (unmapped)
+          * 'delimited': one column for each field, values of all elements joined by *delimiter*
+            (empty value for element without the field, so positions match across columns)
+          * 'json': one column, whole array as JSON; sub arrays go into it too (their tables are removed)
+        * 'positional' and 'delimited' need array without sub arrays (flatten sub arrays first,
+          'delimited' needs none at all); array of scalars gets column for values
+        * **parse_use_pool** and stream parse fill the columns; **parse_to_csv** does not support it
+        * raise ValueError if *array_path* is not table of map or *mode* does not fit
+        """
+        if mode not in FLATTEN_MODES:
+            raise ValueError(f"mode must be one of {FLATTEN_MODES}, not {mode}")
+        tbl_lst = self.map["tableList"]
+        arr_tbls = [tbl for tbl in tbl_lst if tbl["rootPath"] == array_path]
+        if len(array_path) == 0 or len(arr_tbls) == 0:
+            raise ValueError(f"array {array_path} is not table of map")
+        if any(tbl.get("dynamicKeys", False) for tbl in arr_tbls):
+            raise ValueError(f"{array_path} is dynamic-key object, it can not be flattened")
+        sub_tbls = [tbl for tbl in tbl_lst if tbl["rootPath"].startswith(f"{array_path}.")]
+        if len(sub_tbls) > 0 and mode != 'json':
+            raise ValueError(f"array {array_path} has sub arrays, flatten them first or use mode json")
+        inner_flat = [flat for tbl in arr_tbls for flat in tbl.get("flatArrays", None) or []]
+        if len(inner_flat) > 0 and mode == 'delimited':
+            raise ValueError(f"array {array_path} has flattened sub arrays, use mode positional or json")
+        if mode == 'positional' and max_length is None:
+            max_length = self.array_max_length.get(array_path, None)
+            if max_length is None:
+                raise ValueError(f"max length of array {array_path} is not known, run compute_all_paths or give it")
+        parent_path = ''
+        for tbl in tbl_lst:
+            if array_path.startswith(f"{tbl['rootPath']}.") and len(tbl["rootPath"]) > len(parent_path):
+                parent_path = tbl["rootPath"]
+        parents = [tbl for tbl in tbl_lst if tbl["rootPath"] == parent_path]
+        if len(parents) == 0:
+            raise ValueError(f"parent table of array {array_path} is not in map")
+        rel_path = array_path[len(parent_path) + 1:] if len(parent_path) > 0 else array_path
+        arr_name = array_path.split('.')[-1]
+        fields = [clm for tbl in arr_tbls for clm in tbl["columnList"]]
+        new_clms = [] # (column name, relative path)
+        if mode == 'json':
+            new_clms.append((arr_name, rel_path))
+        elif mode == 'positional':
+            for pos in range(1, max_length + 1):
+                if len(fields) == 0: # array of scalars
+                    new_clms.append((f"{arr_name}_{pos}", f"{rel_path}.[{pos}]"))
+                new_clms += [(f"{arr_name}_{pos}_{clm['columnName']}", f"{rel_path}.[{pos}].{clm['relativePath']}")
+                             for clm in fields]
+        else:
+            if len(fields) == 0:
+                new_clms.append((arr_name, f"{rel_path}.[]"))
+            new_clms += [(f"{arr_name}_{clm['columnName']}", f"{rel_path}.[].{clm['relativePath']}") for clm in fields]
+        clm_names = [clm["columnName"] for tbl in parents for clm in tbl["columnList"]]
+        target = parents[-1] # last table if parent is split
+        for (clm_name, clm_path) in new_clms:
+            clm_name = name_from_path(clm_name, clm_names)
+            clm_names.append(clm_name)
+            target["columnList"].append({"columnName": clm_name, "relativePath": clm_path})
+        flat = {"arrayPath": rel_path, "mode": mode}
+        if mode == 'positional':
+            flat["maxLength"] = max_length
+        elif mode == 'delimited':
+            flat["delimiter"] = delimiter
+        target.setdefault("flatArrays", []).append(flat)
+        if mode == 'positional': # flattened sub arrays are in each position
+            for pos in range(1, max_length + 1):
+                for inner in inner_flat:
+                    target["flatArrays"].append(dict(inner, arrayPath = f"{rel_path}.[{pos}].{inner['arrayPath']}"))
+        removed = set(id(tbl) for tbl in arr_tbls + sub_tbls)
+        self.map["tableList"] = [tbl for tbl in tbl_lst if id(tbl) not in removed]
+        self.map["tableNumber"] = len(self.map["tableList"])
+        self.map_index = None
 
     def json_map_export(self, map_file=None):
         """
@@ -252,13 +443,15 @@ class JsonUtils(object):
     def json_map_import(self, map_file=None):
         """
         *import map from JSON format*
+
+        * raise MapError if file is not valid JSON
         """
-        try:
-            with open(map_file, 'r') as f:
+        with open(map_file, 'r') as f:
+            try:
                 self.map = json.load(f)
-        except:
-            print(f"{traceback.format_exc()}")
-            exit(1)
+            except ValueError as e:
+                raise MapError(f"{map_file} is not valid JSON map: {e}", source = map_file) from e
+        self.map_index = None
         # mystr = json.dumps(self.map, indent=4)
         # logger.info(f"DEBUG:\n{mystr}")
 
@@ -274,7 +467,13 @@ class JsonUtils(object):
             for table_elm in self.map["tableList"]:
                 tbl_name = table_elm["tableName"]
                 tbl_rpth = table_elm["rootPath"]
-                f.write(f",{tbl_name},{tbl_rpth},,\n")
+                tbl_extras = table_elm.get("extrasColumn", "")
+                tbl_flat = ""
+                if table_elm.get("flatArrays", None): # JSON in quoted csv field
+                    tbl_flat = json.dumps(table_elm["flatArrays"], separators = (',', ':')).replace('"', '""')
+                    tbl_flat = f'"{tbl_flat}"'
+                tbl_dyn = ",dynamic" if table_elm.get("dynamicKeys", False) else "" # key/value table
+                f.write(f",{tbl_name},{tbl_rpth},{tbl_extras},{tbl_flat}{tbl_dyn}\n")
 
             for table_elm in self.map["tableList"]:
                 tbl_name = table_elm["tableName"]
@@ -310,6 +509,7 @@ class JsonUtils(object):
         * the tool to change JSON map
         """
         # reading csv file
+        import csv
         rows = []
         with open(map_csv, 'r') as csvfile: 
             # creating a csv reader object (can NOT let rows = csv.reader(csvfile))
@@ -324,7 +524,8 @@ class JsonUtils(object):
         tbl_cnt = int(rows[pnt][0]) # the first line of csv, only use table count
         imp_map["tableNumber"] = tbl_cnt
         pnt += 1 # table list header line
-        tbl_list = [row[1:3] for row in rows[pnt:pnt+tbl_cnt]] # table name and array path
+        # table name, array path, extras column, flat arrays, 'dynamic' for key/value table
+        tbl_list = [row[1:6] for row in rows[pnt:pnt+tbl_cnt]]
         pnt += int(tbl_cnt) # table list line
         # tableList array, will assign to self.map["tableList"]
         map_tbl_lst = []
@@ -332,6 +533,12 @@ class JsonUtils(object):
             map_tbl = dict()
             map_tbl["tableName"] = tbl[0]
             map_tbl["rootPath"] = tbl[1]
+            if len(tbl) > 2 and len(tbl[2]) > 0:
+                map_tbl["extrasColumn"] = tbl[2]
+            if len(tbl) > 3 and len(tbl[3]) > 0:
+                map_tbl["flatArrays"] = json.loads(tbl[3])
+            if len(tbl) > 4 and tbl[4] == 'dynamic':
+                map_tbl["dynamicKeys"] = True
             pnt += 2 # two empty line before each table information
             if len(rows[pnt][4]) == 0: # array, need sequnce number variables
                 seq_var_cnt = int(rows[pnt][1])
@@ -349,52 +556,190 @@ class JsonUtils(object):
             map_tbl_lst.append(map_tbl)
         imp_map["tableList"] = map_tbl_lst
         self.map = imp_map
+        self.map_index = None
         # logger.debug(f"Now: {self.map}")
 
-    def postgres_ddl(self, sql_file = None, schema_name = "default_schema"):
+    def compile_map(self):
+        """
+        *compile lookup indexes of map*
+
+        * call **compile_map** out of this class, store result into **map_index**
+        * return **map_index**
+        """
+        self.map_index = compile_map(self.map)
+        return self.map_index
+
+    def get_map_index(self):
+        """
+        * return **map_index**, compile it if not exist
+        """
+        if self.map_index is None or self.map_index.get("version", 1) != MAP_INDEX_VERSION:
+            self.compile_map()
+        return self.map_index
+
+    def map_export_bin(self, map_bin=None):
+        """
+        *export map as compact binary format*
+
+        * map and its lookup indexes (**map_index**) are stored with pickle
+        * loading binary map is much faster than JSON or CSV format for large map
+        * the map is stored as is: export to JSON or CSV format after import get same file
+        """
+        import pickle
+        payload = {"map": self.map, "index": self.get_map_index()}
+        with open(map_bin, 'wb') as f:
+            f.write(MAP_BIN_MAGIC)
+            f.write(MAP_BIN_VERSION.to_bytes(2, 'big'))
+            pickle.dump(payload, f, protocol = min(MAP_BIN_PROTOCOL, pickle.HIGHEST_PROTOCOL))
+
+    def map_import_bin(self, map_bin=None):
+        """
+        *import map from compact binary format*
+
+        * file created by **map_export_bin**; do not load file from untrusted source (pickle)
+        * store map into **map** and lookup indexes into **map_index**
+        * lookup indexes from older version are compiled again (at first use)
+        * raise MapError if file is not binary map of this or older version
+        """
+        import pickle
+        with open(map_bin, 'rb') as f:
+            magic = f.read(len(MAP_BIN_MAGIC))
+            version = int.from_bytes(f.read(2), 'big')
+            if magic != MAP_BIN_MAGIC:
+                raise MapError(f"{map_bin} is not binary map file", source = map_bin)
+            if version > MAP_BIN_VERSION:
+                raise MapError(f"binary map version {version} is newer than {MAP_BIN_VERSION}", source = map_bin)
+            try:
+                payload = pickle.load(f)
+            except (pickle.UnpicklingError, EOFError) as e:
+                raise MapError(f"{map_bin} is broken binary map file: {e}", source = map_bin) from e
+        self.map = payload["map"]
+        self.map_index = payload["index"]
+
+    def postgres_ddl(self, sql_file = None, schema_name = "default_schema", max_columns = None,
+                     primary_key = False, parent_index = False, post_load_file = None, unlogged = False):
         """ 
         *generate postgresql queries of table DDL based on map*
 
         * Based on **map**, create table DDL using *schema_name*
-        * Store SQL query into *sql_file*
+        * Store SQL query into *sql_file*; written table by table (no big string)
+        * *max_columns*: if given, tables wider than it are split first by **split_wide_tables**
+          (**map** is changed, save it again so parsing gives rows of the split tables)
+        * *primary_key*: primary key (uuid, seq_...) of each table; rows of a table are unique by it
+        * *parent_index*: index on parent key (uuid and sequences of parent table) of child tables, for join
+          with parent table; not created with *primary_key* (leading columns of primary key serve the join)
+        * *post_load_file*: keys and indexes go into this file, to run after bulk load (faster load);
+          it also analyzes tables. None: keys and indexes are in *sql_file* after create table
+        * *unlogged*: create UNLOGGED tables (staging: fast load, not crash safe, not replicated)
         """
-        tbl_lst = self.map["tableList"]
-        
-        str_buff = ""
-        for idx, tbl in enumerate(tbl_lst, start=1):
-            tbl_name = tbl["tableName"]
-            mystr = f"drop table if exists {schema_name}.{tbl_name};"
-            mystr = f"{mystr}\ncreate table {schema_name}.{tbl_name} ("
-            mystr = f"{mystr}\n    uuid text"
-            seq_lst = tbl.get("seqList", None)
-            if seq_lst is not None:
-                seq_str = ' int\n    , '.join([e["columnName"] for e in seq_lst])
-                mystr = f"{mystr}\n    , {seq_str} int"
-            clm_lst = tbl["columnList"]
-            clm_str = ' text\n    , '.join([e["columnName"] for e in clm_lst])
-            mystr = f"{mystr}\n    , {clm_str} text"
-            mystr = f"{mystr}\n    );\n\n"
-            str_buff = f"{str_buff}-- The {idx}-th table {tbl_name}\n{mystr}"
+        if max_columns is not None:
+            self.split_wide_tables(max_columns = max_columns)
+        post_lst = [] # (table name, statements) of keys and indexes
         with open(sql_file, 'w') as f:
-            f.write(str_buff)
+            for idx, tbl in enumerate(self.map["tableList"], start=1):
+                tbl_name = tbl["tableName"]
+                seq_names = [e["columnName"] for e in tbl.get("seqList", None) or []]
+                clm_lst = ["uuid text"]
+                clm_lst += [f"{nm} int" for nm in seq_names]
+                clm_lst += [f"{e['columnName']} text" for e in tbl["columnList"]]
+                if tbl.get("extrasColumn", None) is not None:
+                    clm_lst.append(f"{tbl['extrasColumn']} jsonb")
+                f.write(f"-- The {idx}-th table {tbl_name}\n"
+                        f"drop table if exists {schema_name}.{tbl_name};\n"
+                        f"create {'unlogged ' if unlogged else ''}table {schema_name}.{tbl_name} (\n")
+                f.write('    ')
+                f.write('\n    , '.join(clm_lst))
+                f.write("\n    );\n\n")
+                key_stmt = []
+                if primary_key:
+                    key_stmt.append(f"alter table {schema_name}.{tbl_name} add constraint {tbl_name}_pk "
+                                    f"primary key ({', '.join(['uuid'] + seq_names)});")
+                elif parent_index and len(seq_names) > 0:
+                    key_stmt.append(f"create index {tbl_name}_parent_idx on {schema_name}.{tbl_name} "
+                                    f"({', '.join(['uuid'] + seq_names[:-1])});")
+                if post_load_file is None:
+                    f.writelines(f"{stmt}\n\n" for stmt in key_stmt)
+                else:
+                    post_lst.append((tbl_name, key_stmt))
+        if post_load_file is not None:
+            with open(post_load_file, 'w') as f:
+                for idx, (tbl_name, key_stmt) in enumerate(post_lst, start=1):
+                    f.write(f"-- The {idx}-th table {tbl_name}, after load\n")
+                    f.writelines(f"{stmt}\n" for stmt in key_stmt)
+                    f.write(f"analyze {schema_name}.{tbl_name};\n\n")
+
+    def split_wide_tables(self, max_columns=PG_MAX_COLUMNS):
+        """
+        *split tables with too many columns*
+
+        * call **split_wide_tables** out of this class on **map**
+        * return names of new tables
+        """
+        old_names = set(tbl["tableName"] for tbl in self.map["tableList"])
+        self.map = split_wide_tables(self.map, max_columns)
+        new_names = [tbl["tableName"] for tbl in self.map["tableList"] if tbl["tableName"] not in old_names]
+        if len(new_names) > 0:
+            logger.info(f"Split wide tables, new tables: {new_names}")
+            self.map_index = None
+        return new_names
+
+    def postgres_delta_sql(self, sql_file = None, schema_name = "default_schema", staging_schema = "staging"):
+        """
+        *generate postgresql script of delta load (delete + insert by txn id)*
 
-    def parse_to_csv(self):
+        * parsed rows of new and changed records (see delta.DeltaFilter) are loaded into tables of
+          *staging_schema* (same DDL as **postgres_ddl**)
+        * the script deletes all rows of these txn ids (uuid) from tables of *schema_name*, then inserts rows
+          from staging tables, in one transaction; a changed record with less child rows leaves none behind
+        * Store SQL query into *sql_file*
+        """
+        tbl_names = [tbl["tableName"] for tbl in self.map["tableList"]]
+        with open(sql_file, 'w') as f:
+            f.write(f"-- Delta load from {staging_schema} into {schema_name}: delete + insert by txn id\n")
+            f.write("begin;\n\ncreate temp table delta_txn on commit drop as\n    ")
+            f.write('\n    union '.join(f"select uuid from {staging_schema}.{nm}" for nm in tbl_names))
+            f.write(";\n\n")
+            for nm in tbl_names:
+                f.write(f"delete from {schema_name}.{nm} t using delta_txn d where t.uuid = d.uuid;\n")
+            f.write("\n")
+            for nm in tbl_names:
+                f.write(f"insert into {schema_name}.{nm} select * from {staging_schema}.{nm};\n")
+            f.write("\ncommit;\n")
+
+    @timed_stage('parse')
+    def parse_to_csv(self, tables=None, columns=None, where=None, record_filter=None, dedup=None):
         """
         *parse JSON data to csv format using map*
 
         * Based on data in **json_data** and map in **map**, parse JSON data
         * Store CSV format data into **parsed_tables**
+        * *tables* and *columns*: parse selected tables and columns only, see **project_map**
+        * *where* and *record_filter*: parse selected records only, see **parse_use_pool**
+        * *dedup*: drop records seen before, see **parse_use_pool**
         """
+        import uuid
+        if any(tbl.get("flatArrays", None) for tbl in self.map["tableList"]):
+            raise MapError("map with flattened arrays is not supported by parse_to_csv, use parse_use_pool")
+        if any(tbl.get("dynamicKeys", False) for tbl in self.map["tableList"]):
+            raise MapError("map with dynamic-key tables is not supported by parse_to_csv, use parse_use_pool")
         psd_tbl = dict()
-        for idx_tbl, csv_tbl in enumerate(self.map["tableList"], start=1):
+        tbl_list = self.map["tableList"] if tables is None and columns is None else \
+            project_map(self.map, tables, columns)["tableList"]
+        for idx_tbl, csv_tbl in enumerate(tbl_list, start=1):
             tblName = csv_tbl["tableName"]
             tblContent = []
             psd_tbl[tblName] = tblContent
+        rec_filter = self.make_record_filter(where, record_filter)
         for js1 in self.json_data:
+            if dedup is not None and dedup.is_duplicate(js1):
+                self.stats.count('duplicates')
+                continue
+            if rec_filter is not None and not rec_filter(js1):
+                continue
             js1[self.json_txn_id_name] = str(uuid.uuid4())
             tableCnt = self.map["tableNumber"]
             # logger.info(f"Work on {tableCnt} tables...")
-            for idx_tbl, csv_tbl in enumerate(self.map["tableList"], start=1):
+            for idx_tbl, csv_tbl in enumerate(tbl_list, start=1):
                 tblName = csv_tbl["tableName"]
                 tblContent = []
                 tbl_content = list()
@@ -427,9 +772,16 @@ class JsonUtils(object):
                                 if len(psd_str) > 0:
                                     psd_tbl[tblName].append(psd_str)
                 else:
-                    logger.error("Do we need this level?")
-                    exit()
+                    raise UnsupportedDepthError(f"table {tblName} has {len(seq_list)} array levels, "
+                                                "parse_to_csv supports 3 (use parse_use_pool)", path = csv_tbl["rootPath"])
+        for csv_tbl in tbl_list: # extras column is not filled, keep it empty
+            if csv_tbl.get("extrasColumn", None) is not None:
+                psd_tbl[csv_tbl["tableName"]] = [f"{r}{self.csv_delim}" for r in psd_tbl[csv_tbl["tableName"]]]
         self.parsed_tables = psd_tbl
+        if self.stats.enabled:
+            self.stats.count('records', len(self.json_data))
+            for tbl_nm, content in self.parsed_tables.items():
+                self.stats.add_rows(tbl_nm, len(content))
 
     def map_to_allpath(self):
         """ 
@@ -443,26 +795,45 @@ class JsonUtils(object):
         all_path = []
         all_array = []
         for tbl in self.map["tableList"]:
+            for flat in tbl.get("flatArrays", None) or []: # flattened array: data paths without positions
+                arr_path = f"{tbl['rootPath']}.{flat['arrayPath']}" if len(tbl["rootPath"]) > 0 else flat["arrayPath"]
+                all_array.append(arr_path)
             if len(tbl["rootPath"]) > 0:
-                all_array.append(tbl["rootPath"])
+                if tbl["rootPath"] not in all_array: # split wide table: tables with same root path
+                    all_array.append(tbl["rootPath"])
                 for clm in tbl["columnList"]:
+                    if clm["relativePath"] == DYNAMIC_KEY_TAG: # key of dynamic-key object, not in data
+                        continue
                     rootpath = tbl["rootPath"]
-                    rel_path = clm["relativePath"]
+                    rel_path = data_path(clm["relativePath"])
                     thispath = f"{rootpath}.{rel_path}"
-                    all_path.append(thispath)
+                    if thispath not in all_path: # flattened array: one path for all positions
+                        all_path.append(thispath)
             else:
-                all_path += [clm["relativePath"] for clm in tbl["columnList"]]
+                for clm in tbl["columnList"]:
+                    thispath = data_path(clm["relativePath"])
+                    if thispath not in all_path:
+                        all_path.append(thispath)
         self.map_path = all_path
         self.map_array = all_array
+        self.dynamiclist = [tbl["rootPath"] for tbl in self.map["tableList"] if tbl.get("dynamicKeys", False)]
 
     def add_new_path_to_map(self, new_path_list):
         """ 
         *Add new paths to map*
 
         * Assume no new table need to be added. If there exist new tables, will work on it in future.
+        * split wide table: new column goes to the last table of the root path (see **split_wide_tables**)
+        * new path in array flattened as 'json' is in its column already, it is skipped;
+          in other flattened arrays it raises MapMismatchError (flatten the array again)
         * based on *new_path_list* from the new JSON data and **map_path**
         * Add new path into **map**
         """
+        flat_modes = dict() # full path of flattened array -> mode
+        for tbl in self.map["tableList"]:
+            for flat in tbl.get("flatArrays", None) or []:
+                arr_path = f"{tbl['rootPath']}.{flat['arrayPath']}" if len(tbl["rootPath"]) > 0 else flat["arrayPath"]
+                flat_modes[arr_path] = flat["mode"]
         for idx, new_path in enumerate(new_path_list, start=1):
             # logger.debug(f"Add {idx}-th new path '{new_path}'...")
             # if idx > 1:
@@ -470,114 +841,241 @@ class JsonUtils(object):
             tbl_path = None
             for arr in list(reversed(sorted(self.map_array))):
                 # logger.debug(f"array check: {arr}")
-                if arr in new_path:
+                if new_path.startswith(f"{arr}."):
                     tbl_path = arr
                     break
+            if tbl_path in flat_modes:
+                if flat_modes[tbl_path] == 'json':
+                    continue
+                raise MapMismatchError(f"{new_path} is in flattened array {tbl_path}, flatten it again", path = new_path)
+            if tbl_path is None and '' in [tbl["rootPath"] for tbl in self.map["tableList"]]:
+                tbl_path = '' # not in any array, belong to root table
             # logger.debug(f"The new path '{new_path}' belong to array '{tbl_path}'")
             if tbl_path is None:
-                logger.error("{new_path} DO NOT belong to any table!!!")
-                exit()
+                raise MapMismatchError(f"{new_path} DO NOT belong to any table!!!", path = new_path)
             tbl_name = None
+            clm_list = []
             for tbl in self.map["tableList"]:
-                if tbl_path == tbl["rootPath"]:
+                if tbl_path == tbl["rootPath"]: # last one if wide table is split
                     tbl_name = tbl["tableName"]
-                    clm_list = [clm["columnName"] for clm in tbl["columnList"]]
-                    break
+                    clm_list += [clm["columnName"] for clm in tbl["columnList"]]
+                    new_tbl = tbl
             if tbl_name is None:
-                logger.error(f"Can NOT find table for {new_path} with array {tbl_path}!!!")
-                exit()
+                raise MapMismatchError(f"Can NOT find table for {new_path} with array {tbl_path}!!!", path = new_path)
             # logger.debug(f"The new path '{new_path}' belong to table '{tbl_name}'")
             # logger.debug(f"Existing columns: {clm_list}")
-            clm = name_from_path(new_path, clm_list)
-            rel_path = new_path[len(tbl_path)+1:]
+            clm = name_from_path(column_name_path(new_path), clm_list)
+            rel_path = new_path[len(tbl_path)+1:] if len(tbl_path) > 0 else new_path
             # logger.debug(f"Column name for '{new_path}' will be '{clm}' with relative path '{rel_path}'")
             j_clm = dict()
             j_clm["columnName"] = clm
             j_clm["relativePath"] = rel_path
-            for tbl in self.map["tableList"]:
-                if tbl_path == tbl["rootPath"]:
-                    tbl["columnList"].append(j_clm)
+            new_tbl["columnList"].append(j_clm)
+        self.map_index = None
+
+    def plan_with_cache(self, map_cache, sample_size=1000):
+        """
+        *create map using map cache*
+
+        * compute schema fingerprint on the first *sample_size* records of **json_data**
+        * same fingerprint in *map_cache* (see mapcache.MapCache): use cached map (may be edited by user)
+        * cached map with same arrays and less paths: use it, add new paths by **add_new_path_to_map**
+        * otherwise: **compute_all_paths** and **table_plan_json**
+        * the map is stored into *map_cache* and **map**
+        * return fingerprint
+        """
+        from jsonparse.mapcache import schema_fingerprint
+        (pathlist, arraylist) = sample_paths(self.json_data, self.flag_json_array, sample_size)
+        fingerprint = schema_fingerprint(pathlist, arraylist)
+        jmap = map_cache.get(fingerprint)
+        if jmap is not None:
+            logger.info(f"Use cached map {fingerprint}.")
+            self.map = jmap
+            self.map_index = None
+            return fingerprint
+        base_fp = map_cache.find_subset(pathlist, arraylist)
+        if base_fp is not None:
+            logger.info(f"Update cached map {base_fp} with new paths.")
+            self.map = map_cache.get(base_fp)
+            self.map_index = None
+            self.map_to_allpath()
+            (base_paths, dummy) = map_cache.get_paths(base_fp)
+            # path removed from map by user is not new path
+            old_set = set(base_paths) | set(self.map_path)
+            self.add_new_path_to_map([p for p in pathlist if p not in old_set])
+        else:
+            logger.info(f"No cached map for {fingerprint}, compute map from data.")
+            self.compute_all_paths()
+            self.table_plan_json()
+        map_cache.put(fingerprint, self.map, pathlist, arraylist)
+        return fingerprint
 
-    def gen_tblstr_by_map(self):
+    def gen_tblstr_by_map(self, selected=None):
         """
         *generate table structure based on map*
         Later just append data into it
+
+        * *selected*: for each table of map, True if it is parsed (default all)
         """
         self.parsed_tables = dict()
         for idx_tbl, csv_tbl in enumerate(self.map["tableList"], start=1):
+            if selected is not None and not selected[idx_tbl - 1]:
+                continue
             tblName = csv_tbl["tableName"]
             tblContent = []
             self.parsed_tables[tblName] = tblContent
 
-    def parse_use_pool(self):
+    def make_record_filter(self, where=None, func=None):
+        """
+        * **RecordFilter** of *where* conditions and *func*, checked with **map**; None if both are None
+        """
+        if where is None and func is None:
+            return None
+        return RecordFilter(where, func, jmap = self.map)
+
+    def overflow_table_name(self):
+        """
+        * name of overflow table: unmapped paths and values when parse with *unmapped* 'overflow'
+        """
+        return f"{self.table_name_prefix}unmapped"
+
+    def root_column_name(self, path):
+        """
+        * column name of root table for data *path*; last tag of path if it is not column of root table
+        """
+        for tbl in self.map["tableList"]:
+            if len(tbl["rootPath"]) == 0:
+                for clm in tbl["columnList"]:
+                    if clm["relativePath"] == path:
+                        return clm["columnName"]
+        return path.split('.')[-1]
+
+    @timed_stage('write')
+    def write_partitioned(self, out_dir, partition_by, fmt='text', header=False, unmapped='fail',
+                          max_file_bytes=128 * 1024 * 1024, max_open_files=64, chunk_size=1000):
+        """
+        *parse data and write partitioned output files*
+
+        * instead of **parsed_tables**, rows of **json_data** go to *out_dir*/table/column=value/part-N files
+        * *partition_by*: path of root table (like 'date'); rows of child tables go with their root record
+        * see stream.PartitionedWriter for *max_file_bytes* (file rotation) and *max_open_files*
+        * return **unmapped_summary**
+        """
+        from jsonparse.stream import ChunkParser, PartitionedWriter
+        chunk_parser = ChunkParser(self.map, self.get_map_index(), fmt = fmt, csv_delim = self.csv_delim,
+                                   stats = self.stats, unmapped = unmapped, overflow_table = self.overflow_table_name(),
+                                   partition_by = partition_by)
+        with PartitionedWriter(out_dir, self.map, fmt = fmt, csv_delim = self.csv_delim, header = header,
+                               overflow_table = self.overflow_table_name(), partition_name = self.root_column_name(partition_by),
+                               max_file_bytes = max_file_bytes, max_open_files = max_open_files) as writer:
+            for start in range(0, len(self.json_data), chunk_size):
+                parsed = chunk_parser.parse_records(self.json_data[start:start + chunk_size], start)
+                writer.write(chunk_parser.encode(parsed))
+        self.unmapped_summary = dict(chunk_parser.unmapped)
+        return self.unmapped_summary
+
+    def dead_letter_table_name(self):
+        """
+        * name of dead letter table: records put aside when stream parse with *on_error* 'quarantine'
+        """
+        return f"{self.table_name_prefix}dead_letter"
+
+    @timed_stage('parse')
+    def parse_use_pool(self, unmapped='fail', tables=None, columns=None, where=None, record_filter=None,
+                       on_error='raise', delta=None, dedup=None):
         """
         *parse data*
 
         * use pool to parse data
         * go through each tag of data
-        * logger.debug when tar is not in map (or record into list?)
-        * more like for one json record
-        """
-        self.gen_tblstr_by_map()
-        for jsuuid in self.json_data: # assume data are array of JSON records
-        # jsuuid = self.json_data
-            thisrec = [str(uuid.uuid4())]
-            thispath = ""
-            thisTblIdx = [tbl["rootPath"] for tbl in self.map["tableList"]].index(thispath) # root table
-            thisrec += [""] * (len(self.map["tableList"][thisTblIdx]["columnList"]))        # uuid and extra columns
-            thispool = []  # The work platform pool, instead of recursive
-            crt_path = []  # variable for path and pool
-            thisseqClmCnt = 0 # for this table, how many sequence variables
-            thisSeqVal = []   # for this record, value of sequence variables to make it unique
-            thispool.append((jsuuid, crt_path, thisrec, thisTblIdx, thisseqClmCnt, thisSeqVal))
-            while len(thispool) > 0: # work when thispool is not empty
-                poolCheckList = [(crt_tbl_idx, crt_seq_val) for (dummy, dummy, dummy, crt_tbl_idx, dummy, crt_seq_val) in thispool]
-                poolCheckVar = (thisTblIdx, thisSeqVal)
-                if poolCheckVar in poolCheckList: # this record have value in pool
-                    idxpool = poolCheckList.index(poolCheckVar) # work on this record from pool
-                else: # No value in this pool, ready to write to data
-                    strTblNm = self.map["tableList"][thisTblIdx]["tableName"]
-                    rowval = ''.join(thisrec[1 + seqClmCnt :])
-                    if len(rowval) > 0: # only store rows with values
-                        strRow = self.csv_delim.join(thisrec)
-                        # logger.debug(f"{strTblNm}:{strRow}({type(strRow)})")
-                        self.parsed_tables[strTblNm].append(strRow)
-                    # else:
-                    #     logger.debug(f"For table {strTblNm}, this record has value {rowval} (seqcmncnt: {seqClmCnt}) {thisrec}.")
-                    idxpool = 0 # Finish this record, get the first element in this pool
-                (jsonphase, crt_path, thisrec, thisTblIdx, seqClmCnt, thisSeqVal) = thispool.pop(idxpool)
-                if isinstance(jsonphase, collections.abc.MutableMapping):  # found a dict-like structure...
-                    for k, v in jsonphase.items():  # iterate over it; Python 2.x: source.iteritems()
-                        thispath = crt_path + [k]       # at this level, path and for pool
-                        if isinstance(v, str) or isinstance(v, int) or isinstance(v, float): # is there better way to check value?
-                            strpath = '.'.join(thispath)
-                            rootpathlen = len(self.map["tableList"][thisTblIdx]["rootPath"])
-                            strRelPath = strpath[rootpathlen+1:] if rootpathlen > 0 else strpath
-                            thisClmIdx = [clm["relativePath"] for clm in self.map["tableList"][thisTblIdx]["columnList"]].index(strRelPath)
-                            thisrec[1 + seqClmCnt + thisClmIdx] = str(v)
-                        else:
-                            thispool.append((v, thispath, thisrec, thisTblIdx, seqClmCnt, thisSeqVal))  # insert value and current path into pool
-                elif isinstance(jsonphase, collections.abc.Sequence) and not isinstance(jsonphase, str):
-                    #                                    Python 2.x: use basestring instead of str ^
-                    for idx, v in enumerate(jsonphase, start = 1): # loop through each element of Sequence
-                        newrec = thisrec[0:1+seqClmCnt] # obtain uuid and parent sequence value
-                        newrec.append(str(idx))         # append this sequence value
-                        newseqval = thisSeqVal.copy()
-                        newseqval.append(idx)           # also sequence value list
-                        newpath = crt_path              # sub table path
-                        newTblIdx = [tbl["rootPath"] for tbl in self.map["tableList"]].index('.'.join(newpath)) # must be one table
-                        newrec += [""] * (len(self.map["tableList"][newTblIdx]["columnList"])) # append extra columns based on table structure
-                        thispool.append((v, newpath, newrec, newTblIdx, seqClmCnt + 1, newseqval))  # insert into pool
-            # last record
-            strTblNm = self.map["tableList"][thisTblIdx]["tableName"]
-            rowval = ''.join(thisrec[1 + seqClmCnt :])
-            if len(rowval) > 0: # only store rows with values
-                strRow = self.csv_delim.join(thisrec)
-                # logger.debug(f"{strTblNm}:{strRow}({type(strRow)})")
-                self.parsed_tables[strTblNm].append(strRow)
-            # else:
-            #     logger.debug(f"For table {strTblNm}, this record has value {rowval} (seqcmncnt: {seqClmCnt}) {thisrec}.")
+        * call **RecordParser** out of this class for each record
+        * when data path is not in map, *unmapped* decides what to do:
+
+          * 'fail': raise UnmappedPathError (default)
+          * 'skip': ignore the value (whole array if the array is not in map)
+          * 'overflow': store value as JSON into overflow table (self.overflow_table_name), columns are OVERFLOW_COLUMNS
+        * paths not in map are counted, stored into **unmapped_summary** and returned
+        * *tables* (list of table names) and *columns* ({table name: list of column names}):
+          parse selected tables and columns only (projection, see **project_map_index**);
+          parts of data which lead only to tables not selected are not visited
+        * *where* (list of (path, operator, value) on root table) and *record_filter* (callable, input record):
+          parse selected records only, see **RecordFilter**; other records cost only lookup of *where* paths
+        * *on_error* (one of ERROR_POLICIES): when a record raises JsonParseError (like UnmappedPathError),
+          'raise' stops, 'quarantine' puts the record into **dead_letters** (none of its rows are kept) and goes on
+        * *delta* (delta.DeltaFilter): records same as in its hash index are skipped, new and changed records
+          get txn id from their key (records rejected by filter or put aside are not confirmed, see
+          delta.DeltaFilter.confirm); call *delta*.commit() after **parsed_tables** are loaded
+          (delete + insert by txn id, see **postgres_delta_sql**)
+        * *dedup* (dedup.Deduplicator): record with key (or content) seen before is dropped, counted as
+          'duplicates' in statistics
+        """
+        import uuid
+        map_index = self.get_map_index()
+        if tables is not None or columns is not None:
+            map_index = project_map_index(self.map, map_index, tables, columns)
+        self.gen_tblstr_by_map(map_index["selected"])
+        tblNames = map_index["tableName"] + [self.overflow_table_name()]
+        if unmapped == 'overflow':
+            self.parsed_tables[self.overflow_table_name()] = []
+        record_parser = RecordParser(self.map, map_index, unmapped = unmapped,
+                                     record_filter = self.make_record_filter(where, record_filter), on_error = on_error)
+        dup_idx = set()
+        if dedup is not None:
+            dup_idx = set(idx for idx, js in enumerate(self.json_data) if dedup.is_duplicate(js))
+            self.stats.count('duplicates', len(dup_idx))
+        delta_ids = None
+        if delta is not None:
+            from jsonparse.delta import DELTA_SKIPPED
+            delta_ids = delta.select([None if idx in dup_idx else js for idx, js in enumerate(self.json_data)])
+            if self.stats.enabled:
+                for idx, (status, dummy) in enumerate(delta_ids):
+                    if idx not in dup_idx:
+                        self.stats.count(f"delta_{status}")
+        confirmed = [] # delta records which gave rows
+        for idx, jsuuid in enumerate(self.json_data): # assume data are array of JSON records
+            if idx in dup_idx:
+                continue
+            txn_id = None
+            if delta_ids is not None:
+                (status, txn_id) = delta_ids[idx]
+                if status in DELTA_SKIPPED:
+                    continue
+            rows = record_parser.parse_safe(jsuuid, txn_id or str(uuid.uuid4()), idx)
+            if delta_ids is not None and len(rows) > 0:
+                confirmed.append(idx)
+            for (tblIdx, thisrec) in rows:
+                self.parsed_tables[tblNames[tblIdx]].append(self.csv_delim.join(thisrec))
+        if delta is not None:
+            delta.confirm(confirmed)
+        self.unmapped_summary = dict(record_parser.unmapped)
+        self.dead_letters = record_parser.dead_letters
+        if len(self.unmapped_summary) > 0:
+            logger.warning(f"{len(self.unmapped_summary)} paths not in map: {self.unmapped_summary}")
+        if len(self.dead_letters) > 0:
+            logger.warning(f"{len(self.dead_letters)} records put aside, see dead_letters")
+        if self.stats.enabled:
+            record_parser.report_stats(self.stats)
+            for tbl_nm, content in self.parsed_tables.items():
+                self.stats.add_rows(tbl_nm, len(content))
+        return self.unmapped_summary
+
+    def rebuild_json(self, value_type='infer'):
+        """
+        *rebuild JSON records from parsed tables*
 
+        * rows of **parsed_tables** are sorted by txn id, then rebuilt by rebuild.RecordBuilder with **map**
+          (rows of overflow table too)
+        * *value_type*: see rebuild.cell_value
+        * return {txn id: record}, in txn id order
+        """
+        from jsonparse.rebuild import RecordBuilder
+        builder = RecordBuilder(self.map, csv_delim = self.csv_delim, value_type = value_type,
+                                overflow_table = self.overflow_table_name())
+        streams = {nm: sorted(rows, key = lambda r: r.split(self.csv_delim, 1)[0])
+                   for nm, rows in self.parsed_tables.items()}
+        return dict(builder.rebuild(streams))
+
+    @timed_stage('write')
     def debug_csv_output(self, csv_file = None):
         """
         *debug output parsed csv content*
@@ -590,6 +1088,780 @@ class JsonUtils(object):
                 str_cont = '\n'.join(content)
                 f.write(f"{str_cont}\n")
 
+def compile_map(jmap):
+    """
+    *compile lookup indexes of map*
+
+    * This is out of CLASS **JsonUtils**
+    * *jmap* is JSON format map (python dictionary)
+    * instead of searching lists in map, parsing uses dictionary lookup
+    * tables with same root path (wide table split by **split_wide_tables**) share one row while parsing,
+      indexes of the row are kept by the first of them
+    * return python dictionary:
+
+      * **tableIndex**: table root path to table index (first table of root path)
+      * **columnIndex**: for each table, column relative path to column index in row
+      * **tableName**: table names
+      * **rootPathLength**: length of table root path
+      * **seqCount**: number of sequence variables of table
+      * **columnCount**: number of columns in row of table
+      * **extrasPosition**: for each table, position of extras column in row (None if no extras column)
+      * **prefixSet**: for each table, relative paths of objects which have columns or sub tables inside
+      * **splitParts**: for each table, None or list of (table index, first column, end column, with extras column):
+        row is cut into rows of these tables
+      * **rowSelected**: for each table, row is built (any table of its root path is selected)
+      * **flatArrays**: for each table, relative path of flattened array to its setting, see **flat_array_index**
+      * **dynamicRoots**: root path of dynamic-key table ("dynamicKeys" in map) to its table index;
+        values of the object at this path are elements of the table
+      * **selected**, **livePrefix**, **droppedColumns**: projection, see **project_map_index**
+    """
+    tbl_lst = jmap["tableList"]
+    seq_cnt = [len(tbl.get("seqList", None) or []) for tbl in tbl_lst]
+    (clm_index, extras_pos, split_parts) = row_layout(tbl_lst)
+    prefix_set = []
+    for idx, tbl in enumerate(tbl_lst):
+        rel_paths = list(clm_index[idx])
+        if len(tbl["rootPath"]) > 0:
+            sub_prefix = f"{tbl['rootPath']}."
+            rel_paths += [t["rootPath"][len(sub_prefix):] for t in tbl_lst if t["rootPath"].startswith(sub_prefix)]
+        else:
+            rel_paths += [t["rootPath"] for t in tbl_lst if len(t["rootPath"]) > 0]
+        prefix_set.append(path_prefixes(rel_paths))
+    table_index = dict()
+    for idx, tbl in enumerate(tbl_lst):
+        table_index.setdefault(tbl["rootPath"], idx)
+    return {
+        "version": MAP_INDEX_VERSION,
+        "tableIndex": table_index,
+        "columnIndex": clm_index,
+        "tableName": [tbl["tableName"] for tbl in tbl_lst],
+        "rootPathLength": [len(tbl["rootPath"]) for tbl in tbl_lst],
+        "seqCount": seq_cnt,
+        "columnCount": [len(idx) for idx in clm_index],
+        "extrasPosition": extras_pos,
+        "prefixSet": prefix_set,
+        "splitParts": split_parts,
+        "rowSelected": [True] * len(tbl_lst),
+        "flatArrays": flat_array_index(tbl_lst, clm_index),
+        "dynamicRoots": {tbl["rootPath"]: table_index[tbl["rootPath"]] for tbl in tbl_lst if tbl.get("dynamicKeys", False)},
+        "selected": [True] * len(tbl_lst),
+        "livePrefix": None, # no projection
+        "droppedColumns": [set() for tbl in tbl_lst],
+    }
+
+def flat_array_index(tbl_lst, clm_index):
+    """
+    *settings of flattened arrays for RecordParser*
+
+    * "flatArrays" of tables with same root path go to the first one (like columns, see **row_layout**)
+    * return list by table index: {relative array path: (mode, max length, delimiter, fields)};
+      fields is column index of whole array ('json', None if not selected),
+      list of (field tags, column index) ('delimited'), or None ('positional': columns found by path)
+    """
+    flat_index = [dict() for tbl in tbl_lst]
+    first = dict() # root path -> index of first table
+    for idx, tbl in enumerate(tbl_lst):
+        grp = first.setdefault(tbl["rootPath"], idx)
+        for flat in tbl.get("flatArrays", None) or []:
+            rel_path = flat["arrayPath"]
+            fields = None
+            if flat["mode"] == 'json':
+                fields = clm_index[grp].get(rel_path, None)
+            elif flat["mode"] == 'delimited':
+                prefix = f"{rel_path}.[]"
+                fields = [(p[len(prefix) + 1:].split('.') if len(p) > len(prefix) else [], pos)
+                          for p, pos in clm_index[grp].items() if p == prefix or p.startswith(f"{prefix}.")]
+            flat_index[grp][rel_path] = (flat["mode"], flat.get("maxLength", 0), flat.get("delimiter", ','), fields)
+    return flat_index
+
+def row_layout(tbl_lst, proj_lst=None):
+    """
+    *columns of row built by RecordParser for each table*
+
+    * tables with same root path share one row: first table of the root path gets columns of all of them,
+      in map order, then one extras column if any of them has it; other tables of the root path get no row
+    * columns (and extras column) of tables not selected are not in the row
+    * *proj_lst*: tables with selected columns (None for table not selected), see **projected_table_list**;
+      None for all tables and columns
+    * return (column indexes, extras positions, split parts), lists by table index (see **compile_map**)
+    """
+    proj_lst = tbl_lst if proj_lst is None else proj_lst
+    groups = dict() # root path -> table indexes
+    for idx, tbl in enumerate(tbl_lst):
+        groups.setdefault(tbl["rootPath"], []).append(idx)
+    clm_index = [dict() for tbl in tbl_lst]
+    extras_pos = [None] * len(tbl_lst)
+    split_parts = [None] * len(tbl_lst)
+    for members in groups.values():
+        first = members[0]
+        seq_cnt = len(tbl_lst[first].get("seqList", None) or [])
+        parts = []
+        pos = 0
+        for idx in members:
+            tbl = proj_lst[idx]
+            if tbl is None:
+                continue
+            start = pos
+            for clm in tbl["columnList"]:
+                clm_index[first][clm["relativePath"]] = pos
+                pos += 1
+            parts.append((idx, start, pos, tbl.get("extrasColumn", None) is not None))
+        # extras column of table not selected still takes values (dropped), they are not unmapped
+        if len(parts) > 0 and any(tbl_lst[idx].get("extrasColumn", None) is not None for idx in members):
+            extras_pos[first] = 1 + seq_cnt + pos # after uuid, sequences and columns
+        if len(members) > 1:
+            split_parts[first] = parts
+    return (clm_index, extras_pos, split_parts)
+
+def root_column_paths(jmap):
+    """
+    * relative paths of columns of root table (all root tables if it is split)
+    """
+    return set(clm["relativePath"] for tbl in jmap["tableList"] if len(tbl["rootPath"]) == 0
+               for clm in tbl["columnList"])
+
+def data_path(rel_path):
+    """
+    * data path of column relative path: positions of flattened array ('[1]', '[]') are removed;
+      '[value]' of dynamic-key table is kept (path of scalar values, see pathstore.discover_paths)
+    """
+    if '[' not in rel_path:
+        return rel_path
+    return '.'.join(tag for tag in rel_path.split('.')
+                    if not (tag.startswith('[') and tag.endswith(']')) or tag == DYNAMIC_VALUE_TAG)
+
+def column_name_path(path):
+    """
+    * path for column name: '[value]' of dynamic-key table is named 'value'
+    """
+    return f"{path[:-len(DYNAMIC_VALUE_TAG)]}value" if path.endswith(DYNAMIC_VALUE_TAG) else path
+
+def array_max_lengths(records, lengths=None):
+    """
+    *max length of each array in data*
+
+    * This is out of CLASS **JsonUtils**
+    * *records*: list (or iterator) of JSON records
+    * *lengths*: {array path: max length} to update, None for new one
+    * array path is dotted without array flag, same as **arraylist**
+    * return *lengths*
+    """
+    lengths = dict() if lengths is None else lengths
+    for record in records:
+        thispool = [(record, '')]
+        while len(thispool) > 0:
+            (jsonphase, crt_path) = thispool.pop()
+            if isinstance(jsonphase, collections.abc.MutableMapping):
+                for k, v in jsonphase.items():
+                    if not isinstance(v, (str, int, float)) and v is not None:
+                        thispool.append((v, f"{crt_path}.{k}" if len(crt_path) > 0 else k))
+            elif isinstance(jsonphase, collections.abc.Sequence) and not isinstance(jsonphase, str):
+                if len(jsonphase) > lengths.get(crt_path, 0):
+                    lengths[crt_path] = len(jsonphase)
+                for v in jsonphase:
+                    if not isinstance(v, (str, int, float)) and v is not None:
+                        thispool.append((v, crt_path))
+    return lengths
+
+def path_prefixes(path_list):
+    """
+    * all dotted prefixes of paths: 'a.b.c' gives 'a', 'a.b' and 'a.b.c'
+    """
+    prefixes = set()
+    for p in path_list:
+        tags = p.split('.')
+        for i in range(1, len(tags) + 1):
+            prefixes.add('.'.join(tags[:i]))
+    return prefixes
+
+def projected_table_list(jmap, tables=None, columns=None):
+    """
+    *tables and columns selected from map*
+
+    * This is out of CLASS **JsonUtils**
+    * *tables*: list of table names, None for all tables
+    * *columns*: {table name: list of column names}, tables not in it keep all columns
+    * return list in same order as *jmap* "tableList": None for table not selected,
+      or copy of table with selected columns (order of map)
+    * raise ValueError for unknown table or column name
+    """
+    tbl_names = [tbl["tableName"] for tbl in jmap["tableList"]]
+    columns = columns or dict()
+    for nm in list(tables or []) + list(columns):
+        if nm not in tbl_names:
+            raise ValueError(f"table {nm} is not in map")
+    selected = set(tbl_names if tables is None else tables) | set(columns)
+    tbl_lst = []
+    for tbl in jmap["tableList"]:
+        if tbl["tableName"] not in selected:
+            tbl_lst.append(None)
+            continue
+        clm_names = columns.get(tbl["tableName"], None)
+        if clm_names is None:
+            tbl_lst.append(tbl)
+            continue
+        all_names = [clm["columnName"] for clm in tbl["columnList"]]
+        for nm in clm_names:
+            if nm not in all_names:
+                raise ValueError(f"column {nm} is not in table {tbl['tableName']}")
+        new_tbl = dict(tbl)
+        new_tbl["columnList"] = [clm for clm in tbl["columnList"] if clm["columnName"] in clm_names]
+        tbl_lst.append(new_tbl)
+    return tbl_lst
+
+def project_map(jmap, tables=None, columns=None):
+    """
+    *map with selected tables and columns only*
+
+    * see **projected_table_list** for *tables* and *columns*
+    * use it for DDL and output columns of projected parsing
+    """
+    tbl_lst = [tbl for tbl in projected_table_list(jmap, tables, columns) if tbl is not None]
+    return {"tableNumber": len(tbl_lst), "tableList": tbl_lst}
+
+def project_map_index(jmap, map_index=None, tables=None, columns=None):
+    """
+    *lookup indexes of map for parsing selected tables and columns only*
+
+    * This is out of CLASS **JsonUtils**
+    * see **projected_table_list** for *tables* and *columns*
+    * table indexes are same as *jmap*; rows of table not selected are not built,
+      rows of selected table have selected columns only
+    * **livePrefix**: for each table, relative paths which lead to selected columns or selected sub tables;
+      **RecordParser** does not go into other objects and arrays of map
+    * **droppedColumns**: for each table, relative paths of columns not selected (not unmapped)
+    """
+    map_index = map_index if map_index is not None else compile_map(jmap)
+    tbl_lst = jmap["tableList"]
+    proj_lst = projected_table_list(jmap, tables, columns)
+    index = dict(map_index)
+    index["selected"] = [tbl is not None for tbl in proj_lst]
+    (index["columnIndex"], index["extrasPosition"], index["splitParts"]) = row_layout(tbl_lst, proj_lst)
+    index["flatArrays"] = flat_array_index(tbl_lst, index["columnIndex"])
+    index["columnCount"] = [len(clm_idx) for clm_idx in index["columnIndex"]]
+    row_selected = [False] * len(tbl_lst)
+    for idx, tbl in enumerate(tbl_lst):
+        if index["selected"][idx]:
+            row_selected[index["tableIndex"][tbl["rootPath"]]] = True
+    index["rowSelected"] = row_selected
+    index["droppedColumns"] = [set(map_index["columnIndex"][idx]) - set(index["columnIndex"][idx])
+                               for idx in range(len(tbl_lst))]
+    live_prefix = []
+    for idx, tbl in enumerate(tbl_lst):
+        rel_paths = list(index["columnIndex"][idx])
+        root_path = tbl["rootPath"]
+        for sub_idx, sub_tbl in enumerate(tbl_lst):
+            if not index["selected"][sub_idx] or sub_tbl["rootPath"] == root_path:
+                continue
+            if len(root_path) == 0:
+                rel_paths.append(sub_tbl["rootPath"])
+            elif sub_tbl["rootPath"].startswith(f"{root_path}."):
+                rel_paths.append(sub_tbl["rootPath"][len(root_path) + 1:])
+        live_prefix.append(path_prefixes(rel_paths))
+    index["livePrefix"] = live_prefix
+    return index
+
+def split_wide_tables(jmap, max_columns=PG_MAX_COLUMNS):
+    """
+    *map with wide tables split vertically*
+
+    * This is out of CLASS **JsonUtils**
+    * table with more than *max_columns* columns (uuid, sequences, columns and extras column) is split into
+      tables *name*, *name*_p2, *name*_p3 ... with same root path; each has uuid and sequences as key
+      (join on them to get the whole row), columns are kept in map order, extras column is in the last one
+    * table of map already split (like after new columns are added) gets next free *name*_pN of the first table
+    * **RecordParser** builds one row for tables with same root path, and cuts it into rows of these tables
+    * return new map (tables which are not split are same objects); raise ValueError if *max_columns*
+      can not hold key and one column
+    """
+    tbl_lst = []
+    names = set(tbl["tableName"] for tbl in jmap["tableList"])
+    base_names = dict() # root path -> name of first table
+    for tbl in jmap["tableList"]:
+        base_name = base_names.setdefault(tbl["rootPath"], tbl["tableName"])
+        key_cnt = 1 + len(tbl.get("seqList", None) or [])
+        extras_cnt = 0 if tbl.get("extrasColumn", None) is None else 1
+        clm_lst = tbl["columnList"]
+        if key_cnt + len(clm_lst) + extras_cnt <= max_columns:
+            tbl_lst.append(tbl)
+            continue
+        room = max_columns - key_cnt
+        if room < 1:
+            raise ValueError(f"max_columns {max_columns} can not hold key of table {tbl['tableName']} and one column")
+        chunks = [clm_lst[i:i + room] for i in range(0, len(clm_lst), room)]
+        if extras_cnt > 0 and len(chunks[-1]) == room:
+            chunks.append([]) # no room for extras column in last one
+        for part, chunk in enumerate(chunks, start=1):
+            new_tbl = {k: v for k, v in tbl.items() if k not in ("columnList", "extrasColumn")}
+            if part > 1:
+                num = 2
+                while f"{base_name}_p{num}" in names:
+                    num += 1
+                new_tbl["tableName"] = f"{base_name}_p{num}"
+                names.add(new_tbl["tableName"])
+            new_tbl["columnList"] = chunk
+            if extras_cnt > 0 and part == len(chunks):
+                new_tbl["extrasColumn"] = tbl["extrasColumn"]
+            tbl_lst.append(new_tbl)
+    new_map = dict(jmap)
+    new_map["tableNumber"] = len(tbl_lst)
+    new_map["tableList"] = tbl_lst
+    return new_map
+
+class RecordFilter(object):
+    """
+    *decide whether a record is parsed, before any row is built*
+
+    * This is out of CLASS **JsonUtils**
+    * *where*: list of conditions (path, operator, value), all must be true:
+
+      * path is dotted path of root table (not in array), like 'txn.store'
+      * operator is one of FILTER_OPERATORS; 'in' and 'not in' take list of values
+      * value is compared with JSON value as it is (no conversion): 3 and "3" are different
+      * path not in record, or values not comparable (like 3 < "a"): condition is false
+    * *func*: callable, input JSON record (python dictionary), output True to parse it;
+      called after *where* conditions; must be picklable (module level function) for worker processes
+    * *jmap*: if given, paths must be columns of root table of map (ValueError otherwise)
+    * only the paths of conditions are looked up, record is not traversed
+    """
+    def __init__(self, where=None, func=None, jmap=None):
+        self.conditions = []
+        for (path, op, value) in where or []:
+            if op not in FILTER_OPERATORS:
+                raise ValueError(f"operator must be one of {FILTER_OPERATORS}, not {op}")
+            if op in ('in', 'not in'):
+                value = list(value)
+            self.conditions.append((path.split('.'), op, value))
+        self.func = func
+        if jmap is not None:
+            root_paths = root_column_paths(jmap)
+            for (tags, op, value) in self.conditions:
+                if '.'.join(tags) not in root_paths:
+                    raise ValueError(f"filter path {'.'.join(tags)} is not column of root table")
+
+    def __call__(self, record):
+        for (tags, op, value) in self.conditions:
+            v = record
+            for tag in tags:
+                if not isinstance(v, collections.abc.Mapping) or tag not in v:
+                    return False # path not in record
+                v = v[tag]
+            try:
+                if op == '==':
+                    ok = v == value
+                elif op == '!=':
+                    ok = v != value
+                elif op == 'in':
+                    ok = v in value
+                elif op == 'not in':
+                    ok = v not in value
+                elif op == '<':
+                    ok = v < value
+                elif op == '<=':
+                    ok = v <= value
+                elif op == '>':
+                    ok = v > value
+                else:
+                    ok = v >= value
+            except TypeError: # not comparable
+                return False
+            if not ok:
+                return False
+        if self.func is not None:
+            return bool(self.func(record))
+        return True
+
+class RowPool(object):
+    """
+    *work pool of RecordParser.parse_record*
+
+    * entries are (value, path, row, table index, sequence count, sequence values), row key is
+      (table index, sequence values)
+    * **pop_row**: first entry of the row being built; **pop_first**: first entry of all
+    * same order as searching list of entries, but each entry is added and taken once:
+      record with thousands of array elements is not O(n^2)
+    """
+    __slots__ = ('order', 'rows', 'size')
+
+    def __init__(self):
+        self.order = collections.deque() # cells [entry, row key], entry is None when taken
+        self.rows = dict()               # row key -> deque of cells
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, entry):
+        key = (entry[3], tuple(entry[5]))
+        cell = [entry, key]
+        self.order.append(cell)
+        cells = self.rows.get(key, None)
+        if cells is None:
+            cells = self.rows[key] = collections.deque()
+        cells.append(cell)
+        self.size += 1
+
+    def take(self, cell, cells):
+        cells.popleft()
+        if len(cells) == 0:
+            del self.rows[cell[1]]
+        entry = cell[0]
+        cell[0] = None
+        self.size -= 1
+        return entry
+
+    def pop_row(self, key):
+        """
+        * first entry of row *key*, None if there is none
+        """
+        cells = self.rows.get(key, None)
+        if cells is None:
+            return None
+        return self.take(cells[0], cells)
+
+    def pop_first(self):
+        """
+        * first entry in pool (it is first of its row too)
+        """
+        cell = self.order.popleft()
+        while cell[0] is None: # taken by pop_row
+            cell = self.order.popleft()
+        return self.take(cell, self.rows[cell[1]])
+
+class RecordParser(object):
+    """
+    *parse JSON record using pool*
+
+    * This is out of CLASS **JsonUtils**
+    * pool instead of recursive: works with arbitrary array level
+    * *jmap* is JSON format map, *map_index* is compiled by **compile_map**
+    * one RecordParser is used for all records of one run; it keeps counters of the run:
+
+      * **record_count**: number of parsed records
+      * **record_index**: index of record being parsed in input (for errors), see **parse_record**
+      * **scalar_count**: number of scalar values visited
+      * **unmapped**: paths not in map with count
+    * *unmapped* is one of UNMAPPED_POLICIES, see **parse_use_pool** of **JsonUtils**
+    * for table with extras column, values not in map go to extras column instead (not counted as unmapped)
+    * with *map_index* from **project_map_index**, only selected tables and columns are parsed;
+      objects and arrays which lead to nothing selected are skipped, values in tables not selected are not unmapped
+    * rows of overflow table have table index **overflow_index** (after all tables in map)
+    * *record_filter* (like **RecordFilter**): record is not parsed if it returns False;
+      **filtered_count** counts these records
+    * *on_error* (one of ERROR_POLICIES) is used by **parse_safe**; records put aside are in **dead_letters**
+    * used by **parse_use_pool** and stream.ChunkParser
+    """
+    def __init__(self, jmap, map_index=None, unmapped='fail', record_filter=None, on_error='raise'):
+        if unmapped not in UNMAPPED_POLICIES:
+            raise ValueError(f"unmapped must be one of {UNMAPPED_POLICIES}, not {unmapped}")
+        if on_error not in ERROR_POLICIES:
+            raise ValueError(f"on_error must be one of {ERROR_POLICIES}, not {on_error}")
+        self.map = jmap
+        self.map_index = map_index if map_index is not None else compile_map(jmap)
+        self.unmapped_policy = unmapped
+        self.overflow_index = len(jmap["tableList"])
+        self.record_count = 0
+        self.record_index = None
+        self.scalar_count = 0
+        self.unmapped = collections.Counter()
+        self.record_filter = record_filter
+        self.filtered_count = 0
+        self.on_error = on_error
+        self.dead_letters = []
+
+    def unmapped_path(self, strpath, value, thisrec, tblIdx, seqClmCnt, rows):
+        """
+        *data path not in map*
+
+        * count it; raise error, skip or append overflow row to *rows* by policy
+        """
+        self.unmapped[strpath] += 1
+        if self.unmapped_policy == 'fail':
+            if isinstance(value, list):
+                raise UnmappedArrayError(strpath, self.record_index)
+            raise UnmappedPathError(strpath, self.record_index)
+        if self.unmapped_policy == 'overflow':
+            rows.append((self.overflow_index, [
+                thisrec[0],                             # uuid
+                self.map_index["tableName"][tblIdx],    # table of parent row
+                '.'.join(thisrec[1:1 + seqClmCnt]),     # sequence values of parent row
+                strpath,
+                json.dumps(value, separators = (',', ':')),
+            ]))
+
+    def flat_array(self, flat, values, crt_path, rel_path, thisrec, tblIdx, seqClmCnt, seqVal, pool, rows):
+        """
+        *array flattened into columns of the row* (see **flatten_array** of **JsonUtils**)
+
+        * 'json': whole array as JSON into its column
+        * 'delimited': for each field column, values of elements joined by delimiter
+        * 'positional': scalar element goes to its column; object element goes into *pool* with
+          position in path (like 'item.[2]'), as part of this row; position after max length is not in map
+        """
+        (mode, maxLen, delim, fields) = flat
+        keyLen = 1 + seqClmCnt
+        if mode == 'json':
+            if fields is not None:
+                thisrec[keyLen + fields] = json.dumps(values, separators = (',', ':'))
+            return
+        if mode == 'delimited':
+            for (tags, pos) in fields:
+                cells = []
+                for v in values:
+                    for tag in tags:
+                        v = v.get(tag, None) if isinstance(v, collections.abc.Mapping) else None
+                    cells.append(str(v) if isinstance(v, (str, int, float)) else '')
+                thisrec[keyLen + pos] = delim.join(cells) if any(len(c) > 0 for c in cells) else ''
+            return
+        clmIndex = self.map_index["columnIndex"][tblIdx]
+        extPos = self.map_index["extrasPosition"][tblIdx]
+        for idx, v in enumerate(values, start = 1):
+            if isinstance(v, (str, int, float)):
+                strRelPath = f"{rel_path}.[{idx}]"
+                thisClmIdx = clmIndex.get(strRelPath, None)
+                if thisClmIdx is not None:
+                    thisrec[keyLen + thisClmIdx] = str(v)
+                elif extPos is not None:
+                    add_extras(thisrec, extPos, strRelPath, v)
+                elif self.map_index["rowSelected"][tblIdx] and strRelPath not in self.map_index["droppedColumns"][tblIdx]:
+                    self.unmapped_path('.'.join(crt_path + [f"[{idx}]"]), v, thisrec, tblIdx, seqClmCnt, rows)
+            elif v is not None:
+                pool.append((v, crt_path + [f"[{idx}]"], thisrec, tblIdx, seqClmCnt, seqVal))
+
+    def dynamic_elements(self, obj, crt_path, thisrec, tblIdx, seqClmCnt, seqVal, pool, rows):
+        """
+        *values of dynamic-key object are elements of key/value table* (see pathstore.discover_paths)
+
+        * like elements of array: key goes to '[key]' column, scalar value to '[value]' column,
+          object value goes into *pool* as row of the table; array value is not in map
+        * null value gives no row
+        * return number of scalar values
+        """
+        clmIndex = self.map_index["columnIndex"][tblIdx]
+        extPos = self.map_index["extrasPosition"][tblIdx]
+        keyPos = clmIndex.get(DYNAMIC_KEY_TAG, None)
+        valuePos = clmIndex.get(DYNAMIC_VALUE_TAG, None)
+        keyLen = 2 + seqClmCnt # uuid, parent sequences and this sequence
+        clmCount = self.map_index["columnCount"][tblIdx]
+        scalarCnt = 0
+        for idx, (k, v) in enumerate(obj.items(), start = 1):
+            if v is None:
+                continue
+            newrec = thisrec[0:1+seqClmCnt]
+            newrec.append(str(idx))
+            newrec += [""] * clmCount
+            if extPos is not None:
+                newrec.append(None)
+            if keyPos is not None:
+                newrec[keyLen + keyPos] = str(k)
+            if not isinstance(v, collections.abc.MutableMapping):
+                if isinstance(v, (str, int, float)):
+                    scalarCnt += 1
+                if valuePos is not None and isinstance(v, (str, int, float)):
+                    newrec[keyLen + valuePos] = str(v)
+                elif extPos is not None:
+                    add_extras(newrec, extPos, DYNAMIC_VALUE_TAG, v)
+                elif self.map_index["rowSelected"][tblIdx] and DYNAMIC_VALUE_TAG not in self.map_index["droppedColumns"][tblIdx]:
+                    self.unmapped_path(f"{'.'.join(crt_path)}.{DYNAMIC_VALUE_TAG}", v, newrec, tblIdx, seqClmCnt + 1, rows)
+                v = dict() # row is finished from pool
+            pool.append((v, crt_path, newrec, tblIdx, seqClmCnt + 1, seqVal + [idx]))
+        return scalarCnt
+
+    def finish_row(self, tblIdx, thisrec, seqClmCnt, rows):
+        """
+        *row is complete*
+
+        * encode extras column as JSON
+        * append to *rows* if the row has any value and table is selected
+        * row of split wide table is cut into one row for each table of its root path (see **split_wide_tables**)
+        """
+        if not self.map_index["rowSelected"][tblIdx]:
+            return
+        extPos = self.map_index["extrasPosition"][tblIdx]
+        if extPos is not None:
+            ext = thisrec[extPos]
+            thisrec[extPos] = '' if ext is None else json.dumps(ext, separators = (',', ':'))
+        parts = self.map_index["splitParts"][tblIdx]
+        if parts is None:
+            rowval = ''.join(thisrec[1 + seqClmCnt :])
+            if len(rowval) > 0: # only store rows with values
+                rows.append((tblIdx, thisrec))
+            return
+        keyLen = 1 + seqClmCnt # uuid and sequences: key of all parts
+        for (partIdx, start, end, withExtras) in parts:
+            partrec = thisrec[:keyLen] + thisrec[keyLen + start : keyLen + end]
+            if withExtras:
+                partrec.append(thisrec[extPos])
+            if len(''.join(partrec[keyLen:])) > 0:
+                rows.append((partIdx, partrec))
+
+    def quarantine(self, error, record, record_index=None):
+        """
+        *put bad record aside*
+
+        * append dead letter (dictionary, keys are DEAD_LETTER_COLUMNS) to **dead_letters**
+        * *record* is JSON record, or string (like line which is not valid JSON)
+        """
+        self.dead_letters.append({
+            "record_index": record_index,
+            "error": type(error).__name__,
+            "path": getattr(error, "path", None),
+            "message": str(error),
+            "record": record if isinstance(record, str) else json.dumps(record, separators = (',', ':')),
+        })
+
+    def parse_safe(self, jsuuid, txn_id, record_index=None):
+        """
+        *parse one JSON record, errors by on_error*
+
+        * 'raise': same as **parse_record**
+        * 'quarantine': if JsonParseError is raised, record goes to **dead_letters**, return empty list
+        """
+        try:
+            return self.parse_record(jsuuid, txn_id, record_index)
+        except JsonParseError as e:
+            if self.on_error != 'quarantine':
+                raise
+            self.record_count += 1
+            self.quarantine(e, jsuuid, record_index)
+            return []
+
+    def parse_record(self, jsuuid, txn_id, record_index=None):
+        """
+        *parse one JSON record*
+
+        * *txn_id* is the value of first column (uuid) of all rows of this record
+        * *record_index*: position of record in input, reported by errors; default: **record_count**
+          (differs from position when records are skipped before parsing, like duplicates or unchanged delta)
+        * return list of (table index, row value list); only rows with values
+        * return empty list if *record_filter* rejects the record
+        """
+        self.record_index = self.record_count if record_index is None else record_index
+        if self.record_filter is not None and not self.record_filter(jsuuid):
+            self.record_count += 1
+            self.filtered_count += 1
+            return []
+        rows = []
+        tblIndex = self.map_index["tableIndex"]   # table rootPath -> table index
+        clmIndex = self.map_index["columnIndex"]  # for each table: relativePath -> column index
+        rootPathLen = self.map_index["rootPathLength"]
+        extrasPos = self.map_index["extrasPosition"]
+        prefixSet = self.map_index["prefixSet"]
+        clmCount = self.map_index["columnCount"]
+        selected = self.map_index["rowSelected"]
+        livePrefix = self.map_index["livePrefix"] # None: no projection
+        droppedClm = self.map_index["droppedColumns"]
+        flatArrays = self.map_index["flatArrays"]
+        dynamicRoots = self.map_index["dynamicRoots"]
+        scalarCnt = 0
+        thisrec = [txn_id]
+        thispath = ""
+        thisTblIdx = tblIndex[thispath] # root table
+        thisrec += [""] * clmCount[thisTblIdx]        # uuid and extra columns
+        if extrasPos[thisTblIdx] is not None:
+            thisrec.append(None) # extras column: python dictionary until row is complete
+        thispool = RowPool()  # The work platform pool, instead of recursive
+        crt_path = []  # variable for path and pool
+        seqClmCnt = 0  # for this table, how many sequence variables
+        thisSeqVal = []   # for this record, value of sequence variables to make it unique
+        thispool.append((jsuuid, crt_path, thisrec, thisTblIdx, seqClmCnt, thisSeqVal))
+        while len(thispool) > 0: # work when thispool is not empty
+            entry = thispool.pop_row((thisTblIdx, tuple(thisSeqVal))) # work on this record from pool
+            if entry is None: # No value in this pool, ready to write to data
+                self.finish_row(thisTblIdx, thisrec, seqClmCnt, rows)
+                entry = thispool.pop_first() # Finish this record, get the first element in this pool
+            (jsonphase, crt_path, thisrec, thisTblIdx, seqClmCnt, thisSeqVal) = entry
+            if isinstance(jsonphase, collections.abc.MutableMapping):  # found a dict-like structure...
+                if len(dynamicRoots) > 0:
+                    dynTblIdx = dynamicRoots.get('.'.join(crt_path), thisTblIdx)
+                    if dynTblIdx != thisTblIdx: # dynamic-key object: rows of key/value table
+                        scalarCnt += self.dynamic_elements(jsonphase, crt_path, thisrec, dynTblIdx, seqClmCnt,
+                                                           thisSeqVal, thispool, rows)
+                        continue
+                for k, v in jsonphase.items():  # iterate over it; Python 2.x: source.iteritems()
+                    thispath = crt_path + [k]       # at this level, path and for pool
+                    if isinstance(v, str) or isinstance(v, int) or isinstance(v, float): # is there better way to check value?
+                        scalarCnt += 1
+                        strpath = '.'.join(thispath)
+                        rootpathlen = rootPathLen[thisTblIdx]
+                        strRelPath = strpath[rootpathlen+1:] if rootpathlen > 0 else strpath
+                        thisClmIdx = clmIndex[thisTblIdx].get(strRelPath, None)
+                        if thisClmIdx is not None:
+                            thisrec[1 + seqClmCnt + thisClmIdx] = str(v)
+                        elif extrasPos[thisTblIdx] is not None:
+                            add_extras(thisrec, extrasPos[thisTblIdx], strRelPath, v)
+                        elif selected[thisTblIdx] and strRelPath not in droppedClm[thisTblIdx]:
+                            self.unmapped_path(strpath, v, thisrec, thisTblIdx, seqClmCnt, rows)
+                    else:
+                        if livePrefix is not None:
+                            strpath = '.'.join(thispath)
+                            rootpathlen = rootPathLen[thisTblIdx]
+                            strRelPath = strpath[rootpathlen+1:] if rootpathlen > 0 else strpath
+                            if strRelPath not in livePrefix[thisTblIdx] and (
+                                    strRelPath in prefixSet[thisTblIdx] or not selected[thisTblIdx]):
+                                continue # nothing selected inside
+                        if extrasPos[thisTblIdx] is not None and v is not None:
+                            strpath = '.'.join(thispath)
+                            rootpathlen = rootPathLen[thisTblIdx]
+                            strRelPath = strpath[rootpathlen+1:] if rootpathlen > 0 else strpath
+                            if strRelPath not in prefixSet[thisTblIdx]: # no column inside, whole value to extras
+                                add_extras(thisrec, extrasPos[thisTblIdx], strRelPath, v)
+                                continue
+                        thispool.append((v, thispath, thisrec, thisTblIdx, seqClmCnt, thisSeqVal))  # insert value and current path into pool
+            elif isinstance(jsonphase, collections.abc.Sequence) and not isinstance(jsonphase, str):
+                #                                    Python 2.x: use basestring instead of str ^
+                newTblIdx = tblIndex.get('.'.join(crt_path), None) # sub table
+                if newTblIdx is None:
+                    if len(flatArrays[thisTblIdx]) > 0:
+                        strpath = '.'.join(crt_path)
+                        rootpathlen = rootPathLen[thisTblIdx]
+                        strRelPath = strpath[rootpathlen+1:] if rootpathlen > 0 else strpath
+                        flat = flatArrays[thisTblIdx].get(strRelPath, None)
+                        if flat is not None: # array in columns of this table
+                            self.flat_array(flat, jsonphase, crt_path, strRelPath, thisrec, thisTblIdx, seqClmCnt,
+                                            thisSeqVal, thispool, rows)
+                            continue
+                    if len(jsonphase) > 0 and selected[thisTblIdx]:
+                        self.unmapped_path('.'.join(crt_path), jsonphase, thisrec, thisTblIdx, seqClmCnt, rows)
+                    continue
+                for idx, v in enumerate(jsonphase, start = 1): # loop through each element of Sequence
+                    newrec = thisrec[0:1+seqClmCnt] # obtain uuid and parent sequence value
+                    newrec.append(str(idx))         # append this sequence value
+                    newseqval = thisSeqVal.copy()
+                    newseqval.append(idx)           # also sequence value list
+                    newpath = crt_path              # sub table path
+                    newrec += [""] * clmCount[newTblIdx] # append extra columns based on table structure
+                    if extrasPos[newTblIdx] is not None:
+                        newrec.append(None)
+                    thispool.append((v, newpath, newrec, newTblIdx, seqClmCnt + 1, newseqval))  # insert into pool
+        # last record
+        self.finish_row(thisTblIdx, thisrec, seqClmCnt, rows)
+        self.record_count += 1
+        self.scalar_count += scalarCnt
+        return rows
+
+    def report_stats(self, stats):
+        """
+        * add counters of this run into *stats* (see stats.ParseStats)
+        """
+        stats.count('records', self.record_count)
+        stats.count('scalars', self.scalar_count)
+        stats.count('unmapped', sum(self.unmapped.values()))
+        stats.count('filtered', self.filtered_count)
+        stats.count('quarantined', len(self.dead_letters))
+
+def add_extras(thisrec, extPos, rel_path, value):
+    """
+    *put value into extras column of row*
+
+    * the extras column is python dictionary until the row is complete
+    * called by **RecordParser**
+    """
+    ext = thisrec[extPos]
+    if ext is None:
+        ext = thisrec[extPos] = dict()
+    ext[rel_path] = value
+
 def get_paths(source, flag_json_array):
     """ 
     *get full path*
@@ -642,6 +1914,44 @@ def get_path_pool(source, flag_json_array):
                 thispool.append((v, crt_path))          # insert value and current path into pool
     return paths
 
+def split_paths(allpathlist, flag_json_array):
+    """
+    *split raw paths into column paths and array paths*
+
+    * *allpathlist* is output of **get_paths** or **get_path_pool**
+    * path with *flag_json_array* is array (table later)
+    * object paths (not leaf) are removed from column paths
+    * return sorted (pathlist, arraylist)
+    * called by **compute_all_paths** and **sample_paths**
+    """
+    pathset = set()
+    arrset = set()
+    for path in allpathlist:
+        if flag_json_array in path:
+            path.remove(flag_json_array)
+            if len(path) > 0:
+                arrset.add('.'.join(path))
+        else:
+            pathset.add('.'.join(path))
+    arraylist = list(sorted(arrset))
+    objset = set() # object: path with other paths inside
+    for x in pathset:
+        tags = x.split('.')
+        objset.update('.'.join(tags[:i]) for i in range(1, len(tags)))
+    valid_list = [x for x in pathset if x not in arrset and x not in objset]
+    return (sorted(valid_list), arraylist)
+
+def sample_paths(json_data, flag_json_array, sample_size=None):
+    """
+    *compute paths on a sample of JSON data*
+
+    * only the first *sample_size* records are checked (all records if *None*)
+    * cheap version of **compute_all_paths**, used for schema fingerprint
+    * return sorted (pathlist, arraylist)
+    """
+    sample = json_data if sample_size is None else json_data[:sample_size]
+    return split_paths(get_paths(sample, flag_json_array), flag_json_array)
+
 def name_from_path(path, name_list):
     """ 
     *Get variable name from path*
@@ -651,6 +1961,7 @@ def name_from_path(path, name_list):
     * If exist in *name_list*, create random one for later to rename
     * called by **table_plan_json** and **add_new_path_to_map**
     """
+    import uuid
     elm = path.split('.')[-1]
     # while elm in name_list:
     while elm.upper() in [e.upper() for e in name_list]:
@@ -675,17 +1986,19 @@ def parse(json_data, column_list,
     """
     str_rst = ''
     clm_cnt = len(column_list)
+    has_value = False
     for clm_idx in range(clm_cnt):
         thispath = column_list[clm_idx]["relativePath"]
         thiscell = parse_tags_wo_arr(json_data, thispath)
         if thiscell is None:
             thiscell = ''
+        has_value = has_value or len(str(thiscell)) > 0
 
         if clm_idx == 0:
             str_rst = str(thiscell)
         else:
             str_rst = f"{str_rst}{csv_delim}{str(thiscell)}"
-    if len(str_rst) < clm_cnt:
+    if not has_value: # only store rows with values
         return ""
     thiscell = json_data[json_txn_id_name]
     if seq_list is None:
@@ -714,8 +2027,10 @@ def compute_table_content(json_data, seq_list, json_txn_id_name = 'txn_uuid'):
             current_tags = seq_path
 
             temp_list = []
-            js_arr = parse_tags_wo_arr(js, current_tags)
+            js_arr = parse_tags_wo_arr(js, current_tags) or [] # array not in record
             for idx, e in enumerate(js_arr, start = 1):
+                if not isinstance(e, dict): # null element: no row, position is kept
+                    continue
                 e.update({json_txn_id_name: js[json_txn_id_name]})
                 e.update({seq_list[0]["columnName"]: idx})
                 temp_list.append(e)
@@ -727,8 +2042,10 @@ def compute_table_content(json_data, seq_list, json_txn_id_name = 'txn_uuid'):
             temp_list = []
             for e_1 in js: # now js is array already
                 t1_arr = []
-                js_arr = parse_tags_wo_arr(e_1, current_tags)
+                js_arr = parse_tags_wo_arr(e_1, current_tags) or []
                 for idx, e in enumerate(js_arr, start=1):
+                    if not isinstance(e, dict): # null element: no row, position is kept
+                        continue
                     e.update({json_txn_id_name: e_1[json_txn_id_name]})
                     e.update({seq_list[0]["columnName"]: e_1[seq_list[0]["columnName"]]})
                     e.update({seq_list[1]["columnName"]: idx})
@@ -744,8 +2061,10 @@ def compute_table_content(json_data, seq_list, json_txn_id_name = 'txn_uuid'):
                 t1_arr = []
                 for e_2 in e_1: # now e_2 is also array
                     t2_arr = []
-                    js_arr = parse_tags_wo_arr(e_2, current_tags)
+                    js_arr = parse_tags_wo_arr(e_2, current_tags) or []
                     for idx, e in enumerate(js_arr, start=1):
+                        if not isinstance(e, dict): # null element: no row, position is kept
+                            continue
                         e.update({json_txn_id_name: e_2[json_txn_id_name]})
                         e.update({seq_list[0]["columnName"]: e_2[seq_list[0]["columnName"]]})
                         e.update({seq_list[1]["columnName"]: e_2[seq_list[1]["columnName"]]})
@@ -778,8 +2097,8 @@ def compute_table_content(json_data, seq_list, json_txn_id_name = 'txn_uuid'):
                 temp_list.append(t1_arr)
             js = temp_list
         else:
-            logger.error("Do we need this level?")
-            exit()
+            raise UnsupportedDepthError(f"{len(seq_list)} array levels, supports 3 (use RecordParser)",
+                                        path = seq_list[-1]["arrayPath"])
     return js
 
 def table_seq_list(path, arraylist):
@@ -796,13 +2115,14 @@ def table_seq_list(path, arraylist):
     * called by **table_plan_json**
     """
     seq_list = []
-    for tbl_p in reversed(arraylist):
-        if tbl_p in path:
+    for tbl_p in arraylist: # sorted: outer array first
+        if path == tbl_p or path.startswith(f"{tbl_p}."):
             tag = tbl_p.split('.')[-1]
             clm_nm = f"seq_{tag}"
+            if clm_nm in [e["columnName"] for e in seq_list]: # same tag at other level, like item.v.v
+                clm_nm = f"{clm_nm}_{len(seq_list) + 1}"
             seq_list.append({"columnName": clm_nm, "arrayPath": tbl_p})
-    rst = list(reversed(seq_list))
-    return rst
+    return seq_list
 
 def parse_tags_wo_arr(json_data, tags):
     """ 
@@ -828,6 +2148,8 @@ def parse_tags_wo_arr(json_data, tags):
 
 
 if __name__ == '__main__':
+    from datetime import datetime
+    import logzero
     crt_dir = os.getcwd()
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     # mylog = f"{crt_dir}/json_utils_{timestamp}.log"
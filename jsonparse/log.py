@@ -0,0 +1,37 @@
+"""
+The lazy logger
+===============
+
+- **File name**: log.py
+- **Arthor**: Luke Du
+- **Purpose**: Use logzero logger without importing logzero when package is imported.
+
+Importing logzero (and python logging module under it) is the most expensive
+part of importing this package. Short jobs which never write log do not need
+to pay it. The **logger** below imports logzero at the first use.
+
+* use `from jsonparse.log import logger` instead of `from logzero import logger`
+* log configuration (like `logzero.logfile`) works as before: **logger** is the logzero default logger
+"""
+
+class LazyLogger(object):
+    """
+    *logger proxy*
+
+    * import logzero at first attribute access (like *logger.info*)
+    * all attributes come from logzero default logger
+    """
+    def __getattr__(self, name):
+        from logzero import logger as logzero_logger
+        return getattr(logzero_logger, name)
+
+logger = LazyLogger()
+
+def logfile(filename, **kwargs):
+    """
+    *log to file*
+
+    * same as `logzero.logfile`
+    """
+    import logzero
+    logzero.logfile(filename, **kwargs)
@@ -0,0 +1,251 @@
+"""
+The map cache
+=============
+
+- **File name**: mapcache.py
+- **Arthor**: Luke Du
+- **Purpose**: Reuse generated (or user edited) JSON format map when feed schema does not change.
+
+A daily feed usually has the same structure. Instead of running
+**compute_all_paths** and **table_plan_json** for each job, the map is stored
+in a local cache folder, keyed by schema fingerprint (the set of distinct paths
+and arrays in data sample).
+
+* The map file in cache folder is same format as **json_map_export**, user can edit it
+* Least recently used maps are removed when cache has too many maps or too much size
+* Jobs can share a cache folder: index is changed under a file lock (read, change, write as one step),
+  each file is written to a temporary file first and moved into place
+
+MapCache CLASS
+--------------
+"""
+import os
+import json
+import time
+import hashlib
+
+def schema_fingerprint(pathlist, arraylist):
+    """
+    *compute structural fingerprint of JSON data*
+
+    * Based on *pathlist* and *arraylist* (see **sample_paths** in jsonutils)
+    * Order of paths does not matter
+    * return hex string
+    """
+    digest = hashlib.sha1()
+    for p in sorted(set(pathlist)):
+        digest.update(f"P:{p}\n".encode('utf-8'))
+    for a in sorted(set(arraylist)):
+        digest.update(f"A:{a}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+class IndexLock(object):
+    """
+    *exclusive lock of cache index between processes*
+
+    * lock file *path*; fcntl.flock on POSIX, msvcrt.locking on Windows
+    """
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def __enter__(self):
+        self.f = open(self.path, 'a+')
+        try:
+            import fcntl
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        except ImportError: # Windows
+            import msvcrt
+            self.f.seek(0)
+            msvcrt.locking(self.f.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.f.close() # releases lock
+        self.f = None
+
+def write_atomic(path, text):
+    """
+    * write *text* to temporary file, then move it to *path*: readers see old or new file, not part of it
+    """
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
+        f.write(text)
+    os.replace(tmp_file, path)
+
+class MapCache(object):
+    """
+    **variable member initialization in __init__ function**
+
+    - **cache_dir**: local folder to store maps; created when not exist
+    - **max_entries**: maximum number of maps in cache
+    - **max_bytes**: maximum total size of cache files (maps, their paths and index)
+    - **index**:
+
+      * stored as *index.json* in **cache_dir**, as read at last change (other jobs can change it)
+      * for each fingerprint: size of its files, last used time (mtime)
+      * paths and arrays of data of each map are in its own file (*fingerprint*.paths), not in index
+    """
+    index_name = 'index.json'
+    lock_name = 'index.lock'
+
+    def __init__(self,
+                 cache_dir = None,
+                 max_entries = 64,
+                 max_bytes = 64 * 1024 * 1024,
+                ):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok = True)
+        self.index = self._read_index()
+
+    def _index_file(self):
+        return os.path.join(self.cache_dir, self.index_name)
+
+    def _map_file(self, fingerprint):
+        return os.path.join(self.cache_dir, f"{fingerprint}.map")
+
+    def _paths_file(self, fingerprint):
+        return os.path.join(self.cache_dir, f"{fingerprint}.paths")
+
+    def _read_index(self):
+        if not os.path.exists(self._index_file()):
+            return {"entries": dict()}
+        with open(self._index_file(), 'r') as f:
+            index = json.load(f)
+        for fingerprint, entry in index["entries"].items():
+            if "paths" in entry: # index of older version: paths move to their own file
+                paths = json.dumps({"paths": entry.pop("paths"), "arrays": entry.pop("arrays")})
+                write_atomic(self._paths_file(fingerprint), paths)
+                entry["size"] += len(paths.encode('utf-8'))
+                entry.pop("created", None)
+                entry["mtime"] = entry.pop("lastUsed", 0) # ticks: older than any time, order kept
+        return index
+
+    def _change_index(self, change):
+        """
+        * read index, call *change* (with index entries), write index: all under lock; return result of *change*
+        """
+        with IndexLock(os.path.join(self.cache_dir, self.lock_name)):
+            self.index = self._read_index()
+            result = change(self.index["entries"])
+            write_atomic(self._index_file(), json.dumps(self.index))
+        return result
+
+    def _used_time(self, entries):
+        # later than any entry: order of use is kept when clock is coarse
+        return max([time.time()] + [e["mtime"] + 1e-6 for e in entries.values()])
+
+    def map_file(self, fingerprint):
+        """
+        *path of map file in cache*
+
+        * user can edit this file (JSON format map), the edited map will be used next time
+        """
+        return self._map_file(fingerprint)
+
+    def get(self, fingerprint):
+        """
+        *get map by fingerprint*
+
+        * return map (python dictionary) or *None* if not in cache
+        """
+        def use(entries):
+            if fingerprint not in entries:
+                return None
+            try:
+                with open(self._map_file(fingerprint), 'r') as f:
+                    text = f.read()
+            except FileNotFoundError: # map file removed by user
+                del entries[fingerprint]
+                return None
+            entries[fingerprint]["size"] = len(text.encode('utf-8')) + os.path.getsize(self._paths_file(fingerprint))
+            entries[fingerprint]["mtime"] = self._used_time(entries)
+            return text
+        if fingerprint not in self.index["entries"]:
+            self.index = self._read_index() # put by other job
+            if fingerprint not in self.index["entries"]:
+                return None
+        text = self._change_index(use)
+        return None if text is None else json.loads(text)
+
+    def get_paths(self, fingerprint):
+        """
+        *get data paths stored together with map*
+
+        * return (pathlist, arraylist)
+        """
+        with open(self._paths_file(fingerprint), 'r') as f:
+            paths = json.load(f)
+        return (paths["paths"], paths["arrays"])
+
+    def put(self, fingerprint, jmap, pathlist, arraylist):
+        """
+        *store map into cache*
+
+        * *pathlist* and *arraylist* are the data paths used to generate *jmap*
+        * evict least recently used maps if needed
+        """
+        mystr = json.dumps(jmap, indent=4)
+        paths = json.dumps({"paths": sorted(pathlist), "arrays": sorted(arraylist)})
+        write_atomic(self._map_file(fingerprint), mystr)
+        write_atomic(self._paths_file(fingerprint), paths)
+        def add(entries):
+            entries[fingerprint] = {
+                "size": len(mystr.encode('utf-8')) + len(paths.encode('utf-8')),
+                "mtime": self._used_time(entries),
+            }
+            self._evict(entries)
+        self._change_index(add)
+
+    def find_subset(self, pathlist, arraylist):
+        """
+        *find cached map which data paths are subset of giving paths*
+
+        * arrays must be the same (new array means new table, need re-plan)
+        * all cached paths must exist in *pathlist*
+        * if several maps match, the one with most paths is used
+        * return fingerprint or *None*
+        """
+        pathset = set(pathlist)
+        arrset = set(arraylist)
+        best = None
+        best_cnt = -1
+        self.index = self._read_index()
+        for fingerprint in self.index["entries"]:
+            try:
+                (paths, arrays) = self.get_paths(fingerprint)
+            except FileNotFoundError: # evicted by other job
+                continue
+            if set(arrays) != arrset:
+                continue
+            if len(paths) > best_cnt and pathset.issuperset(paths):
+                best = fingerprint
+                best_cnt = len(paths)
+        return best
+
+    def total_bytes(self):
+        """
+        * total size of cache files: maps, their paths and index file (as written from **index**)
+        """
+        index_size = len(json.dumps(self.index).encode('utf-8'))
+        return sum(e["size"] for e in self.index["entries"].values()) + index_size
+
+    def evict(self):
+        """
+        *remove least recently used maps*
+
+        * until number of maps not more than **max_entries** and size not more than **max_bytes**
+        * the most recent map is always kept
+        """
+        self._change_index(self._evict)
+
+    def _evict(self, entries):
+        lru = sorted(entries, key = lambda fp: entries[fp]["mtime"])
+        while len(lru) > 1 and (len(entries) > self.max_entries or self.total_bytes() > self.max_bytes):
+            fingerprint = lru.pop(0)
+            del entries[fingerprint]
+            for fn in (self._map_file(fingerprint), self._paths_file(fingerprint)):
+                if os.path.exists(fn):
+                    os.remove(fn)
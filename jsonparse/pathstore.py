@@ -0,0 +1,286 @@
+"""
+The path discovery for huge schemas
+===================================
+
+- **File name**: pathstore.py
+- **Arthor**: Luke Du
+- **Purpose**: Find paths of data in bounded memory: collapse dynamic keys, spill distinct paths to disk.
+
+Some feeds use values as object keys, like SKU ids::
+
+    {"stock": {"SKU-1001": {"qty": 3}, "SKU-1002": {"qty": 5}, ...}}
+
+Each key is a new path (stock.SKU-1001.qty), so the paths grow with the data
+and the map gets one column per key. **discover_paths** fixes this:
+
+* dynamic keys: an object with more than *key_threshold* distinct keys (over all records, at the same path)
+  is collapsed into a key/value child table, like an array of its values: column '[key]' has the key,
+  column '[value]' has scalar value, paths inside the values are columns of the child table
+  (see **JsonUtils.table_plan_json**, "dynamicKeys" of table in map)
+* spill: distinct paths are kept in **PathStore**; over *max_memory_paths* paths they are written into a
+  sorted SQLite file (temporary), and read back in sorted order at the end
+* column and array paths are split from the sorted paths one by one (**split_sorted_paths**): besides the
+  result lists, at most *max_memory_paths* paths (for each store) are in memory
+
+Keys of an object are counted until it is found dynamic; paths of the first
+keys (before it is found) are collapsed at the end.
+
+Functions and CLASS
+-------------------
+"""
+import os
+import heapq
+import collections.abc
+
+DYNAMIC_KEY_TAG = '[key]'     # relative path of key column of dynamic-key table
+DYNAMIC_VALUE_TAG = '[value]' # relative path of scalar value column of dynamic-key table
+_SEP = '\x01' # joins tags in SQLite, below any character of escaped tag (see _path_text)
+_ESCAPE = {0: '\x02\x02', 1: '\x02\x03', 2: '\x02\x04'} # characters \x00-\x02 of tags, in same order, no _SEP
+
+def _path_text(path):
+    """
+    * text of path (tuple of tags) in SQLite: text order is same as tuple order, for any characters in tags
+    """
+    return _SEP.join(tag.translate(_ESCAPE) for tag in path)
+
+def _path_tags(text):
+    """
+    * tuple of tags from **_path_text**
+    """
+    import re
+    return tuple(re.sub('\x02(.)', lambda m: chr(ord(m.group(1)) - 2), tag, flags = re.S) if '\x02' in tag else tag
+                 for tag in text.split(_SEP))
+
+class PathStore(object):
+    """
+    **variable member initialization in __init__ function**
+
+    - **max_memory_paths**: paths kept in memory before spill to disk; None: never spill
+    - **spill_dir**: folder of temporary SQLite file (default: system temporary folder)
+    - **paths**: distinct paths (tuples of tags) in memory
+    - **spill_count**: number of spills
+
+    Iteration gives distinct paths sorted by tags (children right after parent).
+    """
+    def __init__(self, max_memory_paths=None, spill_dir=None):
+        self.max_memory_paths = max_memory_paths
+        self.spill_dir = spill_dir
+        self.paths = set()
+        self.spill_count = 0
+        self._conn = None
+        self._file = None
+
+    def add(self, path):
+        """
+        * add path (tuple of tags); spill when there are too many in memory
+        """
+        self.paths.add(path)
+        if self.max_memory_paths is not None and len(self.paths) > self.max_memory_paths:
+            self.spill()
+
+    def spill(self):
+        """
+        * write paths in memory into SQLite file (distinct, sorted by primary key) and clear them
+        """
+        if self._conn is None:
+            import sqlite3
+            import tempfile
+            (fd, self._file) = tempfile.mkstemp(prefix = 'jsonparse_paths_', suffix = '.db', dir = self.spill_dir)
+            os.close(fd)
+            self._conn = sqlite3.connect(self._file)
+            self._conn.execute("create table paths (path text primary key) without rowid")
+        self._conn.executemany("insert or ignore into paths (path) values (?)", ((_path_text(p),) for p in self.paths))
+        self._conn.commit()
+        self.paths = set()
+        self.spill_count += 1
+
+    def __iter__(self):
+        in_memory = sorted(self.paths)
+        if self._conn is None:
+            return iter(in_memory)
+        on_disk = (_path_tags(row[0]) for row in self._conn.execute("select path from paths order by path"))
+        return _distinct(heapq.merge(in_memory, on_disk))
+
+    def close(self):
+        """
+        * remove SQLite file
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            os.remove(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _distinct(sorted_paths):
+    last = None
+    for p in sorted_paths:
+        if p != last:
+            yield p
+        last = p
+
+class PathWalker(object):
+    """
+    *paths of records, with dynamic keys collapsed*
+
+    * *store*: **PathStore** of paths found (tuples of tags, array flag after array path like **get_paths**)
+    * *key_threshold*: object with more distinct keys than this is dynamic; None: no collapse
+    * *dynamic*: set of dynamic object paths (dotted), known before and found (updated in place)
+    * *array_lengths*: if given (dictionary), max length of arrays (and dynamic objects) is put into it,
+      by dotted path of store (collapsed by **discover_paths**)
+    """
+    def __init__(self, store, flag_json_array='__JSON_array__', key_threshold=None, dynamic=None, array_lengths=None):
+        self.store = store
+        self.flag_json_array = flag_json_array
+        self.key_threshold = key_threshold
+        self.dynamic = set() if dynamic is None else dynamic
+        self.dynamic_tags = set(tuple(p.split('.')) for p in self.dynamic)
+        self.key_counts = dict() # object path -> distinct keys, until it is dynamic
+        self.array_lengths = array_lengths
+
+    def is_dynamic(self, path, obj):
+        """
+        * object at *path* is dynamic (known, or its distinct keys go over *key_threshold* now)
+        """
+        if path in self.dynamic_tags:
+            return True
+        if self.key_threshold is None or len(path) == 0: # root is never dynamic
+            return False
+        keys = self.key_counts.setdefault(path, set())
+        keys.update(obj.keys())
+        if len(keys) <= self.key_threshold:
+            return False
+        del self.key_counts[path]
+        self.dynamic_tags.add(path)
+        self.dynamic.add('.'.join(path))
+        return True
+
+    def walk(self, record):
+        """
+        * add paths of one record into *store*
+        * path in store has array flag after dynamic object path for its elements (like 'stock', flag, 'qty'),
+          so paths of elements are not taken as keys by **collapse**
+        """
+        add = self.store.add
+        flag = self.flag_json_array
+        lengths = self.array_lengths
+        pool = [(record, (), (), False)] # (value, path, path in store, value is element of key/value table)
+        while len(pool) > 0:
+            (value, path, spath, element) = pool.pop()
+            if isinstance(value, collections.abc.Mapping):
+                if not element and self.is_dynamic(path, value): # values are elements of key/value table
+                    if lengths is not None and len(value) > lengths.get('.'.join(spath), 0):
+                        lengths['.'.join(spath)] = len(value)
+                    for v in value.values():
+                        add(spath + (flag,))
+                        if isinstance(v, (str, int, float)):
+                            add(spath + (DYNAMIC_VALUE_TAG,))
+                        elif isinstance(v, collections.abc.Mapping):
+                            pool.append((v, path, spath + (flag,), True))
+                    continue
+                for k, v in value.items():
+                    add(spath + (k,))
+                    if not isinstance(v, (str, int, float)) and v is not None:
+                        pool.append((v, path + (k,), spath + (k,), False))
+            elif isinstance(value, collections.abc.Sequence) and not isinstance(value, str):
+                if lengths is not None and len(value) > lengths.get('.'.join(spath), 0):
+                    lengths['.'.join(spath)] = len(value)
+                for v in value:
+                    add(spath + (flag,))
+                    if not isinstance(v, (str, int, float)) and v is not None:
+                        pool.append((v, path, spath, False))
+
+    def collapsed(self):
+        """
+        *paths of store with dynamic keys collapsed*
+
+        * paths added before their object was found dynamic still have the key: it is removed
+          (scalar value: '[value]' path instead); yield paths as lists of tags
+        """
+        last = None
+        for path in self.store:
+            if last is not None:
+                yield self.collapse(last, path[:len(last)] != last) # nothing inside: scalar value
+            last = path
+        if last is not None:
+            yield self.collapse(last, True)
+
+    def collapse(self, path, leaf):
+        """
+        * path of store without keys and element flags of dynamic objects, *leaf*: path has nothing inside
+        """
+        flag = self.flag_json_array
+        out = []
+        idx = 0
+        while idx < len(path):
+            out.append(path[idx])
+            idx += 1
+            if idx == len(path) or tuple(out) not in self.dynamic_tags or path[idx] == DYNAMIC_VALUE_TAG:
+                continue
+            if path[idx] == flag: # element flag, or table flag at the end
+                if idx < len(path) - 1:
+                    idx += 1
+                continue
+            idx += 1 # key of dynamic object
+            if idx == len(path):
+                return out + [DYNAMIC_VALUE_TAG if leaf else flag]
+        return out
+
+def split_sorted_paths(paths, flag_json_array='__JSON_array__'):
+    """
+    *split distinct sorted paths into column paths and array paths*
+
+    * same result as jsonutils.split_paths, but *paths* (tuples of tags, array flag at the end of array path)
+      come sorted like **PathStore** (children right after parent), so no set of all paths is built:
+      path followed by a path inside it is object or array, not column
+    * return sorted (pathlist, arraylist)
+    """
+    pathlist = []
+    arrset = set()
+    last = None # column candidate
+    for path in paths:
+        if last is not None and (len(path) <= len(last) or tuple(path[:len(last)]) != last):
+            pathlist.append('.'.join(last)) # nothing inside
+        last = None
+        if path[-1] == flag_json_array:
+            if len(path) > 1:
+                arrset.add('.'.join(path[:-1]))
+        else:
+            last = tuple(path)
+    if last is not None:
+        pathlist.append('.'.join(last))
+    pathlist.sort()
+    return (pathlist, sorted(arrset))
+
+def discover_paths(records, flag_json_array='__JSON_array__', key_threshold=None, max_memory_paths=None,
+                   dynamic=None, array_lengths=None, spill_dir=None):
+    """
+    *compute all paths of records in bounded memory*
+
+    * This is out of CLASS **JsonUtils**
+    * *records*: iterable of JSON records
+    * *key_threshold*, *dynamic*, *array_lengths*: see **PathWalker**
+    * *max_memory_paths*, *spill_dir*: see **PathStore**
+    * return sorted (pathlist, arraylist) like jsonutils.split_paths; dynamic objects are in arraylist
+      (tables) and in *dynamic*
+    * collapsed paths go into a second **PathStore** (same limit), to come back distinct and sorted
+      for **split_sorted_paths**
+    """
+    with PathStore(max_memory_paths, spill_dir) as store, PathStore(max_memory_paths, spill_dir) as collapsed:
+        walker = PathWalker(store, flag_json_array, key_threshold, dynamic, array_lengths)
+        for record in records:
+            walker.walk(record)
+        if len(walker.dynamic_tags) == 0:
+            return split_sorted_paths(store, flag_json_array)
+        if array_lengths is not None: # lengths found before collapse
+            for path in list(array_lengths):
+                length = array_lengths.pop(path)
+                path = '.'.join(walker.collapse(tuple(path.split('.')), False))
+                array_lengths[path] = max(length, array_lengths.get(path, 0))
+        for path in walker.collapsed():
+            collapsed.add(tuple(path))
+        return split_sorted_paths(collapsed, flag_json_array)
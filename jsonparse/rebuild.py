@@ -0,0 +1,359 @@
+"""
+The reverse parse
+=================
+
+- **File name**: rebuild.py
+- **Arthor**: Luke Du
+- **Purpose**: Rebuild nested JSON records from parsed tables, using the same map.
+
+After data are corrected in the tables, downstream APIs still want the
+nested JSON. **RecordBuilder** goes the other way of **RecordParser**:
+
+* input is rows of each table (like **parsed_tables**, table files or a database query), each stream
+  sorted by uuid (then sequence columns); rows of one uuid are merged from all streams (merge join),
+  so only rows of one transaction are in memory
+* each row goes to its place by the sequence columns: element *seq_x* of the array at table root path
+  inside the element of its parent table (root table: the record itself)
+* columns go to their relative path; flattened arrays (see **JsonUtils.flatten_array**), extras
+  column and rows of overflow table are put back too
+* row of key/value table (dynamic-key object, see pathstore.discover_paths) is the value of its key
+  inside the object at table root path
+* tables keep text only: *value_type* 'infer' gives back numbers and booleans from their text
+  (so string "12" comes back as number 12), 'text' keeps all values as strings
+
+Lost by parsing, so not rebuilt: null values, empty strings, empty arrays and
+objects, and arrays not in map (unless they are in overflow table). Element
+of array without any row is null. Rebuilt record parsed again with the same
+map and txn id gives the same rows.
+
+Functions and CLASS
+-------------------
+"""
+import re
+import json
+
+REBUILD_VALUE_TYPES = ('infer', 'text')
+
+_INT_TEXT = re.compile(r'(0|-?[1-9][0-9]*)$') # as written by str(int): no '-0', no leading zero
+
+def cell_value(text, value_type='infer'):
+    """
+    *JSON value of table cell*
+
+    * *value_type* 'text': the text itself
+    * *value_type* 'infer': 'True' and 'False' (as written by parser) are boolean, integer text is int,
+      float text is float when the parser would write the same text for it; others are string
+    """
+    if value_type == 'text' or not isinstance(text, str):
+        return text
+    if text == 'True' or text == 'False':
+        return text == 'True'
+    if _INT_TEXT.match(text):
+        return int(text)
+    if text[-1:].isdigit() or text in ('inf', '-inf', 'nan'):
+        try:
+            v = float(text)
+        except ValueError:
+            return text
+        if str(v) == text:
+            return v
+    return text
+
+def position_tag(tag):
+    """
+    * position of flattened array tag ('[2]' is 2, '[]' is 0), None for key
+    """
+    if tag.startswith('[') and tag.endswith(']'):
+        return int(tag[1:-1]) if len(tag) > 2 else 0
+    return None
+
+def set_path(node, tags, value):
+    """
+    *put value at path inside object*
+
+    * *tags* are keys, or positions like '[2]' (element of list, from 1); missing objects and lists
+      are created, missing elements are null
+    """
+    for idx, tag in enumerate(tags):
+        last = idx == len(tags) - 1
+        pos = position_tag(tag)
+        if pos is None:
+            if last:
+                node[tag] = value
+            elif not isinstance(node.get(tag, None), (dict, list)):
+                node[tag] = [] if position_tag(tags[idx + 1]) is not None else dict()
+            if not last:
+                node = node[tag]
+            continue
+        if len(node) < pos:
+            node.extend([None] * (pos - len(node)))
+        if last:
+            node[pos - 1] = value
+        else:
+            if not isinstance(node[pos - 1], (dict, list)):
+                node[pos - 1] = [] if position_tag(tags[idx + 1]) is not None else dict()
+            node = node[pos - 1]
+
+def get_dict(node, tags):
+    """
+    * object at path inside object, created (with objects on the way) if not there
+    """
+    for tag in tags:
+        if not isinstance(node.get(tag, None), dict):
+            node[tag] = dict()
+        node = node[tag]
+    return node
+
+def get_list(node, tags):
+    """
+    * list at path inside object, created (with objects on the way) if not there
+    """
+    for tag in tags[:-1]:
+        if not isinstance(node.get(tag, None), dict):
+            node[tag] = dict()
+        node = node[tag]
+    if not isinstance(node.get(tags[-1], None), list):
+        node[tags[-1]] = []
+    return node[tags[-1]]
+
+class RecordBuilder(object):
+    """
+    **variable member initialization in __init__ function**
+
+    - **map**: JSON format map, same as used to parse the rows
+    - **csv_delim**: delimiter of row text (row can also be list of values, or dictionary by column name)
+    - **value_type**: one of REBUILD_VALUE_TYPES, see **cell_value**
+    - **overflow_table**: name of overflow table (columns OVERFLOW_COLUMNS), its values are put back too
+    - **record_count**: number of rebuilt records
+    - **dynamic**: root paths of key/value tables (dynamic-key objects)
+    """
+    def __init__(self, jmap, csv_delim=',', value_type='infer', overflow_table=None):
+        if value_type not in REBUILD_VALUE_TYPES:
+            raise ValueError(f"value_type must be one of {REBUILD_VALUE_TYPES}, not {value_type}")
+        self.map = jmap
+        self.csv_delim = csv_delim
+        self.value_type = value_type
+        self.overflow_table = overflow_table
+        self.record_count = 0
+        tbl_lst = jmap["tableList"]
+        self.table_index = {tbl["tableName"]: idx for idx, tbl in enumerate(tbl_lst)}
+        self.root_path = [tbl["rootPath"] for tbl in tbl_lst]
+        self.seq_count = [len(tbl.get("seqList", None) or []) for tbl in tbl_lst]
+        self.path_seq_count = {tbl["rootPath"]: cnt for tbl, cnt in zip(tbl_lst, self.seq_count)}
+        self.root_by_name = {tbl["tableName"]: tbl["rootPath"] for tbl in tbl_lst}
+        self.dynamic = set(tbl["rootPath"] for tbl in tbl_lst if tbl.get("dynamicKeys", False))
+        # flattened arrays of tables with same root path (split wide table) are used together
+        flat_by_root = dict()
+        for tbl in tbl_lst:
+            flat_by_root.setdefault(tbl["rootPath"], []).extend(tbl.get("flatArrays", None) or [])
+        self.columns = []   # by table: list of (tags, kind, delimiter)
+        self.extras = []    # by table: with extras column
+        self.column_names = []
+        for tbl in tbl_lst:
+            flats = flat_by_root[tbl["rootPath"]]
+            json_paths = set(f["arrayPath"] for f in flats if f["mode"] == 'json')
+            delims = {f["arrayPath"]: f.get("delimiter", ',') for f in flats if f["mode"] == 'delimited'}
+            clms = []
+            for clm in tbl["columnList"]:
+                rel_path = clm["relativePath"]
+                tags = rel_path.split('.')
+                if tbl["rootPath"] in self.dynamic and rel_path in ('[key]', '[value]'):
+                    clms.append((tags, rel_path, None)) # used for element itself, see build
+                elif rel_path in json_paths:
+                    clms.append((tags, 'json', None))
+                elif '[]' in tags:
+                    clms.append((tags, 'delimited', delims.get('.'.join(tags[:tags.index('[]')]), ',')))
+                else:
+                    clms.append((tags, 'value', None))
+            self.columns.append(clms)
+            self.extras.append(tbl.get("extrasColumn", None) is not None)
+            seq_names = [e["columnName"] for e in tbl.get("seqList", None) or []]
+            extras = [tbl["extrasColumn"]] if self.extras[-1] else []
+            self.column_names.append(["uuid"] + seq_names + [clm["columnName"] for clm in tbl["columnList"]] + extras)
+
+    def split_row(self, names, row):
+        """
+        * row as list of values: text is split by **csv_delim**, dictionary is taken by column *names*
+        """
+        if isinstance(row, str):
+            return row.rstrip('\r\n').split(self.csv_delim)
+        if isinstance(row, dict):
+            return [row.get(nm, None) for nm in names]
+        return list(row)
+
+    def parent_node(self, containers, root_path, seq):
+        """
+        * (parent element, relative path tags) of element at table root path with sequence values seq;
+          parent is nearest table root path around *root_path*
+        """
+        parent_path = ''
+        for path in self.path_seq_count:
+            if root_path.startswith(f"{path}.") and len(path) > len(parent_path):
+                parent_path = path
+        parent = self.element(containers, parent_path, seq[:self.path_seq_count.get(parent_path, 0)])
+        rel_path = root_path[len(parent_path) + 1:] if len(parent_path) > 0 else root_path
+        return (parent, rel_path.split('.'))
+
+    def element(self, containers, root_path, seq, dyn_key=None):
+        """
+        *object of array element at table root path with sequence values seq*
+
+        * parent element is found (or created) first, see **parent_node**
+        * element without any row of its own is created as empty object
+        * element of key/value table is value of *dyn_key* (sequence value if not known)
+        """
+        key = (root_path, seq)
+        node = containers.get(key, None)
+        if node is not None:
+            return node
+        (parent, tags) = self.parent_node(containers, root_path, seq)
+        if root_path in self.dynamic:
+            obj = get_dict(parent, tags)
+            dyn_key = str(seq[-1]) if dyn_key is None else dyn_key
+            if not isinstance(obj.get(dyn_key, None), dict):
+                obj[dyn_key] = dict()
+            node = containers[key] = obj[dyn_key]
+            return node
+        arr = get_list(parent, tags)
+        pos = seq[-1]
+        if len(arr) < pos:
+            arr.extend([None] * (pos - len(arr)))
+        if not isinstance(arr[pos - 1], dict):
+            arr[pos - 1] = dict()
+        node = containers[key] = arr[pos - 1]
+        return node
+
+    def put_value(self, node, tags, kind, delim, cell):
+        """
+        * put value of one column into element *node*
+        """
+        if kind == 'json':
+            set_path(node, tags, json.loads(cell) if isinstance(cell, str) else cell)
+            return
+        if kind == 'value':
+            set_path(node, tags, cell_value(cell, self.value_type))
+            return
+        cut = tags.index('[]')
+        arr = get_list(node, tags[:cut])
+        cells = cell.split(delim)
+        if len(arr) < len(cells):
+            arr.extend([None] * (len(cells) - len(arr)))
+        for pos, text in enumerate(cells, start = 1):
+            if len(text) == 0:
+                continue
+            if cut == len(tags) - 1: # array of scalars
+                arr[pos - 1] = cell_value(text, self.value_type)
+            else:
+                set_path(arr, [f"[{pos}]"] + tags[cut + 1:], cell_value(text, self.value_type))
+
+    def build(self, table_rows):
+        """
+        *rebuild one record*
+
+        * *table_rows*: {table index: list of rows (lists of values)} of one txn id; index of
+          **overflow_table** is after all tables of map
+        * return the record (python dictionary)
+        """
+        record = dict()
+        containers = {('', ()): record}
+        items = table_rows.items()
+        if len(self.dynamic) > 0: # parent elements first: element of key/value table needs its key
+            items = sorted(items, key = lambda t: (t[0] == len(self.root_path), self.seq_count[t[0]]
+                                                   if t[0] < len(self.root_path) else 0, t[0]))
+        for tblIdx, rows in items:
+            if tblIdx == len(self.root_path): # overflow table: uuid, table name, seq, path, value
+                for row in rows:
+                    root_path = self.root_by_name[row[1]]
+                    seq = tuple(int(s) for s in row[2].split('.')) if row[2] else ()
+                    node = self.element(containers, root_path, seq)
+                    rel_path = row[3][len(root_path) + 1:] if len(root_path) > 0 else row[3]
+                    set_path(node, rel_path.split('.'), json.loads(row[4]) if isinstance(row[4], str) else row[4])
+                continue
+            root_path = self.root_path[tblIdx]
+            keyLen = 1 + self.seq_count[tblIdx]
+            clms = self.columns[tblIdx]
+            dyn_pos = {kind: pos for pos, (tags, kind, delim) in enumerate(clms) if kind in ('[key]', '[value]')}
+            for row in rows:
+                seq = tuple(int(s) for s in row[1:keyLen])
+                dyn_key = row[keyLen + dyn_pos['[key]']] if '[key]' in dyn_pos else None
+                if '[value]' in dyn_pos and row[keyLen + dyn_pos['[value]']] not in (None, ''): # scalar value
+                    (parent, tags) = self.parent_node(containers, root_path, seq)
+                    get_dict(parent, tags)[dyn_key or str(seq[-1])] = cell_value(row[keyLen + dyn_pos['[value]']],
+                                                                                  self.value_type)
+                    continue
+                node = self.element(containers, root_path, seq, dyn_key or None)
+                for (tags, kind, delim), cell in zip(clms, row[keyLen:]):
+                    if cell is None or cell == '' or kind in dyn_pos:
+                        continue
+                    self.put_value(node, tags, kind, delim, cell)
+                if self.extras[tblIdx]:
+                    ext = row[keyLen + len(clms)] if len(row) > keyLen + len(clms) else None
+                    if isinstance(ext, str):
+                        ext = json.loads(ext) if len(ext) > 0 else None
+                    for rel_path, value in (ext or dict()).items():
+                        set_path(node, rel_path.split('.'), value)
+        self.record_count += 1
+        return record
+
+    def merge_txn(self, streams):
+        """
+        *merge join of row streams by uuid*
+
+        * *streams*: {table name: iterable of rows}, each sorted by uuid; **overflow_table** can be one of them
+        * yield (txn id, {table index: rows}), txn ids in sorted order
+        * raise ValueError if table is not in map, or rows of a stream are not sorted by uuid
+        """
+        iters = [] # (table index, table name, column names, iterator)
+        for nm, rows in streams.items():
+            if nm == self.overflow_table and nm is not None:
+                tblIdx = len(self.root_path)
+                from jsonparse.jsonutils import OVERFLOW_COLUMNS
+                names = OVERFLOW_COLUMNS
+            elif nm in self.table_index:
+                tblIdx = self.table_index[nm]
+                names = self.column_names[tblIdx]
+            else:
+                raise ValueError(f"table {nm} is not in map")
+            iters.append((tblIdx, nm, names, iter(rows)))
+        heads = []
+        for (tblIdx, nm, names, it) in iters:
+            row = next(it, None)
+            heads.append(None if row is None else self.split_row(names, row))
+        while True:
+            live = [row[0] for row in heads if row is not None]
+            if len(live) == 0:
+                return
+            txn = min(live)
+            table_rows = dict()
+            for i, (tblIdx, nm, names, it) in enumerate(iters):
+                while heads[i] is not None and heads[i][0] == txn:
+                    table_rows.setdefault(tblIdx, []).append(heads[i])
+                    row = next(it, None)
+                    heads[i] = None if row is None else self.split_row(names, row)
+                    if heads[i] is not None and heads[i][0] < txn:
+                        raise ValueError(f"rows of table {nm} are not sorted by uuid: {heads[i][0]} after {txn}")
+            yield (txn, table_rows)
+
+    def rebuild(self, streams):
+        """
+        *rebuild records from row streams*
+
+        * *streams*: see **merge_txn**
+        * yield (txn id, record), one transaction in memory at a time
+        """
+        for (txn, table_rows) in self.merge_txn(streams):
+            yield (txn, self.build(table_rows))
+
+def rebuild_records(jmap, streams, csv_delim=',', value_type='infer', overflow_table=None):
+    """
+    *rebuild JSON records from parsed tables*
+
+    * This is out of CLASS **JsonUtils**
+    * *streams*: {table name: iterable of rows}, each sorted by uuid (and sequence columns); tables
+      can be left out (their values are not in records)
+    * row: text (values joined by *csv_delim*, like **parsed_tables**), list of values (like rows of csv
+      reader or database cursor), or dictionary by column name (like jsonl output)
+    * yield (txn id, record) in txn id order, see **RecordBuilder**
+    """
+    builder = RecordBuilder(jmap, csv_delim = csv_delim, value_type = value_type, overflow_table = overflow_table)
+    return builder.rebuild(streams)
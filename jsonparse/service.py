@@ -0,0 +1,397 @@
+"""
+The parse service
+=================
+
+- **File name**: service.py
+- **Arthor**: Luke Du
+- **Purpose**: Long running parse worker: warm maps, worker pools and database connections for stream of small batches.
+
+Each run of the command line tool loads the map, compiles its lookup indexes,
+starts worker processes and connects to the database, then parses the
+batch. For a stream of small batches this setup is most of the time.
+**ParseService** keeps them between batches:
+
+* maps of several feeds in a least recently used cache (at most *max_maps*), each with its
+  stream.ChunkParser and (with *workers*) its stream.WorkerPool; a map file changed on disk is loaded again
+* database connections by DSN (like PostgreSQL connection string), rows are loaded with COPY
+* batches come as JSON lines requests on standard input (**serve**) or a local socket (**serve_socket**),
+  one response line for each request
+
+Request (one JSON object in one line)::
+
+    {"feed": "sales", "records": [{...}, "{...}"], "dsn": "dbname=gap", "schema": "gap"}
+
+* *feed*: name of feed given to **ParseService** (*feeds*); map files are only those of *feeds*, a request
+  can not give a map file (a .bin map is unpickled when loaded)
+* *records*: JSON records, objects or JSON strings
+* output: *dsn* (and *schema*): load into database; *out_dir*: append to table files
+  (like stream.TableWriter), folder inside *out_root* of **ParseService**; neither: rows are in response (*tables*)
+* *command* 'status': feeds in cache and counters; 'shutdown': stop after response
+
+Response: `{"ok": true, "feed": ..., "records": 3, "rows": {table name: rows}, "seconds": ...}`,
+or `{"ok": false, "error": "MapError: ..."}`; the service goes on with next request.
+
+TCP socket listens on loopback address only (like 'localhost:7070'), unless
+*allow_remote* of **serve_socket**: requests are not authenticated.
+
+Functions and CLASS
+-------------------
+"""
+import os
+import sys
+import json
+import time
+from collections import OrderedDict
+
+from jsonparse.stream import ChunkParser, TableWriter, WorkerPool, iter_chunks, parse_chunks
+
+SERVICE_COMMANDS = ('parse', 'status', 'shutdown')
+
+def copy_rows(conn, table_name, lines, columns=None, schema_name=None, fmt='csv', csv_delim='|'):
+    """
+    *load encoded lines into database table with COPY*
+
+    * *conn*: DB-API connection with `cursor().copy_expert` (psycopg2); not committed here
+    * *fmt* and *csv_delim* must be same as **ChunkParser** ('csv' or 'text'); 'text' is not escaped,
+      values with backslash, newline, CR or *csv_delim* are loaded wrong, use 'csv'
+    * *columns*: column names of table, like stream.table_columns; None for all columns in DDL order
+    """
+    import io
+    if fmt not in ('text', 'csv'):
+        raise ValueError(f"output format {fmt} can not be loaded with COPY")
+    target = table_name if schema_name is None else f"{schema_name}.{table_name}"
+    clms = '' if columns is None else f" ({', '.join(columns)})"
+    delim = csv_delim.replace("'", "''")
+    sql = f"copy {target}{clms} from stdin with (format {fmt}, delimiter '{delim}')"
+    with conn.cursor() as cur:
+        cur.copy_expert(sql, io.StringIO(''.join(f"{line}\n" for line in lines)))
+
+def is_loopback(host):
+    """
+    * all addresses of *host* are loopback (like 'localhost', '127.0.0.1', '::1'); '' (all interfaces) is not
+    """
+    import socket
+    import ipaddress
+    if host == '':
+        return False
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.gaierror:
+        return False
+    return len(infos) > 0 and all(ipaddress.ip_address(info[4][0].split('%', 1)[0]).is_loopback for info in infos)
+
+class WarmFeed(object):
+    """
+    **variable member initialization in __init__ function**
+
+    - **map_file**: map file of feed (.map/.json, .csv or .bin)
+    - **mtime**: modified time of map file when loaded
+    - **ju**: JsonUtils with map loaded
+    - **chunk_parser**: stream.ChunkParser of map
+    - **pool**: stream.WorkerPool, started at first batch when *workers* is more than 1
+    - **records**: records parsed by this feed (index of first record of next batch, for txn id)
+    """
+    def __init__(self, map_file, workers=1, fmt='csv', csv_delim='|', start_method=None, stats=None,
+                 unmapped='fail', on_error='raise'):
+        from jsonparse.cli import load_map
+        from jsonparse.jsonutils import JsonUtils
+        self.map_file = map_file
+        self.mtime = os.path.getmtime(map_file)
+        self.workers = workers
+        self.start_method = start_method
+        self.ju = JsonUtils(csv_delim = csv_delim)
+        load_map(self.ju, map_file)
+        self.chunk_parser = ChunkParser(self.ju.map, self.ju.get_map_index(), fmt = fmt, csv_delim = csv_delim,
+                                        stats = stats, unmapped = unmapped,
+                                        overflow_table = self.ju.overflow_table_name(), on_error = on_error,
+                                        dead_letter_table = self.ju.dead_letter_table_name())
+        self.pool = None
+        self.records = 0
+
+    def is_stale(self):
+        """
+        * map file is changed (or removed) since it was loaded
+        """
+        try:
+            return os.path.getmtime(self.map_file) != self.mtime
+        except OSError:
+            return True
+
+    def parse(self, lines, chunk_size=1000):
+        """
+        *parse one batch of JSON lines*
+
+        * return {table index: encoded lines} of whole batch
+        """
+        chunks = iter_chunks(lines, chunk_size)
+        if self.workers > 1:
+            if self.pool is None:
+                self.pool = WorkerPool(self.chunk_parser, self.workers, self.start_method)
+            results = self.pool.parse(chunks, self.records)
+        else:
+            results = parse_chunks(chunks, self.chunk_parser, first_index = self.records)
+        out = dict()
+        for parsed in results:
+            for tblIdx, rows in parsed.items():
+                out.setdefault(tblIdx, []).extend(rows)
+        self.records += len(lines)
+        return out
+
+    def close(self):
+        """
+        * stop worker pool
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+class ParseService(object):
+    """
+    **variable member initialization in __init__ function**
+
+    - **feeds**: feed name to map file
+    - **max_maps**: maps kept warm; least recently used feed is closed when one more is loaded
+    - **workers**, **start_method**: worker processes of each warm feed (see stream.WorkerPool)
+    - **out_root**: folder of *out_dir* of requests (*out_dir* is relative to it, can not be outside);
+      None: requests can not write table files
+    - **fmt**, **csv_delim**, **chunk_size**, **unmapped**, **on_error**: options of stream.ChunkParser;
+      default 'csv', quoted values are loaded by COPY as they are ('text' is not escaped)
+    - **connect**: function(dsn) giving database connection; default psycopg2.connect
+    - **stats**: stats.ParseStats of all feeds, or None
+    - **cache**: warm feeds (**WarmFeed**) by name, least recently used first
+    - **connections**: database connections by DSN
+    - **counters**: batches, records, errors, map loads, hits and evictions of cache
+    """
+    def __init__(self, feeds=None, max_maps=8, workers=1, fmt='csv', csv_delim='|', chunk_size=1000,
+                 start_method=None, unmapped='fail', on_error='raise', connect=None, stats=None, out_root=None):
+        if max_maps < 1:
+            raise ValueError("service needs at least one warm map")
+        self.feeds = dict(feeds or dict())
+        self.max_maps = max_maps
+        self.workers = workers
+        self.fmt = fmt
+        self.csv_delim = csv_delim
+        self.chunk_size = chunk_size
+        self.start_method = start_method
+        self.unmapped = unmapped
+        self.on_error = on_error
+        self.connect = connect
+        self.stats = stats
+        self.out_root = None if out_root is None else os.path.realpath(out_root)
+        self.cache = OrderedDict()
+        self.connections = dict()
+        self.counters = {"batches": 0, "records": 0, "errors": 0, "mapLoads": 0, "mapHits": 0, "evictions": 0}
+        self.stopped = False
+
+    def feed(self, name):
+        """
+        *warm feed by name, loaded if not in cache (or map file is changed)*
+
+        * only feeds of **feeds**
+        """
+        if name not in self.feeds:
+            raise ValueError(f"unknown feed {name}, should be one of {sorted(self.feeds)}")
+        warm = self.cache.get(name, None)
+        if warm is not None and not warm.is_stale():
+            self.cache.move_to_end(name)
+            self.counters["mapHits"] += 1
+            return warm
+        if warm is not None:
+            del self.cache[name]
+            warm.close()
+        map_file = self.feeds[name]
+        if not os.path.exists(map_file):
+            raise ValueError(f"unknown feed {name}: map file {map_file} does not exist")
+        warm = WarmFeed(map_file, self.workers, self.fmt, self.csv_delim, self.start_method, self.stats,
+                        self.unmapped, self.on_error)
+        self.cache[name] = warm
+        self.counters["mapLoads"] += 1
+        while len(self.cache) > self.max_maps:
+            (old_name, old) = self.cache.popitem(last = False)
+            old.close()
+            self.counters["evictions"] += 1
+        return warm
+
+    def connection(self, dsn):
+        """
+        * database connection of *dsn*, opened at first use and kept; opened again if it is closed
+        """
+        conn = self.connections.get(dsn, None)
+        if conn is None or getattr(conn, "closed", False):
+            connect = self.connect
+            if connect is None:
+                import psycopg2 # optional, only for loading into PostgreSQL
+                connect = psycopg2.connect
+            conn = self.connections[dsn] = connect(dsn)
+        return conn
+
+    def load(self, conn, warm, parsed, schema_name=None):
+        """
+        * COPY rows of each table in one transaction, roll back on error
+        """
+        chunk_parser = warm.chunk_parser
+        try:
+            for tblIdx, lines in parsed.items():
+                if len(lines) > 0:
+                    copy_rows(conn, chunk_parser.table_names[tblIdx], lines, chunk_parser.columns[tblIdx],
+                              schema_name, self.fmt, self.csv_delim)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def out_path(self, out_dir):
+        """
+        * folder *out_dir* of request in **out_root**; ValueError if it is outside (like '../x' or a link out)
+        """
+        if self.out_root is None:
+            raise ValueError("service has no out_root, requests can not write table files")
+        path = os.path.realpath(os.path.join(self.out_root, out_dir))
+        if os.path.commonpath([self.out_root, path]) != self.out_root:
+            raise ValueError(f"out_dir {out_dir} is outside of out_root")
+        return path
+
+    def write(self, out_dir, warm, parsed):
+        """
+        * append rows to table files in *out_dir* (inside **out_root**, see **out_path**)
+        """
+        out_dir = self.out_path(out_dir)
+        writer = TableWriter(out_dir, warm.ju.map, fmt = self.fmt, csv_delim = self.csv_delim,
+                             overflow_table = warm.ju.overflow_table_name(),
+                             dead_letter_table = warm.ju.dead_letter_table_name())
+        writer.append = True
+        with writer:
+            writer.write(parsed)
+
+    def parse_batch(self, request):
+        """
+        *parse records of one request into its output*
+
+        * return response
+        """
+        start = time.perf_counter()
+        if "map" in request:
+            raise ValueError("request can not give map file, use feed of service")
+        name = request.get("feed", None)
+        if name is None:
+            raise ValueError("request needs feed")
+        warm = self.feed(name)
+        if request.get("dsn", None) is None and request.get("out_dir", None) is not None:
+            self.out_path(request["out_dir"]) # rejected before parsing
+        lines = [r if isinstance(r, str) else json.dumps(r) for r in request.get("records", [])]
+        parsed = warm.parse(lines, self.chunk_size)
+        response = {"ok": True, "feed": name, "records": len(lines)}
+        if request.get("dsn", None) is not None:
+            self.load(self.connection(request["dsn"]), warm, parsed, request.get("schema", None))
+        elif request.get("out_dir", None) is not None:
+            self.write(request["out_dir"], warm, parsed)
+        else:
+            response["tables"] = {warm.chunk_parser.table_names[tblIdx]: lines
+                                  for tblIdx, lines in parsed.items() if len(lines) > 0}
+        response["rows"] = {warm.chunk_parser.table_names[tblIdx]: len(lines)
+                            for tblIdx, lines in parsed.items() if len(lines) > 0}
+        self.counters["batches"] += 1
+        self.counters["records"] += len(lines)
+        response["seconds"] = round(time.perf_counter() - start, 6)
+        return response
+
+    def status(self):
+        """
+        * feeds in cache (least recently used first), counters, statistics
+        """
+        status = {"ok": True, "feeds": {name: {"map": warm.map_file, "records": warm.records,
+                                               "unmapped": warm.chunk_parser.unmapped}
+                                        for name, warm in self.cache.items()},
+                  "connections": len(self.connections), "counters": dict(self.counters)}
+        if self.stats is not None:
+            status["stats"] = self.stats.as_dict()
+        return status
+
+    def handle(self, request):
+        """
+        *answer one request*
+
+        * *request*: dictionary or JSON string; errors are in response, not raised
+        """
+        try:
+            if isinstance(request, (str, bytes)):
+                request = json.loads(request)
+            command = request.get("command", "parse")
+            if command == 'parse':
+                return self.parse_batch(request)
+            if command == 'status':
+                return self.status()
+            if command == 'shutdown':
+                self.stopped = True
+                return {"ok": True}
+            raise ValueError(f"unknown command {command}, should be one of {SERVICE_COMMANDS}")
+        except Exception as e:
+            self.counters["errors"] += 1
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    def serve(self, infile=None, outfile=None):
+        """
+        *answer requests in lines of infile (default standard input) until end or shutdown*
+
+        * one response line for each request line, flushed; empty lines are skipped
+        """
+        infile = infile or sys.stdin
+        outfile = outfile or sys.stdout
+        for line in infile:
+            if len(line.strip()) == 0:
+                continue
+            response = json.dumps(self.handle(line), ensure_ascii = False) + '\n'
+            outfile.write(response.encode('utf-8') if isinstance(line, bytes) else response) # socket: bytes
+            outfile.flush()
+            if self.stopped:
+                break
+
+    def serve_socket(self, address, allow_remote=False):
+        """
+        *answer requests of clients of local socket until shutdown*
+
+        * *address*: path of Unix socket, or 'host:port' of TCP socket (like 'localhost:7070')
+        * *allow_remote*: TCP host can be other than loopback address (ValueError if not); requests are
+          not authenticated, any client which can connect can parse and load
+        * one client at a time (warm feeds are not thread safe); each client sends request lines like **serve**
+        """
+        import socketserver
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                service.serve(self.rfile, self.wfile)
+
+        if ':' in address and os.path.sep not in address:
+            (host, port) = address.rsplit(':', 1)
+            if not allow_remote and not is_loopback(host):
+                raise ValueError(f"host {host} is not loopback address, listen on it only with allow_remote")
+            server = socketserver.TCPServer((host, int(port)), Handler)
+        else:
+            if os.path.exists(address):
+                os.remove(address)
+            server = socketserver.UnixStreamServer(address, Handler)
+        try:
+            while not self.stopped:
+                server.handle_request()
+        finally:
+            server.server_close()
+            if isinstance(server.server_address, str) and os.path.exists(address):
+                os.remove(address)
+
+    def close(self):
+        """
+        * stop worker pools of warm feeds, close database connections
+        """
+        for warm in self.cache.values():
+            warm.close()
+        self.cache.clear()
+        for conn in self.connections.values():
+            conn.close()
+        self.connections.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
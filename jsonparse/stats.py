@@ -0,0 +1,296 @@
+"""
+The parse statistics
+====================
+
+- **File name**: stats.py
+- **Arthor**: Luke Du
+- **Purpose**: Optional timers, counters and peak memory of map generation and parsing.
+
+Statistics are off by default: **JsonUtils** uses **NULL_STATS**, which does
+nothing. Call `JsonUtils.enable_stats()` to collect:
+
+* time of each stage: decode, discover (path discovery), plan, parse, encode, write
+* counters: records, rows of each table, scalars visited, unmapped paths hit, records filtered out
+* peak memory (resident set size) of the process
+* histograms: like seconds of each chunk of stream parse (*chunk_seconds*), to tune chunk size
+* with *profile*, stages run under cProfile, see **ParseStats.profile_report**
+
+Statistics can be exported as JSON or Prometheus text format.
+
+ParseStats CLASS
+----------------
+"""
+import time
+
+STAGES = ('decode', 'discover', 'plan', 'parse', 'encode', 'write')
+
+# upper bounds of histogram buckets (seconds), last bucket has no upper bound
+HISTOGRAM_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def peak_memory_bytes():
+    """
+    *peak resident memory of this process in bytes*
+
+    * 0 when not available (no resource module, like Windows)
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024 # Linux: kilobytes
+
+class _StageTimer(object):
+    """
+    * context manager returned by **ParseStats.stage**
+    """
+    __slots__ = ('stats', 'name', 'start', 'profiler')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.profiler = None
+
+    def __enter__(self):
+        if self.stats.profile_stage(self.name):
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.stats.add_profile(self.name, self.profiler)
+        self.stats.add_time(self.name, elapsed)
+        self.stats.peak_memory = max(self.stats.peak_memory, peak_memory_bytes())
+        return False
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class NullStats(object):
+    """
+    *statistics switched off*
+
+    * same methods as **ParseStats**, do nothing
+    """
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_TIMER
+
+    def count(self, name, n=1):
+        pass
+
+    def add_rows(self, table_name, n=1):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+    def merge(self, other):
+        pass
+
+NULL_STATS = NullStats()
+
+def timed_stage(name):
+    """
+    *decorator: time method of JsonUtils as stage name*
+
+    * the object of method must have **stats** (ParseStats or NullStats)
+    """
+    import functools
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.stats.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+class ParseStats(object):
+    """
+    **variable member initialization in __init__ function**
+
+    - **profile**: True for all stages, or list of stage names to run under cProfile
+    - **timers**: stage name to seconds
+    - **calls**: stage name to number of runs
+    - **counters**: counter name (like *records*, *scalars*, *unmapped*) to value
+    - **table_rows**: table name to number of rows
+    - **peak_memory**: peak resident memory in bytes (maximum of processes when merged)
+    - **profiles**: stage name to pstats.Stats
+    - **histograms**: histogram name to [count of each bucket of HISTOGRAM_BUCKETS and one more, sum, max]
+    """
+    enabled = True
+
+    def __init__(self, profile=False):
+        self.profile = profile
+        self.timers = dict()
+        self.calls = dict()
+        self.counters = dict()
+        self.table_rows = dict()
+        self.peak_memory = 0
+        self.profiles = dict()
+        self.histograms = dict()
+
+    def __getstate__(self):
+        # sent back from worker process: profiles (pstats) are not picklable
+        state = self.__dict__.copy()
+        state["profiles"] = dict()
+        return state
+
+    def profile_stage(self, name):
+        """
+        * whether stage *name* runs under cProfile
+        """
+        if self.profile is True:
+            return True
+        return bool(self.profile) and name in self.profile
+
+    def stage(self, name):
+        """
+        *time one stage*
+
+        * use as `with stats.stage('parse'):`
+        """
+        return _StageTimer(self, name)
+
+    def add_time(self, name, seconds, calls=1):
+        self.timers[name] = self.timers.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+
+    def add_profile(self, name, profiler):
+        import pstats
+        if name in self.profiles:
+            self.profiles[name].add(profiler)
+        else:
+            self.profiles[name] = pstats.Stats(profiler)
+
+    def count(self, name, n=1):
+        """
+        * add *n* to counter *name*
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_rows(self, table_name, n=1):
+        """
+        * add *n* rows of table *table_name*
+        """
+        self.table_rows[table_name] = self.table_rows.get(table_name, 0) + n
+
+    def observe(self, name, value):
+        """
+        * add *value* (like seconds of one chunk) into histogram *name*
+        """
+        import bisect
+        hist = self.histograms.get(name, None)
+        if hist is None:
+            hist = self.histograms[name] = [[0] * (len(HISTOGRAM_BUCKETS) + 1), 0.0, 0.0]
+        hist[0][bisect.bisect_left(HISTOGRAM_BUCKETS, value)] += 1
+        hist[1] += value
+        hist[2] = max(hist[2], value)
+
+    def merge(self, other):
+        """
+        *add statistics from other ParseStats*
+
+        * like statistics from worker process; profiles are not merged
+        """
+        for name, seconds in other.timers.items():
+            self.add_time(name, seconds, other.calls.get(name, 0))
+        for name, n in other.counters.items():
+            self.count(name, n)
+        for name, n in other.table_rows.items():
+            self.add_rows(name, n)
+        self.peak_memory = max(self.peak_memory, other.peak_memory)
+        for name, (counts, total, top) in getattr(other, "histograms", dict()).items():
+            hist = self.histograms.setdefault(name, [[0] * len(counts), 0.0, 0.0])
+            hist[0] = [a + b for a, b in zip(hist[0], counts)]
+            hist[1] += total
+            hist[2] = max(hist[2], top)
+
+    def as_dict(self):
+        """
+        * statistics as python dictionary
+        """
+        return {
+            "timers": {k: round(v, 6) for k, v in self.timers.items()},
+            "calls": dict(self.calls),
+            "counters": dict(self.counters),
+            "tableRows": dict(self.table_rows),
+            "peakMemory": self.peak_memory,
+            "histograms": {name: {
+                "buckets": {str(le): n for le, n in zip(HISTOGRAM_BUCKETS + ('inf',), counts)},
+                "count": sum(counts),
+                "sum": round(total, 6),
+                "max": round(top, 6),
+            } for name, (counts, total, top) in self.histograms.items()},
+        }
+
+    def to_json(self, indent=None):
+        """
+        * statistics as JSON string
+        """
+        import json
+        return json.dumps(self.as_dict(), indent = indent)
+
+    def to_prometheus(self, prefix='jsonparse'):
+        """
+        * statistics in Prometheus text format
+        """
+        lines = [
+            f"# HELP {prefix}_stage_seconds_total Time spent in each stage.",
+            f"# TYPE {prefix}_stage_seconds_total counter",
+        ]
+        lines += [f'{prefix}_stage_seconds_total{{stage="{k}"}} {v:.6f}' for k, v in sorted(self.timers.items())]
+        lines += [
+            f"# HELP {prefix}_stage_calls_total Number of runs of each stage.",
+            f"# TYPE {prefix}_stage_calls_total counter",
+        ]
+        lines += [f'{prefix}_stage_calls_total{{stage="{k}"}} {v}' for k, v in sorted(self.calls.items())]
+        for name, n in sorted(self.counters.items()):
+            lines += [f"# TYPE {prefix}_{name}_total counter", f"{prefix}_{name}_total {n}"]
+        lines += [
+            f"# HELP {prefix}_rows_total Parsed rows of each table.",
+            f"# TYPE {prefix}_rows_total counter",
+        ]
+        lines += [f'{prefix}_rows_total{{table="{k}"}} {v}' for k, v in sorted(self.table_rows.items())]
+        lines += [
+            f"# HELP {prefix}_peak_memory_bytes Peak resident memory.",
+            f"# TYPE {prefix}_peak_memory_bytes gauge",
+            f"{prefix}_peak_memory_bytes {self.peak_memory}",
+        ]
+        for name, (counts, total, top) in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            cumulative = 0
+            for le, n in zip(HISTOGRAM_BUCKETS + ('+Inf',), counts):
+                cumulative += n
+                lines.append(f'{prefix}_{name}_bucket{{le="{le}"}} {cumulative}')
+            lines += [f"{prefix}_{name}_sum {total:.6f}", f"{prefix}_{name}_count {cumulative}"]
+        return '\n'.join(lines) + '\n'
+
+    def profile_report(self, stage=None, sort='cumulative', limit=20):
+        """
+        *cProfile report as text*
+
+        * *stage* None: all profiled stages
+        """
+        import io
+        buff = io.StringIO()
+        for name, st in sorted(self.profiles.items()):
+            if stage is not None and name != stage:
+                continue
+            buff.write(f"==== stage {name} ====\n")
+            st.stream = buff
+            st.sort_stats(sort).print_stats(limit)
+        return buff.getvalue()
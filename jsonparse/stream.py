@@ -0,0 +1,914 @@
+"""
+The streaming parse
+===================
+
+- **File name**: stream.py
+- **Arthor**: Luke Du
+- **Purpose**: Parse JSON lines data chunk by chunk, without loading whole file into memory.
+
+**JsonUtils** works on whole data in **json_data**. For large files (or data
+from pipe), the JSON lines (one JSON record per line) are read chunk by chunk:
+
+* decode, parse (by **RecordParser**) and encode one chunk; can be done in worker processes
+* write encoded rows of each table to its output file
+* only a few chunks are in memory at the same time
+* with checkpoint (see checkpoint.Checkpoint), a stopped run is resumed by **parse_stream**
+
+Functions and CLASS
+-------------------
+"""
+import os
+import sys
+import json
+import time
+
+from jsonparse.jsonutils import compile_map, get_paths, split_paths, RecordParser, OVERFLOW_COLUMNS, DEAD_LETTER_COLUMNS
+from jsonparse.errors import DecodeError
+from jsonparse.jsonutils import projected_table_list, project_map_index, root_column_paths, array_max_lengths
+from jsonparse.stats import NULL_STATS
+from jsonparse.ingest import Prefetcher, read_input_bytes, DEFAULT_MAX_BYTES
+
+OUTPUT_FORMATS = ('text', 'csv', 'jsonl')
+CHUNK_WEIGHTS = ('bytes', 'rows') # cost estimate of line for chunk size, see line_weight
+
+_BAD_LINE = object() # line which is not valid JSON, put aside
+_DROPPED = object()  # line dropped before parsing (duplicate), keeps its record index
+NULL_PARTITION = '__null__' # partition of record without partition value
+
+def open_input(fn):
+    """
+    *open input file for reading text*
+
+    * *fn* is '-': standard input
+    * *fn* ends with '.gz': gzip file
+    """
+    if fn == '-':
+        return sys.stdin
+    if fn.endswith('.gz'):
+        import gzip
+        return gzip.open(fn, 'rt')
+    return open(fn, 'r')
+
+def iter_lines(inputs, readahead=0, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    *JSON lines from input files*
+
+    * *inputs* is list of file names ('-' for standard input)
+    * empty lines are skipped
+    * yield one JSON record (string) each time
+    * *readahead* more than 0: next files are read in threads (see ingest.Prefetcher)
+    """
+    if readahead > 0:
+        for (line, pos) in iter_lines_at(inputs, readahead = readahead, max_bytes = max_bytes):
+            yield line
+        return
+    for fn in inputs:
+        f = open_input(fn)
+        try:
+            for line in f:
+                line = line.strip()
+                if len(line) > 0:
+                    yield line
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+def _open_inputs(inputs, start_idx, readahead, max_bytes):
+    """
+    * yield (index, file object) of input files from index *start_idx*
+    * *readahead* more than 0: file content read ahead in threads, as BytesIO
+    """
+    if readahead > 0 and '-' not in inputs:
+        import io
+        files = inputs[start_idx:]
+        for idx, (fn, data) in enumerate(Prefetcher(files, read_input_bytes, readahead, max_bytes), start = start_idx):
+            yield (idx, io.BytesIO(data))
+        return
+    for idx in range(start_idx, len(inputs)):
+        fn = inputs[idx]
+        if fn == '-':
+            yield (idx, sys.stdin.buffer)
+        elif fn.endswith('.gz'):
+            import gzip
+            yield (idx, gzip.open(fn, 'rb'))
+        else:
+            yield (idx, open(fn, 'rb'))
+
+def iter_lines_at(inputs, start=(0, 0), readahead=0, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    *JSON lines from input files with position*
+
+    * like **iter_lines**, yield (line, (input file index, byte offset after line))
+    * start at byte offset *start[1]* of input file *start[0]*; standard input can only start at 0
+    * *readahead* and *max_bytes*: read next files in threads, see ingest.Prefetcher
+    """
+    (start_idx, start_offset) = start
+    for (idx, f) in _open_inputs(inputs, start_idx, readahead, max_bytes):
+        offset = start_offset if idx == start_idx else 0
+        if offset > 0 and f is sys.stdin.buffer:
+            raise ValueError("standard input can not start after offset 0")
+        try:
+            if offset > 0:
+                f.seek(offset)
+            for raw in f:
+                offset += len(raw)
+                line = raw.strip()
+                if len(line) > 0:
+                    yield (line.decode('utf-8'), (idx, offset))
+        finally:
+            if f is not sys.stdin.buffer:
+                f.close()
+
+def iter_records(inputs, input_format='ndjson', readahead=0, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    *JSON records from input files*
+
+    * *input_format* 'ndjson': JSON lines, one record per line (streaming)
+    * *input_format* 'json': each file is a JSON list (*[]*), whole file is loaded
+    * *readahead* and *max_bytes*: read next files in threads, see ingest.Prefetcher
+    """
+    if input_format == 'ndjson':
+        for line in iter_lines(inputs, readahead, max_bytes):
+            yield json.loads(line)
+    elif input_format == 'json':
+        for (idx, f) in _open_inputs(inputs, 0, readahead, max_bytes):
+            try:
+                jd = json.load(f)
+            finally:
+                if f is not sys.stdin.buffer:
+                    f.close()
+            for js in (jd if isinstance(jd, list) else [jd]):
+                yield js
+    else:
+        raise ValueError(f"unknown input format {input_format}")
+
+def iter_chunks(iterable, chunk_size=1000, max_weight=None, weight=None):
+    """
+    *split iterable into lists with chunk_size elements*
+
+    * the last list may be shorter
+    * *max_weight*: list is also cut when *weight* of its elements adds up to this (like bytes of lines,
+      see **line_weight**), so a huge record does not make a huge chunk; *weight* default: len
+    """
+    chunk = []
+    if max_weight is None:
+        for e in iterable:
+            chunk.append(e)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    else:
+        weight = weight or len
+        total = 0
+        for e in iterable:
+            chunk.append(e)
+            total += weight(e)
+            if len(chunk) >= chunk_size or total >= max_weight:
+                yield chunk
+                chunk = []
+                total = 0
+    if len(chunk) > 0:
+        yield chunk
+
+def line_weight(line, by='bytes'):
+    """
+    *cost estimate of JSON line for chunk size*
+
+    * *by* (one of CHUNK_WEIGHTS) 'bytes': length of line; 'rows': number of objects ('{'), each
+      gives at most one row, array of objects gives one row for each element
+    """
+    return len(line) if by == 'bytes' else line.count('{')
+
+def sized_chunks(lines, chunk_size=1000, chunk_bytes=None, chunk_rows=None):
+    """
+    *chunks of JSON lines by records, bytes or estimated rows*
+
+    * cut at *chunk_size* records, or when lines of chunk have *chunk_bytes* characters,
+      or *chunk_rows* estimated rows (see **line_weight**); None: not used (*chunk_bytes* if both are given)
+    * elements of *lines* can be (line, position) like **iter_lines_at**
+    """
+    if chunk_bytes is None and chunk_rows is None:
+        return iter_chunks(lines, chunk_size)
+    by = 'bytes' if chunk_bytes is not None else 'rows'
+    limit = chunk_bytes if chunk_bytes is not None else chunk_rows
+    def weight(e):
+        return line_weight(e if isinstance(e, str) else e[0], by)
+    return iter_chunks(lines, chunk_size, limit, weight)
+
+def stream_paths(records, flag_json_array='__JSON_array__', chunk_size=1000, array_lengths=None,
+                 key_threshold=None, max_memory_paths=None, dynamic=None):
+    """
+    *compute all paths from records chunk by chunk*
+
+    * like **compute_all_paths** of **JsonUtils**, but only distinct paths are kept in memory
+    * *array_lengths*: if given (dictionary), max length of arrays is put into it (see jsonutils.array_max_lengths)
+    * *key_threshold*: objects with more distinct keys are dynamic, collapsed into key/value tables;
+      *dynamic*: set of dynamic object paths, known before and found (updated in place);
+      *max_memory_paths*: distinct paths are spilled to disk over this number; see pathstore.discover_paths
+    * return sorted (pathlist, arraylist)
+    """
+    if key_threshold is not None or max_memory_paths is not None or dynamic:
+        from jsonparse.pathstore import discover_paths
+        return discover_paths(records, flag_json_array, key_threshold, max_memory_paths, dynamic, array_lengths)
+    allpath = set()
+    for chunk in iter_chunks(records, chunk_size):
+        for path in get_paths(chunk, flag_json_array):
+            allpath.add(tuple(path))
+        if array_lengths is not None:
+            array_max_lengths(chunk, array_lengths)
+    return split_paths([list(p) for p in allpath], flag_json_array)
+
+def table_columns(tbl):
+    """
+    *output column names of table in map*
+
+    * uuid, sequence variables, columns, then extras column; same order as **postgres_ddl**
+    """
+    seq_lst = tbl.get("seqList", None) or []
+    extras = [tbl["extrasColumn"]] if tbl.get("extrasColumn", None) is not None else []
+    return ["uuid"] + [e["columnName"] for e in seq_lst] + [e["columnName"] for e in tbl["columnList"]] + extras
+
+def txn_id(txn_seed, record_index):
+    """
+    *txn id (uuid) of record*
+
+    * *txn_seed* None: random uuid
+    * else uuid from *txn_seed* (uuid string) and index of record: same in each run
+    """
+    import uuid
+    if txn_seed is None:
+        return str(uuid.uuid4())
+    return str(uuid.uuid5(uuid.UUID(txn_seed), str(record_index)))
+
+def partition_value(record, tags):
+    """
+    *partition of record*
+
+    * value of path *tags* (list of keys) in *record*, as string safe for folder name
+    * NULL_PARTITION if path is not in record or value is null
+    """
+    v = record
+    for tag in tags:
+        if not isinstance(v, dict) or tag not in v:
+            return NULL_PARTITION
+        v = v[tag]
+    if v is None:
+        return NULL_PARTITION
+    from urllib.parse import quote
+    return quote(v if isinstance(v, str) else json.dumps(v), safe = '-_.')
+
+def format_rows(rows, fmt, columns, csv_delim=','):
+    """
+    *encode parsed rows to text lines*
+
+    * *fmt* 'text': values joined by *csv_delim* (same as **parsed_tables**), not escaped
+    * *fmt* 'csv': csv module quoting with *csv_delim* as delimiter, a line can have newline in quoted value
+    * *fmt* 'jsonl': one JSON object per row, keys are *columns*
+    """
+    if fmt == 'text':
+        return [csv_delim.join(row) for row in rows]
+    if fmt == 'csv':
+        import io
+        import csv
+        buff = io.StringIO()
+        writer = csv.writer(buff, delimiter = csv_delim, lineterminator = '\r\n') # values with newline or CR quoted
+        lines = []
+        for row in rows: # one line per row, newline and CR in quoted values kept
+            writer.writerow(row)
+            lines.append(buff.getvalue()[:-2])
+            buff.seek(0)
+            buff.truncate()
+        return lines
+    if fmt == 'jsonl':
+        return [json.dumps(dict(zip(columns, row)), separators = (',', ':')) for row in rows]
+    raise ValueError(f"unknown output format {fmt}")
+
+class ChunkParser(object):
+    """
+    *parse one chunk of JSON lines*
+
+    * callable: input list of JSON strings, output {table index: encoded lines}; None in the list is
+      a dropped line (like duplicate, see **parse_stream**), not parsed
+    * can be sent to worker process (only map and options inside)
+    * *stats* (stats.ParseStats) collects decode, parse and encode stages; see **take_report**
+    * *unmapped*: policy for paths not in map (see **parse_use_pool** of **JsonUtils**);
+      overflow rows (table *overflow_table*) have table index after all tables of map
+    * **unmapped**: paths not in map with count
+    * *tables* and *columns*: parse selected tables and columns only (see **project_map_index** of jsonutils)
+    * *record_filter*: parse selected records only (see **RecordFilter** of jsonutils)
+    * *txn_seed*: seed of txn ids (see **txn_id**), None for random uuid
+    * *on_error* 'quarantine': lines which are not valid JSON and records which raise JsonParseError are
+      rows of dead letter table *dead_letter_table* (table index after overflow table, columns DEAD_LETTER_COLUMNS)
+    * *partition_by*: path of root table (like 'date'); output keys are (table index, partition value)
+      instead of table index, all rows of a record (child tables too) have partition of the record
+      (see **partition_value**, **PartitionedWriter**)
+    * *delta* (delta.DeltaFilter): records same as in its hash index are not parsed, new and changed records
+      get txn id from their key; hashes to save are sent back by **take_report** (saved by **parse_stream**)
+    """
+    def __init__(self, jmap, map_index=None, fmt='text', csv_delim=',', stats=None, unmapped='fail',
+                 overflow_table='unmapped', tables=None, columns=None, record_filter=None, txn_seed=None,
+                 on_error='raise', dead_letter_table='dead_letter', partition_by=None, delta=None):
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"unknown output format {fmt}")
+        self.map = jmap
+        self.map_index = map_index if map_index is not None else compile_map(jmap)
+        if tables is not None or columns is not None:
+            self.map_index = project_map_index(jmap, self.map_index, tables, columns)
+        self.fmt = fmt
+        self.csv_delim = csv_delim
+        self.columns = [None if tbl is None else table_columns(tbl)
+                        for tbl in projected_table_list(jmap, tables, columns)] + [OVERFLOW_COLUMNS, DEAD_LETTER_COLUMNS]
+        self.stats = stats if stats is not None else NULL_STATS
+        self.unmapped_policy = unmapped
+        self.record_filter = record_filter
+        self.txn_seed = txn_seed
+        self.on_error = on_error
+        self.dead_letter_index = len(jmap["tableList"]) + 1
+        self.unmapped = dict()
+        self.table_names = self.map_index["tableName"] + [overflow_table, dead_letter_table]
+        self.delta = delta
+        self.partition_tags = None
+        if partition_by is not None:
+            if partition_by not in root_column_paths(jmap):
+                raise ValueError(f"partition path {partition_by} is not column of root table")
+            self.partition_tags = partition_by.split('.')
+
+    def parse_records(self, records, first_index=0, bad_lines=None):
+        """
+        * parse decoded records, return {table index: row value lists}
+        * *first_index*: index of first record in whole input, for txn id
+        * *bad_lines*: {index: line} of lines which are not valid JSON (see **__call__**), put aside
+        """
+        parsed = dict()
+        record_parser = RecordParser(self.map, self.map_index, unmapped = self.unmapped_policy,
+                                     record_filter = self.record_filter, on_error = self.on_error)
+        partition_tags = self.partition_tags
+        delta_ids = None
+        if self.delta is not None:
+            from jsonparse.delta import DELTA_SKIPPED
+            delta_ids = self.delta.select([None if js is _BAD_LINE or js is _DROPPED else js for js in records])
+            if self.stats.enabled:
+                for js, (status, dummy) in zip(records, delta_ids):
+                    if js is not _DROPPED:
+                        self.stats.count(f"delta_{status}")
+        confirmed = [] # positions of delta records which gave rows
+        for idx, js in enumerate(records, start = first_index):
+            if js is _DROPPED:
+                continue
+            if js is _BAD_LINE:
+                record_parser.record_count += 1
+                record_parser.quarantine(DecodeError("line is not valid JSON", record_index = idx), bad_lines[idx], idx)
+                continue
+            if delta_ids is None:
+                tid = txn_id(self.txn_seed, idx)
+            else:
+                (status, tid) = delta_ids[idx - first_index]
+                if status in DELTA_SKIPPED:
+                    continue
+                tid = tid or txn_id(self.txn_seed, idx)
+            rows = record_parser.parse_safe(js, tid, idx)
+            if delta_ids is not None and len(rows) > 0:
+                confirmed.append(idx - first_index)
+            if partition_tags is None:
+                for (tblIdx, row) in rows:
+                    parsed.setdefault(tblIdx, []).append(row)
+            else:
+                partition = partition_value(js, partition_tags)
+                for (tblIdx, row) in rows:
+                    parsed.setdefault((tblIdx, partition), []).append(row)
+        if delta_ids is not None:
+            self.delta.confirm(confirmed)
+        if len(record_parser.dead_letters) > 0:
+            key = self.dead_letter_index if partition_tags is None else (self.dead_letter_index, NULL_PARTITION)
+            parsed[key] = [["" if d[c] is None else str(d[c]) for c in DEAD_LETTER_COLUMNS]
+                           for d in record_parser.dead_letters]
+        for path, n in record_parser.unmapped.items():
+            self.unmapped[path] = self.unmapped.get(path, 0) + n
+        if self.stats.enabled:
+            record_parser.report_stats(self.stats)
+            for key, rows in parsed.items():
+                self.stats.add_rows(self.table_names[self.table_index(key)], len(rows))
+        return parsed
+
+    def table_index(self, key):
+        """
+        * table index of output key: key itself, or first of (table index, partition value)
+        """
+        return key if self.partition_tags is None else key[0]
+
+    def encode(self, parsed):
+        """
+        * encode result of **parse_records** to text lines by format
+        """
+        return {key: format_rows(rows, self.fmt, self.columns[self.table_index(key)], self.csv_delim)
+                for key, rows in parsed.items()}
+
+    def decode_or_quarantine(self, lines, first_index=0):
+        """
+        * decode lines; line which is not valid JSON is kept in {index: line} for dead letter table
+        """
+        records = []
+        bad_lines = dict()
+        for idx, line in enumerate(lines, start = first_index):
+            if line is None:
+                records.append(_DROPPED)
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append(_BAD_LINE)
+                bad_lines[idx] = line
+        return (records, bad_lines)
+
+    def take_report(self):
+        """
+        *statistics and unmapped paths since last call*
+
+        * return {"stats": **stats** or None if switched off, "unmapped": **unmapped**,
+          "delta": hashes to save or None}, then start new ones
+        * used to send report from worker process back to main process
+        """
+        report = {"stats": None, "unmapped": self.unmapped, "delta": None}
+        if self.delta is not None:
+            report["delta"] = self.delta.take_pending()
+        self.unmapped = dict()
+        if self.stats.enabled:
+            from jsonparse.stats import ParseStats
+            report["stats"] = self.stats
+            self.stats = ParseStats(profile = self.stats.profile)
+        return report
+
+    def merge_report(self, report, encoded=None):
+        """
+        * add report from **take_report** (of worker process)
+        * *encoded*: output of the chunk of report; delta keys parsed by other chunk before (see
+          delta.DeltaFilter.merge_pending) are 'repeated', their rows are removed from it
+        * return *encoded*
+        """
+        if report["stats"] is not None:
+            self.stats.merge(report["stats"])
+        for path, n in report["unmapped"].items():
+            self.unmapped[path] = self.unmapped.get(path, 0) + n
+        if report.get("delta", None):
+            repeated = self.delta.merge_pending(report["delta"])
+            if len(repeated) > 0:
+                from jsonparse.delta import key_txn_id
+                self.stats.count('delta_repeated', len(repeated))
+                if encoded is not None:
+                    encoded = self.drop_txn_ids(encoded, set(key_txn_id(key) for key in repeated))
+        return encoded
+
+    def drop_txn_ids(self, encoded, txn_ids):
+        """
+        * remove encoded rows with uuid (first column) in *txn_ids*
+        """
+        def row_txn_id(line):
+            if self.fmt == 'jsonl':
+                return json.loads(line).get("uuid", None)
+            if self.fmt == 'csv':
+                import csv
+                return next(csv.reader([line], delimiter = self.csv_delim))[0]
+            return line.split(self.csv_delim, 1)[0]
+        return {key: [line for line in lines if row_txn_id(line) not in txn_ids] for key, lines in encoded.items()}
+
+    def __call__(self, lines, first_index=0):
+        if not self.stats.enabled:
+            return self.parse_chunk(lines, first_index)
+        start = time.perf_counter()
+        try:
+            return self.parse_chunk(lines, first_index)
+        finally:
+            self.stats.observe('chunk_seconds', time.perf_counter() - start)
+
+    def parse_chunk(self, lines, first_index=0):
+        """
+        * decode, parse and encode one chunk of JSON lines (call of ChunkParser, timed in histogram
+          'chunk_seconds' of *stats*)
+        """
+        bad_lines = None
+        with self.stats.stage('decode'):
+            if self.on_error == 'quarantine':
+                (records, bad_lines) = self.decode_or_quarantine(lines, first_index)
+            else:
+                try:
+                    records = [_DROPPED if line is None else json.loads(line) for line in lines]
+                except ValueError:
+                    idx = min(self.decode_or_quarantine(lines, first_index)[1])
+                    raise DecodeError(f"line of record {idx} is not valid JSON", record_index = idx)
+        with self.stats.stage('parse'):
+            parsed = self.parse_records(records, first_index, bad_lines)
+        with self.stats.stage('encode'):
+            return self.encode(parsed)
+
+_worker_parser = None # ChunkParser in worker process
+
+def worker_context(start_method=None):
+    """
+    *multiprocessing context of worker processes*
+
+    * *start_method* None: 'fork' where it can be used safely (POSIX, not macOS), else default of platform
+      (Python 3.14 default is 'forkserver' on Linux too)
+    * forked workers inherit *chunk_parser* (map and lookup indexes) from this process: it is not pickled and
+      not unpickled, memory pages are shared until written; 'spawn' and 'forkserver' workers unpickle it once each
+    """
+    import multiprocessing
+    if start_method is None and sys.platform != 'darwin' and 'fork' in multiprocessing.get_all_start_methods():
+        start_method = 'fork'
+    return multiprocessing.get_context(start_method)
+
+def _init_worker(chunk_parser):
+    global _worker_parser
+    _worker_parser = chunk_parser
+    _worker_parser.take_report() # report of main process is not counted again
+
+def _parse_in_worker(lines, first_index):
+    return (_worker_parser(lines, first_index), _worker_parser.take_report())
+
+class WorkerPool(object):
+    """
+    *process pool of workers which parse chunks by one ChunkParser*
+
+    * each worker gets *chunk_parser* once when it starts, see **worker_context** for *start_method*;
+      before fork, objects are frozen out of garbage collector (gc.freeze), so collection in workers does not
+      write (and copy) the pages of the inherited map
+    * the pool can parse many streams (see **parse**), so it is started once for a long running job
+      (like service.ParseService)
+    * close (or use `with`) to stop workers
+    """
+    def __init__(self, chunk_parser, workers=2, start_method=None):
+        self.chunk_parser = chunk_parser
+        self.workers = workers
+        ctx = worker_context(start_method)
+        if ctx.get_start_method() != 'fork':
+            self.pool = ctx.Pool(workers, initializer = _init_worker, initargs = (chunk_parser,))
+            return
+        import gc
+        gc.freeze()
+        try:
+            self.pool = ctx.Pool(workers, initializer = _init_worker, initargs = (chunk_parser,))
+        finally:
+            gc.unfreeze()
+
+    def parse(self, chunks, first_index=0, window=None, max_pending=None):
+        """
+        *parse chunks in workers, yield results in order*
+
+        * idle workers take next chunk from queue of pool, at most *window* chunks (default 2 * workers)
+          are queued or being parsed
+        * a slow chunk (like a huge record) does not stop the others: while it is parsed, next chunks are
+          still sent, their results wait (at most *max_pending* chunks, default 4 * *window*, in memory)
+        * statistics and unmapped paths from workers are added into *chunk_parser*
+        """
+        import threading
+        from collections import deque
+        window = window or 2 * self.workers
+        max_pending = max(max_pending or 4 * window, window)
+        pending = deque()
+        finished = threading.Event() # set by pool when any chunk is done
+        def wake(result):
+            finished.set()
+        def next_result():
+            (parsed, report) = pending.popleft().get()
+            return self.chunk_parser.merge_report(report, parsed)
+        for chunk in chunks:
+            pending.append(self.pool.apply_async(_parse_in_worker, (chunk, first_index),
+                                                 callback = wake, error_callback = wake))
+            first_index += len(chunk)
+            while len(pending) > 0:
+                finished.clear()
+                if pending[0].ready():
+                    yield next_result()
+                elif len(pending) >= max_pending or sum(1 for r in pending if not r.ready()) >= window:
+                    finished.wait(1.0)
+                else:
+                    break
+        while len(pending) > 0:
+            yield next_result()
+
+    def close(self):
+        """
+        * stop workers
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def parse_chunks(chunks, chunk_parser, workers=1, window=None, first_index=0, start_method=None, max_pending=None):
+    """
+    *parse chunks in order*
+
+    * *workers* 1: parse in this process
+    * *workers* more than 1: parse in process pool (**WorkerPool**), see **WorkerPool.parse** for *window*
+      and *max_pending*
+    * yield result of *chunk_parser* for each chunk, same order as *chunks*
+    * statistics and unmapped paths from workers are added into *chunk_parser*
+    * *first_index*: index of first record of *chunks* in whole input (for txn id)
+    * *start_method*: of worker processes ('fork', 'spawn' or 'forkserver'), None for 'fork' where it can be
+      used (workers inherit map, see **worker_context**)
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield chunk_parser(chunk, first_index)
+            first_index += len(chunk)
+        return
+    with WorkerPool(chunk_parser, workers, start_method) as pool:
+        yield from pool.parse(chunks, first_index, window, max_pending)
+
+class TableWriter(object):
+    """
+    *write encoded rows into one file per table*
+
+    * **out_dir** None or '-': all tables to standard output, each line starts with table name and tab
+    * file name is table name with extension of format ('.txt', '.csv' or '.jsonl')
+    * with **header**, first line of 'csv' file is column names
+    * *overflow_table*: name of overflow table (table index after all tables of map)
+    * *tables* and *columns*: same projection as **ChunkParser**, for header of 'csv' file
+    * *dead_letter_table*: name of dead letter table (table index after overflow table)
+    """
+    extensions = {'text': 'txt', 'csv': 'csv', 'jsonl': 'jsonl'}
+
+    def __init__(self, out_dir, jmap, fmt='text', csv_delim=',', header=False, overflow_table='unmapped',
+                 tables=None, columns=None, dead_letter_table='dead_letter'):
+        self.out_dir = None if out_dir == '-' else out_dir
+        self.fmt = fmt
+        self.csv_delim = csv_delim
+        self.header = header
+        self.table_names = [tbl["tableName"] for tbl in jmap["tableList"]] + [overflow_table, dead_letter_table]
+        self.columns = [None if tbl is None else table_columns(tbl)
+                        for tbl in projected_table_list(jmap, tables, columns)] + [OVERFLOW_COLUMNS, DEAD_LETTER_COLUMNS]
+        self.files = dict()
+        self.sizes = dict() # table name -> size of output file at last checkpoint
+        self.append = False
+        if self.out_dir is not None:
+            os.makedirs(self.out_dir, exist_ok = True)
+
+    def table_file(self, tblIdx):
+        """
+        * output file name of table
+        """
+        return os.path.join(self.out_dir, f"{self.table_names[tblIdx]}.{self.extensions[self.fmt]}")
+
+    def _get_file(self, tblIdx):
+        f = self.files.get(tblIdx, None)
+        if f is None:
+            f = open(self.table_file(tblIdx), 'a' if self.append else 'w')
+            if self.header and self.fmt == 'csv' and f.tell() == 0:
+                f.write(f"{self.csv_delim.join(self.columns[tblIdx])}\n")
+            self.files[tblIdx] = f
+        return f
+
+    def write(self, parsed):
+        """
+        * write {table index: encoded lines}
+        """
+        for tblIdx, lines in parsed.items():
+            if len(lines) == 0:
+                continue
+            if self.out_dir is None:
+                tbl_name = self.table_names[tblIdx]
+                sys.stdout.write(''.join(f"{tbl_name}\t{line}\n" for line in lines))
+            else:
+                self._get_file(tblIdx).write('\n'.join(lines) + '\n')
+
+    def resume(self, sizes):
+        """
+        *continue output files of checkpoint*
+
+        * *sizes*: table name to file size at checkpoint; longer files are cut to it,
+          table files not in *sizes* are removed (written after checkpoint)
+        * new rows are appended
+        """
+        if self.out_dir is None:
+            raise ValueError("output to standard output can not be resumed")
+        for tblIdx, tbl_name in enumerate(self.table_names):
+            fn = self.table_file(tblIdx)
+            if tbl_name in sizes:
+                with open(fn, 'r+b') as f:
+                    f.truncate(sizes[tbl_name])
+            elif os.path.exists(fn):
+                os.remove(fn)
+        self.sizes = dict(sizes)
+        self.append = True
+
+    def sync(self):
+        """
+        *flush output files to disk*
+
+        * return table name to file size, for checkpoint
+        """
+        if self.out_dir is None:
+            raise ValueError("output to standard output can not be checkpointed")
+        for tblIdx, f in self.files.items():
+            f.flush()
+            os.fsync(f.fileno())
+            self.sizes[self.table_names[tblIdx]] = os.path.getsize(self.table_file(tblIdx))
+        return dict(self.sizes)
+
+    def close(self):
+        """
+        * close all output files
+        """
+        for f in self.files.values():
+            f.close()
+        self.files = dict()
+        if self.out_dir is None:
+            sys.stdout.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class PartitionedWriter(object):
+    """
+    *write encoded rows into partition folders of each table*
+
+    * input of **write** comes from **ChunkParser** with *partition_by*: {(table index, partition value): lines}
+    * file is **out_dir**/table/*partition_name*=value/part-NNNNN.ext (ext by format, like **TableWriter**)
+    * when a file is about *max_file_bytes* (counted in characters), next rows go to next part file
+    * at most *max_open_files* files are open; least recently used file is closed (opened again to append)
+    * other options are same as **TableWriter**
+    """
+    extensions = TableWriter.extensions
+
+    def __init__(self, out_dir, jmap, fmt='text', csv_delim=',', header=False, overflow_table='unmapped',
+                 tables=None, columns=None, dead_letter_table='dead_letter', partition_name='date',
+                 max_file_bytes=128 * 1024 * 1024, max_open_files=64):
+        from collections import OrderedDict
+        if out_dir is None or out_dir == '-':
+            raise ValueError("partitioned output needs output folder")
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.csv_delim = csv_delim
+        self.header = header
+        self.partition_name = partition_name
+        self.max_file_bytes = max_file_bytes
+        self.max_open_files = max(1, max_open_files)
+        self.table_names = [tbl["tableName"] for tbl in jmap["tableList"]] + [overflow_table, dead_letter_table]
+        self.columns = [None if tbl is None else table_columns(tbl)
+                        for tbl in projected_table_list(jmap, tables, columns)] + [OVERFLOW_COLUMNS, DEAD_LETTER_COLUMNS]
+        self.files = OrderedDict() # relative file path -> open file, least recently used first
+        self.sizes = dict() # relative file path -> size
+        self.parts = dict() # (table index, partition value) -> current part number
+        os.makedirs(self.out_dir, exist_ok = True)
+
+    def part_file(self, tblIdx, partition, part):
+        """
+        * relative path of part file
+        """
+        return os.path.join(self.table_names[tblIdx], f"{self.partition_name}={partition}",
+                            f"part-{part:05d}.{self.extensions[self.fmt]}")
+
+    def _get_file(self, rel_path):
+        f = self.files.pop(rel_path, None)
+        if f is None:
+            if len(self.files) >= self.max_open_files:
+                self.files.popitem(last = False)[1].close()
+            full_path = os.path.join(self.out_dir, rel_path)
+            os.makedirs(os.path.dirname(full_path), exist_ok = True)
+            f = open(full_path, 'a' if rel_path in self.sizes else 'w')
+            self.sizes.setdefault(rel_path, 0)
+        self.files[rel_path] = f # most recently used
+        return f
+
+    def write(self, parsed):
+        """
+        * write {(table index, partition value): encoded lines}
+        """
+        for (tblIdx, partition), lines in parsed.items():
+            if len(lines) == 0:
+                continue
+            data = '\n'.join(lines) + '\n'
+            part = self.parts.get((tblIdx, partition), 0)
+            rel_path = self.part_file(tblIdx, partition, part)
+            if self.sizes.get(rel_path, 0) > 0 and self.sizes[rel_path] + len(data) > self.max_file_bytes:
+                part += 1
+                rel_path = self.part_file(tblIdx, partition, part)
+            self.parts[(tblIdx, partition)] = part
+            f = self._get_file(rel_path)
+            if self.header and self.fmt == 'csv' and self.sizes[rel_path] == 0:
+                data = f"{self.csv_delim.join(self.columns[tblIdx])}\n{data}"
+            f.write(data)
+            self.sizes[rel_path] += len(data)
+
+    def resume(self, sizes):
+        """
+        *continue output files of checkpoint*
+
+        * *sizes*: relative file path to size at checkpoint; longer files are cut to it,
+          part files not in *sizes* are removed (written after checkpoint)
+        """
+        tbl_index = {nm: idx for idx, nm in enumerate(self.table_names)}
+        for root, dirs, files in os.walk(self.out_dir):
+            for fn in files:
+                rel_path = os.path.relpath(os.path.join(root, fn), self.out_dir)
+                if rel_path in sizes:
+                    with open(os.path.join(self.out_dir, rel_path), 'r+b') as f:
+                        f.truncate(sizes[rel_path])
+                elif fn.startswith('part-'):
+                    os.remove(os.path.join(self.out_dir, rel_path))
+        self.sizes = dict(sizes)
+        for rel_path in sizes:
+            (tbl_name, partition_dir, fn) = rel_path.split(os.sep)
+            key = (tbl_index[tbl_name], partition_dir.split('=', 1)[1])
+            self.parts[key] = max(self.parts.get(key, 0), int(fn.split('.')[0][len('part-'):]))
+
+    def sync(self):
+        """
+        *flush output files to disk*
+
+        * return relative file path to file size, for checkpoint
+        """
+        for rel_path, f in self.files.items():
+            f.flush()
+            os.fsync(f.fileno())
+        self.sizes = {rel_path: os.path.getsize(os.path.join(self.out_dir, rel_path)) for rel_path in self.sizes}
+        return dict(self.sizes)
+
+    def close(self):
+        """
+        * close all output files
+        """
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def parse_stream(inputs, chunk_parser, writer, chunk_size=1000, workers=1, checkpoint=None, stats=NULL_STATS,
+                 readahead=0, max_bytes=DEFAULT_MAX_BYTES, dedup=None, start_method=None, chunk_bytes=None,
+                 chunk_rows=None):
+    """
+    *parse JSON lines of input files into table files*
+
+    * read *inputs* chunk by chunk, parse by *chunk_parser* (in *workers* processes), write by *writer* (**TableWriter**)
+    * *readahead* and *max_bytes*: read next files in threads, see ingest.Prefetcher
+    * *checkpoint* (checkpoint.Checkpoint, loaded): start from its position, save it after every
+      *checkpoint.every* chunks and at the end; *chunk_parser* must use txn seed of checkpoint
+    * with *delta* of *chunk_parser*, record hashes are saved after the checkpoint (or at the end, after
+      output is flushed): records of a stopped run are parsed again, not lost
+    * *dedup* (dedup.Deduplicator): duplicated lines are dropped in this process before parsing
+      (counted as 'duplicates' in *stats*); they keep their record index, txn ids do not change; its seen
+      keys are saved with *checkpoint* and loaded at resume (resume with other *dedup* than saved is ValueError)
+    * *start_method*: of worker processes, see **parse_chunks**
+    * *chunk_bytes*, *chunk_rows*: chunk is also cut by size of lines or estimated rows, see **sized_chunks**
+    * return number of records of whole input
+    """
+    from collections import deque
+    start = (0, 0)
+    records = 0
+    if checkpoint is not None:
+        if writer.out_dir is None:
+            raise ValueError("output to standard output can not be checkpointed")
+        (start, records) = (checkpoint.position, checkpoint.records)
+        if records > 0 and (checkpoint.dedup_file is None) != (dedup is None):
+            raise ValueError("resume needs same deduplication as checkpoint: "
+                             f"{'with' if dedup is None else 'without'} seen keys saved in {checkpoint.path}")
+        if dedup is not None and checkpoint.dedup_file is not None:
+            dedup.load(checkpoint.dedup_file)
+        writer.resume(checkpoint.tables)
+        for path, n in checkpoint.unmapped.items():
+            chunk_parser.unmapped[path] = chunk_parser.unmapped.get(path, 0) + n
+    positions = deque() # (input position after chunk, records in chunk) of chunks being parsed
+    def chunks():
+        for chunk in sized_chunks(iter_lines_at(inputs, start, readahead, max_bytes), chunk_size, chunk_bytes,
+                                  chunk_rows):
+            positions.append((chunk[-1][1], len(chunk)))
+            if dedup is None:
+                yield [line for (line, pos) in chunk]
+                continue
+            lines = [None if dedup.is_duplicate_line(line) else line for (line, pos) in chunk]
+            stats.count('duplicates', sum(1 for line in lines if line is None))
+            yield lines
+    position = start
+    chunk_cnt = 0
+    for parsed in parse_chunks(chunks(), chunk_parser, workers = workers, first_index = records,
+                               start_method = start_method):
+        with stats.stage('write'):
+            writer.write(parsed)
+        (position, cnt) = positions.popleft()
+        records += cnt
+        chunk_cnt += 1
+        if checkpoint is not None and chunk_cnt % checkpoint.every == 0:
+            checkpoint.commit(writer, position, records, chunk_parser.unmapped, dedup = dedup)
+            if chunk_parser.delta is not None:
+                chunk_parser.delta.commit(end_of_run = False)
+    if checkpoint is not None:
+        checkpoint.commit(writer, position, records, chunk_parser.unmapped, done = True, dedup = dedup)
+    elif chunk_parser.delta is not None and writer.out_dir is not None:
+        writer.sync()
+    if chunk_parser.delta is not None:
+        chunk_parser.delta.commit()
+    return records
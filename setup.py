@@ -179,11 +179,11 @@ setup(
     #
     # For example, the following would provide a command called `py_pkg_db` which
     # executes the function `main` from this package when invoked:
-    # entry_points={  # Optional
-    #     'console_scripts': [
-    #         'py_pkg_db=py_pkg_db:main',
-    #     ],
-    # },
+    entry_points={  # Optional
+        'console_scripts': [
+            'jsonparse=jsonparse.cli:main',
+        ],
+    },
 
     # List additional URLs that are relevant to your project as a dict.
     #
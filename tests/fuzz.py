@@ -0,0 +1,245 @@
+"""
+Parse engine fuzz harness
+=========================
+
+* **Program file**: fuzz.py
+* **Client**      : random nested JSON and maps; all parse engines must give same tables
+
+Random schema (objects, arrays of objects up to a depth, scalars of each
+type), random records of the schema (missing keys, nulls, empty arrays), and
+a map planned from the records (sometimes with wide tables split). Each
+engine parses the same JSON lines; tables are compared record by record,
+modulo txn id (rows are grouped by their uuid, uuids are dropped).
+
+Engines (see **ENGINES**):
+
+* parse_to_csv: only for array depth up to 3
+* parse_use_pool
+* chunk: stream.ChunkParser in this process
+* workers: stream.parse_chunks with 2 worker processes (not in default list, slow to start)
+* rebuild: parse_use_pool, then rebuild.RecordBuilder, then parse rebuilt records again
+
+Used by tests.test_equivalence, and for throughput of each engine:
+
+`python -B -m tests.fuzz --records 5000 --depth 3 --seed 7`
+"""
+import sys
+import json
+import time
+import random
+import string
+import argparse
+import logging
+
+KEY_NAMES = ['id', 'a', 'amt', 'item', 'items', 'code', 'type', 'det', 'sub', 'tag', 'v', 'ab']
+SCALAR_KINDS = ('str', 'int', 'float', 'bool')
+DEFAULT_ENGINES = ('parse_to_csv', 'parse_use_pool', 'chunk', 'rebuild')
+CSV_DELIM = '|'
+
+def random_schema(rng, depth=3, max_keys=5, nesting=3):
+    """
+    *random object schema*
+
+    * {key: ('scalar', kind) | ('object', schema) | ('array', schema)}
+    * at most *depth* array levels and *nesting* object levels inside each other
+    """
+    schema = dict()
+    for key in rng.sample(KEY_NAMES, rng.randint(1, max_keys)):
+        roll = rng.random()
+        if roll < 0.2 and depth > 0:
+            schema[key] = ('array', random_schema(rng, depth - 1, max_keys, nesting))
+        elif roll < 0.35 and nesting > 0:
+            schema[key] = ('object', random_schema(rng, depth, max_keys, nesting - 1))
+        else:
+            schema[key] = ('scalar', rng.choice(SCALAR_KINDS))
+    return schema
+
+def random_scalar(rng, kind):
+    if kind == 'int':
+        return rng.randint(-1000, 100000)
+    if kind == 'float':
+        return round(rng.uniform(-100, 1000), rng.randint(0, 4))
+    if kind == 'bool':
+        return rng.random() < 0.5
+    chars = string.ascii_letters + string.digits + " -_.:é中"
+    return ''.join(rng.choice(chars) for i in range(rng.randint(0, 12)))
+
+def random_value(rng, schema, max_length=3, missing=0.15, null=0.05):
+    """
+    *random object of schema*
+
+    * keys are left out with rate *missing*, values are null with rate *null*
+    * arrays have 0 to *max_length* elements
+    """
+    obj = dict()
+    for key, (kind, sub) in schema.items():
+        if rng.random() < missing:
+            continue
+        if rng.random() < null:
+            obj[key] = None
+        elif kind == 'scalar':
+            obj[key] = random_scalar(rng, sub)
+        elif kind == 'object':
+            obj[key] = random_value(rng, sub, max_length, missing, null)
+        else:
+            obj[key] = [random_value(rng, sub, max_length, missing, null) for i in range(rng.randint(0, max_length))]
+    return obj
+
+def array_depth(schema):
+    """
+    * deepest array level of schema
+    """
+    depth = 0
+    for kind, sub in schema.values():
+        if kind == 'array':
+            depth = max(depth, 1 + array_depth(sub))
+        elif kind == 'object':
+            depth = max(depth, array_depth(sub))
+    return depth
+
+def random_case(seed, records=100, depth=3):
+    """
+    *random test case*
+
+    * return (schema, JSON lines, map); with some seeds wide tables are split
+    """
+    from jsonparse.jsonutils import JsonUtils
+    rng = random.Random(seed)
+    schema = random_schema(rng, depth)
+    lines = [json.dumps(random_value(rng, schema), ensure_ascii = False) for i in range(records)]
+    ju = JsonUtils(csv_delim = CSV_DELIM)
+    ju.load_from_string(jstr = f"[{','.join(lines)}]")
+    ju.compute_all_paths()
+    ju.table_plan_json()
+    if rng.random() < 0.3: # room for key (uuid and sequences) and at least one column
+        key_cnt = 1 + max(len(tbl.get("seqList", None) or []) for tbl in ju.map["tableList"])
+        ju.split_wide_tables(max_columns = key_cnt + rng.randint(1, 4))
+    return (schema, lines, ju.map)
+
+def load(jmap, lines):
+    from jsonparse.jsonutils import JsonUtils
+    ju = JsonUtils(csv_delim = CSV_DELIM)
+    ju.load_from_string(jstr = f"[{','.join(lines)}]")
+    ju.map = jmap
+    return ju
+
+def run_parse_to_csv(jmap, lines):
+    ju = load(jmap, lines)
+    ju.parse_to_csv()
+    return {nm: [r.split(CSV_DELIM) for r in rows] for nm, rows in ju.parsed_tables.items()}
+
+def run_parse_use_pool(jmap, lines):
+    ju = load(jmap, lines)
+    ju.parse_use_pool()
+    return {nm: [r.split(CSV_DELIM) for r in rows] for nm, rows in ju.parsed_tables.items()}
+
+def run_chunk(jmap, lines, workers=1):
+    from jsonparse.stream import ChunkParser, parse_chunks, iter_chunks
+    chunk_parser = ChunkParser(jmap, fmt = 'text', csv_delim = CSV_DELIM)
+    tables = {nm: [] for nm in chunk_parser.table_names[:len(jmap["tableList"])]}
+    for parsed in parse_chunks(iter_chunks(lines, 250), chunk_parser, workers = workers):
+        for tblIdx, rows in parsed.items():
+            tables[chunk_parser.table_names[tblIdx]] += [r.split(CSV_DELIM) for r in rows]
+    return tables
+
+def run_workers(jmap, lines):
+    return run_chunk(jmap, lines, workers = 2)
+
+def run_rebuild(jmap, lines):
+    from jsonparse.jsonutils import RecordParser
+    ju = load(jmap, lines)
+    ju.parse_use_pool()
+    parser = RecordParser(jmap)
+    names = [tbl["tableName"] for tbl in jmap["tableList"]]
+    tables = {nm: [] for nm in names}
+    for txn, rec in ju.rebuild_json().items():
+        for (tblIdx, row) in parser.parse_record(rec, txn):
+            tables[names[tblIdx]].append(row)
+    return tables
+
+ENGINES = {
+    "parse_to_csv": run_parse_to_csv,
+    "parse_use_pool": run_parse_use_pool,
+    "chunk": run_chunk,
+    "workers": run_workers,
+    "rebuild": run_rebuild,
+}
+
+def supports(engine, schema):
+    """
+    * engine can parse data of schema
+    """
+    return engine != 'parse_to_csv' or array_depth(schema) <= 3
+
+def canonical(tables):
+    """
+    *tables modulo txn id*
+
+    * rows are grouped by uuid: each record is {table name: sorted rows without uuid}
+    * return sorted list of records (as JSON text), order of records and uuids do not matter
+    """
+    records = dict()
+    for nm, rows in tables.items():
+        for row in rows:
+            records.setdefault(row[0], dict()).setdefault(nm, []).append(row[1:])
+    return sorted(json.dumps({nm: sorted(rows) for nm, rows in rec.items()}, sort_keys = True)
+                  for rec in records.values())
+
+def compare_engines(seed, records=100, depth=3, engines=DEFAULT_ENGINES):
+    """
+    *run engines on one random case*
+
+    * return list of (engine, base engine, first record which differs); empty list if all are same;
+      base engine is the first engine which supports the case
+    """
+    (schema, lines, jmap) = random_case(seed, records, depth)
+    results = [(nm, canonical(ENGINES[nm](jmap, lines))) for nm in engines if supports(nm, schema)]
+    (base_nm, base) = results[0]
+    diffs = []
+    for nm, result in results[1:]:
+        if result != base:
+            first = next((r for r in result if r not in base), None) or next(r for r in base if r not in result)
+            diffs.append((nm, base_nm, first))
+    return diffs
+
+def throughput(seed, records=5000, depth=3, engines=DEFAULT_ENGINES, repeat=3):
+    """
+    *records per second of each engine on one random case* (best of *repeat* runs)
+    """
+    (schema, lines, jmap) = random_case(seed, records, depth)
+    result = dict()
+    for nm in engines:
+        if not supports(nm, schema):
+            continue
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            ENGINES[nm](jmap, lines)
+            sec = time.perf_counter() - start
+            best = sec if best is None else min(best, sec)
+        result[nm] = records / best
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = "Compare parse engines on random JSON, report throughput")
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--cases", type = int, default = 20, help = "random cases to compare")
+    parser.add_argument("--records", type = int, default = 5000, help = "records of throughput case")
+    parser.add_argument("--depth", type = int, default = 3, help = "max array depth")
+    parser.add_argument("--repeat", type = int, default = 3, help = "runs per engine, best one is used")
+    parser.add_argument("--engine", action = 'append', choices = sorted(ENGINES), help = "default: all but workers")
+    args = parser.parse_args(argv)
+    logging.disable(logging.INFO)
+    engines = args.engine or DEFAULT_ENGINES
+    failed = 0
+    for seed in range(args.seed, args.seed + args.cases):
+        for nm, base_nm, rec in compare_engines(seed, depth = args.depth, engines = engines):
+            failed += 1
+            print(f"seed {seed}: {nm} differs from {base_nm}: {rec}")
+    print(f"{args.cases} cases compared, {failed} differences")
+    for nm, rate in throughput(args.seed, args.records, args.depth, engines, args.repeat).items():
+        print(f"{nm:<16} {rate:12,.0f} records/s")
+    return 1 if failed > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
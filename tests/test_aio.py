@@ -0,0 +1,137 @@
+"""
+Test asyncio pipeline
+=====================
+
+* **Program file**: test_aio.py
+* **Client**      : async records, parse in executor, async sinks with backpressure
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_aio`
+"""
+import json
+import asyncio
+import unittest
+
+from jsonparse.jsonutils import JsonUtils
+from jsonparse.stream import ChunkParser, parse_chunks, iter_chunks
+from jsonparse.aio import parse_async, process_executor
+
+SEED = '0b6c54a4-8e5d-4a4e-9a57-2b0d1d0b5a11'
+
+def make_lines(cnt):
+    """ sample JSON lines
+    """
+    return [json.dumps({"date": "2021-07-10", "txn": {"store": i, "item": [{"sku": str(j)} for j in range(i % 3)]}})
+            for i in range(cnt)]
+
+class Source(object):
+    """ async iterator of lines, counts lines read
+    """
+    def __init__(self, lines):
+        self.lines = lines
+        self.read = 0
+
+    async def __aiter__(self):
+        for line in self.lines:
+            self.read += 1
+            await asyncio.sleep(0)
+            yield line
+
+class TestAio(unittest.TestCase):
+    def setUp(self):
+        ju = JsonUtils()
+        ju.load_from_string(jstr = f"[{','.join(make_lines(3))}]")
+        ju.compute_all_paths()
+        ju.table_plan_json()
+        self.map = ju.map
+
+    def expected(self, lines, chunk_parser):
+        out = dict()
+        for parsed in parse_chunks(iter_chunks(lines, 7), chunk_parser):
+            for tblIdx, rows in parsed.items():
+                out.setdefault(chunk_parser.table_names[tblIdx], []).extend(rows)
+        return out
+
+    def run_pipeline(self, lines, chunk_parser, **kwargs):
+        out = dict()
+        def make_sink(nm):
+            async def sink(rows):
+                out.setdefault(nm, []).extend(rows)
+            return sink
+        sinks = {nm: make_sink(nm) for nm in chunk_parser.table_names}
+        n = asyncio.run(parse_async(Source(lines).__aiter__(), chunk_parser, sinks, chunk_size = 7, **kwargs))
+        return (n, out)
+
+    def test_same_as_sync(self):
+        """ same rows as synchronous parse, in order
+        """
+        lines = make_lines(50)
+        (n, out) = self.run_pipeline(lines, ChunkParser(self.map, txn_seed = SEED))
+        self.assertEqual(n, 50)
+        self.assertEqual(out, self.expected(lines, ChunkParser(self.map, txn_seed = SEED)))
+
+    def test_process_executor(self):
+        """ parse in process pool, unmapped paths come back from workers
+        """
+        lines = make_lines(50) + ['{"clerk": "x"}']
+        chunk_parser = ChunkParser(self.map, txn_seed = SEED, unmapped = 'skip')
+        with process_executor(chunk_parser, 2) as executor:
+            (n, out) = self.run_pipeline(lines, chunk_parser, executor = executor)
+        self.assertEqual(out, self.expected(lines, ChunkParser(self.map, txn_seed = SEED, unmapped = 'skip')))
+        self.assertEqual(chunk_parser.unmapped, {'clerk': 1})
+
+    def test_backpressure(self):
+        """ slow sink: reading waits, only a few chunks ahead
+        """
+        source = Source(make_lines(200))
+        chunk_parser = ChunkParser(self.map)
+        read_at_first_sink = []
+        async def slow_sink(tbl_name, rows):
+            if len(read_at_first_sink) == 0:
+                await asyncio.sleep(0.1)
+                read_at_first_sink.append(source.read)
+        asyncio.run(parse_async(source.__aiter__(), chunk_parser, {}, chunk_size = 10, queue_size = 2,
+                                default_sink = slow_sink))
+        self.assertLessEqual(read_at_first_sink[0], 50)
+        self.assertEqual(source.read, 200)
+
+    def test_stop_with_full_queue(self):
+        """ cancel or read error while queue is full: pipeline stops, no task left waiting
+        """
+        class BadSource(Source):
+            async def __aiter__(self):
+                async for line in Source.__aiter__(self):
+                    yield line
+                raise OSError("connection lost")
+        chunk_parser = ChunkParser(self.map)
+        async def stuck_sink(tbl_name, rows):
+            await asyncio.Event().wait()
+        async def slow_sink(tbl_name, rows):
+            await asyncio.sleep(0.01)
+        async def cancel_when_full():
+            source = Source(make_lines(1000))
+            task = asyncio.ensure_future(parse_async(source.__aiter__(), chunk_parser, {}, chunk_size = 10,
+                                                     queue_size = 2, default_sink = stuck_sink))
+            while source.read < 40:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await asyncio.wait_for(task, 5)
+            return [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        self.assertEqual(asyncio.run(cancel_when_full()), [])
+        async def error_when_full():
+            source = BadSource(make_lines(100))
+            await asyncio.wait_for(parse_async(source.__aiter__(), chunk_parser, {}, chunk_size = 10, queue_size = 2,
+                                               default_sink = slow_sink), 5)
+        with self.assertRaises(OSError):
+            asyncio.run(error_when_full())
+
+    def test_no_sink(self):
+        """ table without sink is error
+        """
+        with self.assertRaises(ValueError):
+            asyncio.run(parse_async(Source(make_lines(5)).__aiter__(), ChunkParser(self.map), {}))
+
+if __name__ == '__main__':
+    unittest.main()
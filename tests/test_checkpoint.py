@@ -0,0 +1,127 @@
+"""
+Test checkpoint
+===============
+
+* **Program file**: test_checkpoint.py
+* **Client**      : streaming parse stops, run again resumes from checkpoint
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_checkpoint`
+"""
+import os
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+from jsonparse.cli import main
+from jsonparse.stream import TableWriter
+
+SEED = '0b6c54a4-8e5d-4a4e-9a57-2b0d1d0b5a11'
+
+def make_records(cnt):
+    """ sample JSON records
+    """
+    return [{"date": "2021-07-10", "txn": {"store": i, "item": [{"sku": str(j)} for j in range(i % 3)]}} for i in range(cnt)]
+
+class Stop(Exception):
+    pass
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        d = self.d = self.tmp.name
+        for n in range(2):
+            with open(f"{d}/d{n}.jsonl", 'w') as f:
+                f.write('\n'.join(json.dumps(r) for r in make_records(23)) + '\n\n')
+        main(['plan', '--map', f"{d}/m.map", f"{d}/d0.jsonl"])
+        self.inputs = [f"{d}/d0.jsonl", f"{d}/d1.jsonl"]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def parse(self, out_dir, *more):
+        return main(['parse', '--map', f"{self.d}/m.map", '--out-dir', out_dir, '--chunk-size', '4',
+                     '--format', 'csv', '--header'] + list(more) + self.inputs)
+
+    def read(self, out_dir):
+        return {fn: open(os.path.join(out_dir, fn), 'r').read() for fn in sorted(os.listdir(out_dir))}
+
+    def test_same_seed(self):
+        """ same txn seed, same output
+        """
+        self.parse(f"{self.d}/a", '--txn-seed', SEED)
+        self.parse(f"{self.d}/b", '--txn-seed', SEED, '--workers', '2')
+        self.assertEqual(self.read(f"{self.d}/a"), self.read(f"{self.d}/b"))
+
+    def test_resume(self):
+        """ stop after rows of a chunk are written but not committed; run again, same output as one run
+        """
+        self.parse(f"{self.d}/a", '--txn-seed', SEED)
+        ckpt = f"{self.d}/c.json"
+        write = TableWriter.write
+        calls = []
+        def write_then_stop(writer, parsed):
+            write(writer, parsed)
+            calls.append(1)
+            if len(calls) == 7:
+                raise Stop()
+        with mock.patch.object(TableWriter, 'write', write_then_stop):
+            with self.assertRaises(Stop):
+                self.parse(f"{self.d}/b", '--checkpoint', ckpt, '--checkpoint-every', '3')
+        with open(ckpt, 'r') as f:
+            state = json.load(f)
+        self.assertEqual((state["position"][0], state["records"], state["done"]), (1, 24, False))
+        self.assertEqual(self.parse(f"{self.d}/b", '--checkpoint', ckpt), 0)
+        with open(ckpt, 'r') as f:
+            state = json.load(f)
+        self.assertEqual((state["records"], state["done"]), (46, True))
+        a = self.read(f"{self.d}/a")
+        b = self.read(f"{self.d}/b")
+        self.assertEqual(sorted(a), sorted(b))
+        # txn ids come from checkpoint seed; compare rows without uuid
+        for fn in a:
+            self.assertEqual([r.split('|', 1)[1] for r in a[fn].splitlines()], [r.split('|', 1)[1] for r in b[fn].splitlines()])
+        self.parse(f"{self.d}/c", '--txn-seed', state["txnSeed"])
+        self.assertEqual(self.read(f"{self.d}/c"), b)
+
+    def test_resume_dedup(self):
+        """ seen keys of deduplication are saved with checkpoint: resumed run drops same records as one run
+        """
+        for method in ('exact', 'bloom'):
+            dedup = ['--dedup', 'content', '--dedup-method', method, '--txn-seed', SEED]
+            self.parse(f"{self.d}/{method}a", *dedup)
+            ckpt = f"{self.d}/{method}.json"
+            write = TableWriter.write
+            calls = []
+            def write_then_stop(writer, parsed):
+                write(writer, parsed)
+                calls.append(1)
+                if len(calls) == 7:
+                    raise Stop()
+            with mock.patch.object(TableWriter, 'write', write_then_stop):
+                with self.assertRaises(Stop):
+                    self.parse(f"{self.d}/{method}b", '--checkpoint', ckpt, '--checkpoint-every', '3', *dedup)
+            with open(ckpt, 'r') as f:
+                state = json.load(f)
+            self.assertEqual(state["position"][0], 1)
+            self.assertEqual(os.listdir(self.d).count(os.path.basename(state["dedupFile"])), 1)
+            with self.assertRaises(ValueError):
+                self.parse(f"{self.d}/{method}b", '--checkpoint', ckpt, '--txn-seed', SEED)
+            self.assertEqual(self.parse(f"{self.d}/{method}b", '--checkpoint', ckpt, *dedup), 0)
+            self.assertEqual(self.read(f"{self.d}/{method}b"), self.read(f"{self.d}/{method}a"))
+            self.assertEqual([fn for fn in os.listdir(self.d) if fn.startswith(f"{method}.json.dedup")],
+                             [os.path.basename(json.load(open(ckpt, 'r'))["dedupFile"])])
+
+    def test_inputs_changed(self):
+        """ checkpoint of other inputs is error
+        """
+        ckpt = f"{self.d}/c.json"
+        self.parse(f"{self.d}/b", '--checkpoint', ckpt)
+        self.inputs = self.inputs[:1]
+        with self.assertRaises(ValueError):
+            self.parse(f"{self.d}/b", '--checkpoint', ckpt)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""
+Test command line tool
+======================
+
+* **Program file**: test_cli.py
+* **Client**      : plan / evolve / parse sub commands
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_cli`
+"""
+import os
+import sys
+import json
+import tempfile
+import subprocess
+import unittest
+
+from jsonparse.cli import main
+from jsonparse.jsonutils import JsonUtils
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+def make_records(cnt, extra=False):
+    """ sample JSON records
+    """
+    rec_list = []
+    for i in range(cnt):
+        rec = {"date": "2021-07-10", "txn": {"store": i, "item": [{"sku": str(j), "amt": j} for j in range(i % 3)]}}
+        if extra:
+            rec["clerk"] = f"c{i}"
+        rec_list.append(rec)
+    return rec_list
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.d = self.tmp.name
+        self.data = os.path.join(self.d, 'd.jsonl')
+        with open(self.data, 'w') as f:
+            f.write('\n'.join(json.dumps(r) for r in make_records(40)))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read_lines(self, fn):
+        with open(fn, 'r') as f:
+            return f.read().splitlines()
+
+    def test_plan_and_parse(self):
+        """ plan map and DDL, parse with 1 or 3 workers, same output except uuid
+        """
+        d = self.d
+        self.assertEqual(main(['plan', '--map', f"{d}/m.map", '--also-map', f"{d}/m.bin",
+                               '--ddl', f"{d}/m.sql", '--prefix', 'ex_', self.data]), 0)
+        self.assertTrue(os.path.exists(f"{d}/m.sql"))
+        ju = JsonUtils()
+        ju.json_map_import(map_file = f"{d}/m.map")
+        self.assertEqual([t["tableName"] for t in ju.map["tableList"]], ['ex_01item', 'ex_00root'])
+
+        main(['parse', '--map', f"{d}/m.map", '--out-dir', f"{d}/p1", self.data])
+        main(['parse', '--map', f"{d}/m.bin", '--out-dir', f"{d}/p3", '--workers', '3', '--chunk-size', '7', self.data])
+        for tbl in ['ex_01item', 'ex_00root']:
+            p1 = [r.split('|', 1)[1] for r in self.read_lines(f"{d}/p1/{tbl}.txt")]
+            p3 = [r.split('|', 1)[1] for r in self.read_lines(f"{d}/p3/{tbl}.txt")]
+            self.assertEqual(p1, p3)
+        self.assertEqual(len(self.read_lines(f"{d}/p1/ex_00root.txt")), 40)
+
+    def test_evolve(self):
+        """ new path in data is added to map
+        """
+        d = self.d
+        main(['plan', '--map', f"{d}/m.map", self.data])
+        with open(f"{d}/new.jsonl", 'w') as f:
+            f.write('\n'.join(json.dumps(r) for r in make_records(5, extra = True)))
+        self.assertEqual(main(['evolve', '--map', f"{d}/m.map", '--out', f"{d}/m2.csv", f"{d}/new.jsonl"]), 0)
+        ju = JsonUtils()
+        ju.map_import_csv(map_csv = f"{d}/m2.csv")
+        ju.map_to_allpath()
+        self.assertIn('clerk', ju.map_path)
+
+    def test_stdin_jsonl(self):
+        """ parse from standard input to standard output
+        """
+        d = self.d
+        main(['plan', '--map', f"{d}/m.map", self.data])
+        line = json.dumps(make_records(3)[2])
+        out = subprocess.run([sys.executable, '-m', 'jsonparse', 'parse', '--map', f"{d}/m.map", '--format', 'jsonl'],
+                             input = line, stdout = subprocess.PIPE, cwd = ROOT, check = True,
+                             universal_newlines = True).stdout.splitlines()
+        tables = [e.split('\t', 1)[0] for e in out]
+        self.assertEqual(sorted(tables), ['00root', '01item', '01item'])
+        row = json.loads(out[tables.index('00root')].split('\t', 1)[1])
+        self.assertEqual(row["store"], "2")
+
+    def test_bad_options(self):
+        """ bad option values exit with code 2 and usage, not traceback
+        """
+        import io
+        d = self.d
+        main(['plan', '--map', f"{d}/m.map", self.data])
+        parse = ['parse', '--map', f"{d}/m.map", '--out-dir', f"{d}/out"]
+        for args in (['plan', '--map', f"{d}/n.map", '--flatten', 'txn.item', self.data],
+                     ['plan', '--map', f"{d}/n.map", '--flatten', 'txn.item=rows', self.data],
+                     parse + ['--columns', '00root', self.data],
+                     parse + ['--where', 'store', self.data],
+                     parse + ['--where', 'txn.nosuch==1', self.data],
+                     parse + ['--where', 'txn.store ~ 1', self.data],
+                     parse + ['--partition-by', 'txn.item.sku', self.data],
+                     parse + ['--delta-index', f"{d}/h.db", self.data],
+                     ['serve', '--feed', f"x={d}/m.map", '--max-maps', '0']):
+            stderr = sys.stderr
+            sys.stderr = io.StringIO()
+            try:
+                with self.assertRaises(SystemExit) as cm:
+                    main(args)
+                message = sys.stderr.getvalue()
+            finally:
+                sys.stderr = stderr
+            self.assertEqual(cm.exception.code, 2, args)
+            self.assertIn("usage:", message)
+            self.assertNotIn("Traceback", message)
+        self.assertFalse(os.path.exists(f"{d}/n.map"))
+
+if __name__ == '__main__':
+    unittest.main()
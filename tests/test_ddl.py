@@ -0,0 +1,72 @@
+"""
+Test DDL keys and indexes
+=========================
+
+* **Program file**: test_ddl.py
+* **Client**      : primary keys, parent indexes, post load file and unlogged tables in DDL
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_ddl`
+"""
+import tempfile
+import unittest
+
+from jsonparse.jsonutils import JsonUtils
+from jsonparse.cli import main
+
+JSTR = """
+[{"date": "2021-07-10", "txn": {"store": 123, "item": [{"sku":"456", "disc": [{"code": "A"}]}]}}]
+"""
+
+class TestDdl(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.d = self.tmp.name
+        self.ju = JsonUtils(table_name_prefix = 'ex_')
+        self.ju.load_from_string(jstr = JSTR)
+        self.ju.compute_all_paths()
+        self.ju.table_plan_json()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self, fn):
+        with open(fn, 'r') as f:
+            return f.read()
+
+    def test_primary_key(self):
+        """ composite primary key after each create table
+        """
+        self.ju.postgres_ddl(sql_file = f"{self.d}/m.sql", schema_name = 's', primary_key = True)
+        ddl = self.read(f"{self.d}/m.sql")
+        self.assertIn("    );\n\nalter table s.ex_02disc add constraint ex_02disc_pk primary key (uuid, seq_item, seq_disc);\n", ddl)
+        self.assertIn("alter table s.ex_00root add constraint ex_00root_pk primary key (uuid);", ddl)
+        self.assertNotIn("create index", ddl)
+        self.assertLess(ddl.index("create table s.ex_01item"), ddl.index("ex_01item_pk"))
+
+    def test_post_load(self):
+        """ parent indexes in post load file, unlogged tables in pre load file
+        """
+        self.ju.postgres_ddl(sql_file = f"{self.d}/pre.sql", schema_name = 's', parent_index = True,
+                             post_load_file = f"{self.d}/post.sql", unlogged = True)
+        pre = self.read(f"{self.d}/pre.sql")
+        post = self.read(f"{self.d}/post.sql")
+        self.assertEqual(pre.count("create unlogged table"), 3)
+        self.assertNotIn("index", pre)
+        self.assertIn("create index ex_02disc_parent_idx on s.ex_02disc (uuid, seq_item);\nanalyze s.ex_02disc;", post)
+        self.assertIn("create index ex_01item_parent_idx on s.ex_01item (uuid);", post)
+        self.assertIn("-- The 3-th table ex_00root, after load\nanalyze s.ex_00root;", post)
+
+    def test_cli(self):
+        """ plan options
+        """
+        with open(f"{self.d}/d.json", 'w') as f:
+            f.write(JSTR)
+        self.assertEqual(main(['plan', '--map', f"{self.d}/m.map", '--input-format', 'json', '--ddl', f"{self.d}/pre.sql",
+                               '--post-load-ddl', f"{self.d}/post.sql", '--primary-key', f"{self.d}/d.json"]), 0)
+        self.assertEqual(self.read(f"{self.d}/post.sql").count("primary key"), 3)
+        self.assertIn("create table", self.read(f"{self.d}/pre.sql"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Test deduplication
+==================
+
+* **Program file**: test_dedup.py
+* **Client**      : duplicated records are dropped before parsing, by key or content, exact or Bloom filter
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_dedup`
+"""
+import json
+import tempfile
+import unittest
+
+from jsonparse.jsonutils import JsonUtils
+from jsonparse.dedup import Deduplicator, BloomFilter
+from jsonparse.cli import main
+
+def make_records(ids):
+    """ records with key txn.id
+    """
+    return [{"txn": {"id": i, "store": i % 3, "item": [{"sku": str(j)} for j in range(2)]}} for i in ids]
+
+class TestDedup(unittest.TestCase):
+    def setUp(self):
+        self.ju = JsonUtils(csv_delim = '|')
+        self.data = make_records([1, 2, 3, 2, 1, 4])
+        self.data[4]["txn"]["store"] = 9 # same key, other content
+        self.ju.load_from_string(jstr = json.dumps(self.data))
+        self.ju.compute_all_paths()
+        self.ju.table_plan_json()
+        self.ju.enable_stats()
+
+    def test_key(self):
+        """ by key path, both engines
+        """
+        self.ju.parse_use_pool(dedup = Deduplicator(['txn.id']))
+        self.assertEqual(len(self.ju.parsed_tables['00root']), 4)
+        self.assertEqual(len(self.ju.parsed_tables['01item']), 8)
+        self.assertEqual(self.ju.stats.counters['duplicates'], 2)
+        self.ju.parse_to_csv(dedup = Deduplicator(['txn.id']))
+        self.assertEqual(len(self.ju.parsed_tables['00root']), 4)
+
+    def test_content(self):
+        """ by content hash: same key with other content is kept; key order does not matter
+        """
+        self.data.append({"txn": {"store": 1, "item": [{"sku": "0"}, {"sku": "1"}], "id": 1}})
+        self.ju.load_from_string(jstr = json.dumps(self.data))
+        self.ju.parse_use_pool(dedup = Deduplicator())
+        self.assertEqual(len(self.ju.parsed_tables['00root']), 5)
+
+    def test_bloom(self):
+        """ Bloom filter: size from capacity and error rate, no false negative, few false positives
+        """
+        bloom = BloomFilter(capacity = 10000, error_rate = 0.01)
+        self.assertEqual(bloom.hash_count, 7)
+        self.assertEqual(len(bloom.bits), 11982)
+        dedup = Deduplicator(['txn.id'], method = 'bloom', capacity = 10000, error_rate = 0.01)
+        recs = make_records(range(10000))
+        dropped = sum(dedup.is_duplicate(r) for r in recs)
+        self.assertLess(dropped, 300)
+        self.assertTrue(all(dedup.is_duplicate(r) for r in recs[:1000]))
+        with self.assertRaises(ValueError):
+            Deduplicator(method = 'cuckoo')
+
+    def test_cli(self):
+        """ streaming: duplicated lines dropped in main process, txn ids of others do not change
+        """
+        with tempfile.TemporaryDirectory() as d:
+            self.ju.json_map_export(map_file = f"{d}/m.map")
+            with open(f"{d}/d.jsonl", 'w') as f:
+                f.write('\n'.join(json.dumps(r) for r in self.data))
+            args = ['parse', '--map', f"{d}/m.map", '--txn-seed', '0b6c54a4-8e5d-4a4e-9a57-2b0d1d0b5a11',
+                    '--chunk-size', '2', '--stats', f"{d}/s.json"]
+            self.assertEqual(main(args + ['--out-dir', f"{d}/a", f"{d}/d.jsonl"]), 0)
+            self.assertEqual(main(args + ['--out-dir', f"{d}/b", '--dedup', 'txn.id', '--workers', '2', f"{d}/d.jsonl"]), 0)
+            with open(f"{d}/s.json", 'r') as f:
+                self.assertEqual(json.load(f)["counters"]["duplicates"], 2)
+            self.assertEqual(main(args + ['--out-dir', f"{d}/c", '--dedup', 'content', '--dedup-method', 'bloom',
+                                          f"{d}/d.jsonl"]), 0)
+            read = lambda fn: open(fn, 'r').read().splitlines()
+            all_rows = read(f"{d}/a/00root.txt")
+            self.assertEqual(read(f"{d}/b/00root.txt"), [all_rows[i] for i in (0, 1, 2, 5)])
+            self.assertEqual(read(f"{d}/c/00root.txt"), [all_rows[i] for i in (0, 1, 2, 4, 5)])
+
+if __name__ == '__main__':
+    unittest.main()
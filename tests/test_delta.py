@@ -0,0 +1,168 @@
+"""
+Test delta load
+===============
+
+* **Program file**: test_delta.py
+* **Client**      : unchanged records are skipped by content hash, changed records keep txn id of their key
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_delta`
+"""
+import os
+import json
+import tempfile
+import unittest
+
+from jsonparse.jsonutils import JsonUtils
+from jsonparse.delta import DeltaFilter, record_hash, key_txn_id
+from jsonparse.cli import main
+
+def make_records(ids, version=0):
+    """ records with key txn.id
+    """
+    return [{"txn": {"id": i, "store": i % 3, "item": [{"sku": str(j), "v": version} for j in range(2)]}} for i in ids]
+
+class TestDelta(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.d = self.tmp.name
+        self.ju = JsonUtils(csv_delim = '|')
+        self.ju.load_from_string(jstr = json.dumps(make_records(range(10))))
+        self.ju.compute_all_paths()
+        self.ju.table_plan_json()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_hash(self):
+        """ key order does not change hash
+        """
+        self.assertEqual(record_hash({"a": 1, "b": [1, {"c": 2, "d": 3}]}), record_hash({"b": [1, {"d": 3, "c": 2}], "a": 1}))
+        self.assertNotEqual(record_hash({"a": 1}), record_hash({"a": "1"}))
+
+    def test_parse_use_pool(self):
+        """ second run parses new and changed records only, txn id from key
+        """
+        with DeltaFilter(f"{self.d}/h.db", ['txn.id']) as delta:
+            self.ju.enable_stats()
+            self.ju.parse_use_pool(delta = delta)
+            self.assertEqual(len(self.ju.parsed_tables['00root']), 10)
+            self.assertEqual(delta.commit(), 10)
+            # overlapping window: 5..9 same, 7 changed, 10..11 new, one record without key
+            data = make_records(range(5, 12))
+            data[2] = make_records([7], version = 1)[0]
+            data.append({"txn": {"store": 1}})
+            self.ju.load_from_string(jstr = json.dumps(data))
+            self.ju.enable_stats()
+            self.ju.parse_use_pool(delta = delta)
+            uuids = [r.split('|')[0] for r in self.ju.parsed_tables['00root']]
+            self.assertEqual(len(uuids), 4)
+            self.assertEqual(uuids[:3], [key_txn_id(json.dumps([i])) for i in (7, 10, 11)])
+            counters = self.ju.stats.counters
+            self.assertEqual((counters['delta_new'], counters['delta_changed'], counters['delta_unchanged'],
+                              counters['delta_unkeyed']), (2, 1, 4, 1))
+            self.assertEqual(len(self.ju.parsed_tables['01item']), 6)
+        with DeltaFilter(f"{self.d}/h.db", ['txn.id']) as delta:
+            self.ju.parse_use_pool(delta = delta) # nothing committed: same records again
+            self.assertEqual(len(self.ju.parsed_tables['00root']), 4)
+
+    def test_stream(self):
+        """ command line: second run writes changed records only; workers; delta script
+        """
+        d = self.d
+        self.ju.json_map_export(map_file = f"{d}/m.map")
+        with open(f"{d}/a.jsonl", 'w') as f:
+            f.write('\n'.join(json.dumps(r) for r in make_records(range(20))))
+        data = make_records(range(10, 25))
+        data[0] = make_records([10], version = 2)[0]
+        with open(f"{d}/b.jsonl", 'w') as f:
+            f.write('\n'.join(json.dumps(r) for r in data))
+        args = ['parse', '--map', f"{d}/m.map", '--delta-index', f"{d}/h.db", '--delta-key', 'txn.id', '--chunk-size', '4']
+        self.assertEqual(main(args + ['--out-dir', f"{d}/o1", f"{d}/a.jsonl"]), 0)
+        self.assertEqual(main(args + ['--out-dir', f"{d}/o2", '--workers', '2', f"{d}/b.jsonl"]), 0)
+        with open(f"{d}/o2/00root.txt", 'r') as f:
+            rows = f.read().splitlines()
+        self.assertEqual(sorted(json.loads(r.split('|')[1]) for r in rows), [10, 20, 21, 22, 23, 24])
+        self.assertEqual(main(args + ['--out-dir', f"{d}/o3", f"{d}/b.jsonl"]), 0)
+        self.assertFalse(os.path.exists(f"{d}/o3/00root.txt") and os.path.getsize(f"{d}/o3/00root.txt") > 0)
+        self.assertEqual(main(['plan', '--map', f"{d}/n.map", '--delta-sql', f"{d}/delta.sql", '--schema', 's',
+                               f"{d}/a.jsonl"]), 0)
+        with open(f"{d}/delta.sql", 'r') as f:
+            sql = f.read()
+        self.assertIn("delete from s.00root t using delta_txn d where t.uuid = d.uuid;", sql)
+        self.assertIn("    union select uuid from staging.00root;", sql)
+        self.assertTrue(sql.rstrip().endswith("commit;"))
+
+    def test_same_key_twice(self):
+        """ key twice in one input: one version is parsed (last one in same batch), no duplicate rows of txn id
+        """
+        data = make_records(range(6))
+        data.insert(2, make_records([4], version = 1)[0]) # key 4 twice, other content
+        data.append(make_records([1], version = 2)[0])    # key 1 twice, other content, last record
+        with DeltaFilter(f"{self.d}/h.db", ['txn.id']) as delta:
+            self.ju.load_from_string(jstr = json.dumps(data))
+            self.ju.parse_use_pool(delta = delta)
+            roots = self.ju.parsed_tables['00root']
+            self.assertEqual(len(roots), 6)
+            self.assertEqual(len(set(r.split('|')[0] for r in roots)), 6)
+            items = [r for r in self.ju.parsed_tables['01item'] if r.startswith(key_txn_id('[1]'))]
+            self.assertEqual(len(items), 2)
+            self.assertTrue(all(r.endswith('|2') for r in items))
+            self.assertEqual(delta.pending[json.dumps([1])], record_hash(data[-1]))
+        # stream: key in other chunk (in this process or other worker) is parsed once
+        d = self.d
+        self.ju.json_map_export(map_file = f"{d}/m.map")
+        with open(f"{d}/a.jsonl", 'w') as f:
+            f.write('\n'.join(json.dumps(r) for r in data))
+        for n, workers in enumerate(('1', '3')):
+            args = ['parse', '--map', f"{d}/m.map", '--delta-index', f"{d}/s{n}.db", '--delta-key', 'txn.id',
+                    '--chunk-size', '2', '--workers', workers, '--out-dir', f"{d}/o{n}", f"{d}/a.jsonl"]
+            self.assertEqual(main(args), 0)
+            with open(f"{d}/o{n}/00root.txt", 'r') as f:
+                uuids = [r.split('|')[0] for r in f.read().splitlines()]
+            with open(f"{d}/o{n}/01item.txt", 'r') as f:
+                items = f.read().splitlines()
+            self.assertEqual(sorted(uuids), sorted(set(uuids)))
+            self.assertEqual(len(uuids), 6)
+            self.assertEqual(len(items), 12)
+
+    def test_not_parsed_not_saved(self):
+        """ records rejected by filter or put into dead letter table are not saved, next run parses them
+        """
+        from jsonparse.stream import ChunkParser
+        with DeltaFilter(f"{self.d}/h.db", ['txn.id']) as delta:
+            self.ju.load_from_string(jstr = json.dumps(make_records(range(6))))
+            self.ju.parse_use_pool(where = [('txn.store', '==', 0)], delta = delta)
+            self.assertEqual(len(self.ju.parsed_tables['00root']), 2)
+            self.assertEqual(delta.commit(), 2)
+            self.ju.parse_use_pool(delta = delta)
+            self.assertEqual(sorted(json.loads(r.split('|')[1]) for r in self.ju.parsed_tables['00root']), [1, 2, 4, 5])
+        with DeltaFilter(f"{self.d}/s.db", ['txn.id']) as delta:
+            chunk_parser = ChunkParser(self.ju.map, csv_delim = '|', record_filter = lambda js: js["txn"]["id"] < 3,
+                                       delta = delta)
+            lines = [json.dumps(r) for r in make_records(range(6))]
+            root = chunk_parser.table_names.index('00root')
+            self.assertEqual(len(chunk_parser(lines)[root]), 3)
+            self.assertEqual(delta.commit(), 3)
+            chunk_parser.record_filter = None
+            self.assertEqual(len(chunk_parser(lines)[root]), 3)
+        # map without path of record: quarantined, parsed after map is fixed
+        data = make_records(range(4))
+        data[1]["txn"]["note"] = "late"
+        with DeltaFilter(f"{self.d}/q.db", ['txn.id']) as delta:
+            self.ju.load_from_string(jstr = json.dumps(data))
+            self.ju.parse_use_pool(on_error = 'quarantine', delta = delta)
+            self.assertEqual((len(self.ju.parsed_tables['00root']), len(self.ju.dead_letters)), (3, 1))
+            self.assertEqual(delta.commit(), 3)
+            fixed = JsonUtils(csv_delim = '|')
+            fixed.load_from_string(jstr = json.dumps(data))
+            fixed.compute_all_paths()
+            fixed.table_plan_json()
+            fixed.parse_use_pool(on_error = 'quarantine', delta = delta)
+            roots = fixed.parsed_tables['00root']
+            self.assertEqual([r.split('|')[0] for r in roots], [key_txn_id('[1]')])
+            self.assertIn('late', roots[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+"""
+Test dynamic keys and path spill
+================================
+
+* **Program file**: test_dynamic.py
+* **Client**      : objects keyed by data values become key/value tables; paths are spilled to disk
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_dynamic`
+"""
+import os
+import json
+import tempfile
+import unittest
+
+from jsonparse.cli import main
+from jsonparse.errors import MapError, UnmappedArrayError
+from jsonparse.jsonutils import JsonUtils, RecordParser
+from jsonparse.pathstore import PathStore, discover_paths
+from jsonparse.stream import ChunkParser, parse_chunks, iter_chunks
+
+def make_record(i):
+    """ stock keyed by SKU (object values with array inside), attributes keyed by name (scalar values)
+    """
+    rec = {"id": i, "store": {"no": i % 3, "city": "x"}}
+    rec["stock"] = {f"SKU-{i * 2 + j}": {"qty": j, "lot": [{"n": k} for k in range(j + 1)]} for j in range(3)}
+    rec["attr"] = {f"a{i % 7}": i, f"b{i % 5}": "on"}
+    return rec
+
+RECORDS = [make_record(i) for i in range(40)]
+
+class TestDynamic(unittest.TestCase):
+    def setUp(self):
+        self.ju = JsonUtils(csv_delim = '|')
+        self.ju.load_from_string(jstr = json.dumps(RECORDS))
+
+    def test_path_store(self):
+        """ spilled paths come back distinct and sorted, file is removed
+        """
+        paths = [(f"k{i % 37}", f"v{i % 11}") for i in range(500)] + [("k1",), ("k1", "v1", "x")]
+        with PathStore(max_memory_paths = 20) as store:
+            for p in paths:
+                store.add(p)
+            self.assertGreater(store.spill_count, 0)
+            self.assertLessEqual(len(store.paths), 20)
+            db_file = store._file
+            result = list(store)
+        self.assertEqual(result, sorted(set(paths)))
+        self.assertFalse(os.path.exists(db_file))
+
+    def test_control_characters(self):
+        """ keys with characters below separator of spilled paths: same order and same paths as split_paths
+        """
+        from jsonparse.jsonutils import get_paths, split_paths
+        keys = ["", "\x00", "\x01", "\x02", "\x1e", "\x1f", "a", "a\x00", "a\x1e"]
+        recs = [dict({k: {"x": 1, "y": [{"z": 2}]} for k in keys}, b = {k: i for i, k in enumerate(keys)})]
+        paths = [tuple(p) for rec in recs for p in get_paths(rec, '__JSON_array__')]
+        expected = split_paths([list(p) for p in paths], '__JSON_array__')
+        self.assertEqual(len(expected[0]), 3 * len(keys))
+        for limit in (None, 3):
+            with PathStore(max_memory_paths = limit) as store:
+                for p in paths:
+                    store.add(p)
+                self.assertEqual(list(store), sorted(set(paths)))
+            self.assertEqual(discover_paths(recs, max_memory_paths = limit), expected)
+
+    def test_spill_memory(self):
+        """ with spill, memory besides result lists is bounded (not a set of all paths)
+        """
+        import tracemalloc
+        recs = [{"grp": {f"k{i}_{j}": {"v": 1, "w": [1]} for j in range(20)}} for i in range(500)]
+        usage = dict()
+        for limit in (None, 200):
+            tracemalloc.start()
+            try:
+                result = discover_paths(recs, max_memory_paths = limit)
+                (current, peak) = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            usage[limit] = (result, peak - current)
+        self.assertEqual(usage[None][0], usage[200][0])
+        self.assertEqual(len(usage[200][0][0]), 10000)
+        self.assertLess(usage[200][1] * 3, usage[None][1])
+        self.assertLess(usage[200][1], 2 * 1024 * 1024)
+
+    def test_discover(self):
+        """ dynamic objects are tables, same paths with spill, keys found before collapse are removed
+        """
+        self.ju.compute_all_paths(key_threshold = 8)
+        self.assertEqual(self.ju.dynamiclist, ["attr", "stock"])
+        self.assertEqual(self.ju.arraylist, ["attr", "stock", "stock.lot"])
+        self.assertEqual(self.ju.pathlist, ["attr.[value]", "id", "stock.lot.n", "stock.qty", "store.city", "store.no"])
+        self.assertEqual(self.ju.array_max_length, {"attr": 2, "stock": 3, "stock.lot": 3})
+        dynamic = set()
+        self.assertEqual(discover_paths(RECORDS, key_threshold = 8, max_memory_paths = 5, dynamic = dynamic),
+                         (self.ju.pathlist, self.ju.arraylist))
+        self.assertEqual(dynamic, {"attr", "stock"})
+        # no threshold: one column for each key
+        (pathlist, arraylist) = discover_paths(RECORDS)
+        self.assertIn("stock.SKU-7.qty", pathlist)
+
+    def test_parse_and_rebuild(self):
+        """ key/value rows, stream parse gives same rows, records rebuilt as input
+        """
+        self.ju.compute_all_paths(key_threshold = 8)
+        self.ju.table_plan_json()
+        tbl = next(t for t in self.ju.map["tableList"] if t["rootPath"] == "stock")
+        self.assertTrue(tbl["dynamicKeys"])
+        self.assertEqual([c["columnName"] for c in tbl["columnList"]], ["key", "qty"])
+        self.ju.parse_use_pool()
+        stock = sorted(r.split('|', 1)[1] for r in self.ju.parsed_tables["02stock"])
+        self.assertEqual(len(stock), 40 * 3)
+        self.assertIn("1|SKU-0|0", stock)
+        self.assertEqual(len(self.ju.parsed_tables["03lot"]), 40 * 6)
+        self.assertEqual(len(self.ju.parsed_tables["01attr"]), 40 * 2)
+        chunk_parser = ChunkParser(self.ju.map, fmt = 'text', csv_delim = '|')
+        tables = {nm: [] for nm in self.ju.parsed_tables}
+        lines = [json.dumps(r) for r in RECORDS]
+        for parsed in parse_chunks(iter_chunks(lines, 7), chunk_parser):
+            for tblIdx, rows in parsed.items():
+                tables[chunk_parser.table_names[tblIdx]] += [r.split('|', 1)[1] for r in rows]
+        self.assertEqual({nm: sorted(rows) for nm, rows in tables.items()},
+                         {nm: sorted(r.split('|', 1)[1] for r in rows) for nm, rows in self.ju.parsed_tables.items()})
+        rebuilt = self.ju.rebuild_json()
+        by_id = {rec["id"]: rec for rec in rebuilt.values()}
+        self.assertEqual([by_id[i] for i in range(len(RECORDS))], RECORDS)
+
+    def test_not_supported(self):
+        """ parse_to_csv and flatten do not support key/value tables; array value is not in map
+        """
+        self.ju.compute_all_paths(key_threshold = 8)
+        self.ju.table_plan_json()
+        with self.assertRaises(MapError):
+            self.ju.parse_to_csv()
+        with self.assertRaises(ValueError):
+            self.ju.flatten_array("attr", 'json')
+        parser = RecordParser(self.ju.map)
+        with self.assertRaises(UnmappedArrayError):
+            parser.parse_record({"id": 1, "attr": {"z": [1, 2]}}, "t1")
+        parser = RecordParser(self.ju.map, unmapped = 'skip')
+        parser.parse_record({"id": 1, "attr": {"z": [1, 2]}}, "t1")
+        self.assertEqual(dict(parser.unmapped), {"attr.[value]": 1})
+
+    def test_cli(self):
+        """ plan with dynamic keys and spill; evolve keeps new keys in key/value table, CSV map keeps it
+        """
+        with tempfile.TemporaryDirectory() as d:
+            with open(f"{d}/d.jsonl", 'w') as f:
+                f.write('\n'.join(json.dumps(r) for r in RECORDS))
+            self.assertEqual(main(['plan', '--map', f"{d}/m.csv", '--dynamic-keys', '8', '--spill-paths', '10',
+                                   f"{d}/d.jsonl"]), 0)
+            new_rec = make_record(500)
+            new_rec["stock"]["SKU-NEW"] = {"qty": 1, "bin": "b7"}
+            with open(f"{d}/new.jsonl", 'w') as f:
+                f.write(json.dumps(new_rec))
+            self.assertEqual(main(['evolve', '--map', f"{d}/m.csv", '--out', f"{d}/m2.map", f"{d}/new.jsonl"]), 0)
+            ju = JsonUtils()
+            ju.json_map_import(map_file = f"{d}/m2.map")
+        stock = [t for t in ju.map["tableList"] if t.get("dynamicKeys", False)]
+        self.assertEqual(sorted(t["rootPath"] for t in stock), ["attr", "stock"])
+        clms = [c["relativePath"] for t in stock for c in t["columnList"]]
+        self.assertIn("bin", clms)
+        self.assertNotIn("SKU-NEW.bin", clms)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""
+Test parse engine equivalence
+=============================
+
+* **Program file**: test_equivalence.py
+* **Client**      : random nested JSON and maps (tests.fuzz); all engines give same tables modulo txn id
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_equivalence`
+
+More cases and throughput of each engine: `python -B -m tests.fuzz --cases 200`
+"""
+import json
+import unittest
+
+from jsonparse.jsonutils import JsonUtils
+from tests.fuzz import ENGINES, compare_engines, random_case, canonical, throughput
+
+class TestEquivalence(unittest.TestCase):
+    def test_random_cases(self):
+        """ engines give same tables on random cases, array depth 1 to 4
+        """
+        for seed in range(1, 41):
+            with self.subTest(seed = seed):
+                self.assertEqual(compare_engines(seed, records = 40, depth = seed % 4 + 1), [])
+
+    def test_workers(self):
+        """ worker processes give same tables
+        """
+        self.assertEqual(compare_engines(3, records = 60, engines = ('parse_use_pool', 'workers')), [])
+
+    def test_canonical(self):
+        """ uuids and order of records do not matter, rows of one record stay together
+        """
+        one = {"t": [["u1", "a"], ["u2", "b"]], "c": [["u1", "1", "x"]]}
+        two = {"t": [["v2", "b"], ["v1", "a"]], "c": [["v1", "1", "x"]]}
+        other = {"t": [["v2", "b"], ["v1", "a"]], "c": [["v2", "1", "x"]]}
+        self.assertEqual(canonical(one), canonical(two))
+        self.assertNotEqual(canonical(one), canonical(other))
+
+    def test_throughput(self):
+        """ records per second of each engine
+        """
+        rates = throughput(5, records = 50, engines = ('parse_to_csv', 'parse_use_pool'), repeat = 1)
+        self.assertEqual(sorted(rates), ['parse_to_csv', 'parse_use_pool'])
+        self.assertTrue(all(r > 0 for r in rates.values()))
+
+    def test_found_cases(self):
+        """ cases found by the harness: key which is start of other key, same array name at two levels,
+            table without columns, record without array
+        """
+        data = [{"a": "x", "ab": {"v": [{"v": [{"n": 1}]}]}, "tag": {"a": [{"k": 1}]}}, {"a": "y"}]
+        ju = JsonUtils(csv_delim = '|')
+        ju.load_from_string(jstr = json.dumps(data))
+        ju.compute_all_paths()
+        self.assertIn("a", ju.pathlist)
+        ju.table_plan_json()
+        seq_names = {tbl["rootPath"]: [e["columnName"] for e in tbl.get("seqList", None) or []]
+                     for tbl in ju.map["tableList"]}
+        self.assertEqual(seq_names["ab.v.v"], ["seq_v", "seq_v_2"])
+        self.assertEqual(seq_names["tag.a"], ["seq_a"])
+        lines = [json.dumps(r) for r in data]
+        self.assertEqual(canonical(ENGINES["parse_to_csv"](ju.map, lines)),
+                         canonical(ENGINES["parse_use_pool"](ju.map, lines)))
+
+    def test_random_case(self):
+        """ same seed gives same case
+        """
+        self.assertEqual(random_case(9, records = 5)[1], random_case(9, records = 5)[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+Test errors
+===========
+
+* **Program file**: test_errors.py
+* **Client**      : exceptions instead of exit, dead letter of bad records
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_errors`
+"""
+import json
+import tempfile
+import unittest
+
+from jsonparse.jsonutils import JsonUtils
+from jsonparse.errors import JsonParseError, DecodeError, MapError, MapMismatchError, UnmappedPathError, \
+    UnmappedArrayError, UnsupportedDepthError
+from jsonparse.cli import main
+
+JSTR = """
+[{"date": "2021-07-10", "txn": {"store": 123, "item": [{"sku":"456"}, {"sku": "789"}]}}]
+"""
+
+class TestErrors(unittest.TestCase):
+    def setUp(self):
+        self.ju = JsonUtils(csv_delim = '|', table_name_prefix = 'ex_')
+        self.ju.load_from_string(jstr = JSTR)
+        self.ju.compute_all_paths()
+        self.ju.table_plan_json()
+
+    def test_hierarchy(self):
+        """ errors are JsonParseError (and ValueError) with path and record index
+        """
+        with self.assertRaises(DecodeError):
+            self.ju.load_from_string(jstr = '[{"a": ')
+        with tempfile.TemporaryDirectory() as d:
+            with open(f"{d}/m.map", 'w') as f:
+                f.write('{"tableNumber"')
+            with self.assertRaises(MapError):
+                self.ju.json_map_import(map_file = f"{d}/m.map")
+        self.ju.load_from_string(jstr = '[{"txn": {"store": 1, "promo": [{"code": "A"}]}}]')
+        with self.assertRaises(UnmappedArrayError) as cm:
+            self.ju.parse_use_pool()
+        self.assertEqual((cm.exception.path, cm.exception.record_index), ('txn.promo', 0))
+        self.assertTrue(issubclass(UnmappedArrayError, UnmappedPathError))
+        self.assertTrue(issubclass(UnmappedPathError, MapMismatchError))
+        self.assertTrue(issubclass(UnsupportedDepthError, ValueError))
+
+    def test_index_after_skip(self):
+        """ record index of error is position in input, also after records are skipped (duplicates)
+        """
+        from jsonparse.dedup import Deduplicator
+        from jsonparse.stream import ChunkParser, parse_chunks, iter_chunks
+        recs = [{"txn": {"store": 1}}, {"txn": {"store": 1}}, {"txn": {"store": 2, "clerk": "x"}}]
+        self.ju.load_from_string(jstr = json.dumps(recs))
+        with self.assertRaises(UnmappedPathError) as cm:
+            self.ju.parse_use_pool(dedup = Deduplicator())
+        self.assertEqual(cm.exception.record_index, 2)
+        self.ju.parse_use_pool(dedup = Deduplicator(), on_error = 'quarantine')
+        self.assertEqual([d["record_index"] for d in self.ju.dead_letters], [2])
+        chunk_parser = ChunkParser(self.ju.map, csv_delim = '|')
+        lines = [json.dumps(r) for r in recs]
+        with self.assertRaises(UnmappedPathError) as cm:
+            list(parse_chunks(iter_chunks([lines[0], None, lines[2]], 2), chunk_parser))
+        self.assertEqual(cm.exception.record_index, 2)
+
+    def test_map_mismatch(self):
+        """ new path which belongs to no table (map without root table)
+        """
+        self.ju.map["tableList"] = [tbl for tbl in self.ju.map["tableList"] if len(tbl["rootPath"]) > 0]
+        self.ju.map_to_allpath()
+        with self.assertRaises(MapMismatchError) as cm:
+            self.ju.add_new_path_to_map(['clerk'])
+        self.assertEqual(cm.exception.path, 'clerk')
+
+    def test_quarantine(self):
+        """ bad records go to dead letters, other records are parsed
+        """
+        self.ju.load_from_string(jstr = '[{"txn": {"store": 1}}, {"txn": {"store": 2, "clerk": "x"}}, {"txn": {"store": 3}}]')
+        self.ju.parse_use_pool(on_error = 'quarantine')
+        self.assertEqual([r.split('|')[-1] for r in self.ju.parsed_tables['ex_00root']], ['1', '3'])
+        self.assertEqual(len(self.ju.dead_letters), 1)
+        dl = self.ju.dead_letters[0]
+        self.assertEqual((dl["record_index"], dl["error"], dl["path"]), (1, 'UnmappedPathError', 'txn.clerk'))
+        self.assertEqual(json.loads(dl["record"])["txn"]["store"], 2)
+
+    def test_cli_quarantine(self):
+        """ parse sub command puts invalid lines and unmapped records into dead letter table
+        """
+        with tempfile.TemporaryDirectory() as d:
+            self.ju.json_map_export(map_file = f"{d}/m.map")
+            with open(f"{d}/d.jsonl", 'w') as f:
+                f.write('{"txn": {"store": 1}}\n{"txn": \n{"txn": {"store": 2, "clerk": "x"}}\n{"txn": {"store": 3}}\n')
+            self.assertEqual(main(['parse', '--map', f"{d}/m.map", '--out-dir', f"{d}/a", f"{d}/d.jsonl"]), 1)
+            self.assertEqual(main(['parse', '--map', f"{d}/m.map", '--out-dir', f"{d}/b", '--prefix', 'ex_',
+                                   '--format', 'jsonl', '--on-error', 'quarantine', '--workers', '2',
+                                   '--chunk-size', '2', f"{d}/d.jsonl"]), 0)
+            with open(f"{d}/b/ex_dead_letter.jsonl", 'r') as f:
+                rows = [json.loads(line) for line in f]
+            self.assertEqual([(r["record_index"], r["error"]) for r in rows], [('1', 'DecodeError'), ('2', 'UnmappedPathError')])
+            with open(f"{d}/b/ex_00root.jsonl", 'r') as f:
+                self.assertEqual(len(f.read().splitlines()), 2)
+        self.assertTrue(issubclass(DecodeError, JsonParseError))
+
+if __name__ == '__main__':
+    unittest.main()
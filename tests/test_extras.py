@@ -0,0 +1,75 @@
+"""
+Test extras column
+==================
+
+* **Program file**: test_extras.py
+* **Client**      : values not in map go to extras (jsonb) column of their table
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_extras`
+"""
+import json
+import tempfile
+import unittest
+
+from jsonparse.jsonutils import JsonUtils, compile_map
+from jsonparse.stream import table_columns
+
+JSTR = """
+[{"date": "2021-07-10", "txn": {"store": 123, "item": [{"sku":"456", "amt": 3.20}, {"sku": "789"}]}}]
+"""
+JSTR_NEW = """
+[{"date": "2021-07-10", "txn": {"store": 123, "item": [{"sku":"456", "amt": 3.20, "qty": 2}, {"sku": "789"}],
+  "promo": [{"code": "A"}], "geo": {"lat": 1.5}}}]
+"""
+
+class TestExtras(unittest.TestCase):
+    def setUp(self):
+        self.ju = JsonUtils(csv_delim = '|', table_name_prefix = 'ex_')
+        self.ju.load_from_string(jstr = JSTR)
+        self.ju.compute_all_paths()
+        self.ju.table_plan_json(extras_column = 'extras')
+
+    def test_map(self):
+        """ every table has extras column, in DDL and CSV map
+        """
+        self.assertEqual([t["extrasColumn"] for t in self.ju.map["tableList"]], ['extras', 'extras'])
+        self.assertEqual(table_columns(self.ju.map["tableList"][0])[-1], 'extras')
+        with tempfile.TemporaryDirectory() as d:
+            self.ju.postgres_ddl(sql_file = f"{d}/m.sql", schema_name = 's')
+            with open(f"{d}/m.sql", 'r') as f:
+                self.assertIn('extras jsonb', f.read())
+            self.ju.map_export_csv(map_csv = f"{d}/m.csv")
+            ju = JsonUtils()
+            ju.map_import_csv(map_csv = f"{d}/m.csv")
+            self.assertEqual(ju.map, self.ju.map)
+
+    def test_parse(self):
+        """ values not in map are kept in extras column, not counted as unmapped
+        """
+        self.ju.load_from_string(jstr = JSTR_NEW)
+        self.assertEqual(self.ju.parse_use_pool(), {})
+        root = self.ju.parsed_tables['ex_00root'][0].split('|')
+        self.assertEqual(json.loads(root[-1]), {"txn.promo": [{"code": "A"}], "txn.geo": {"lat": 1.5}})
+        items = [r.split('|', 1)[1] for r in self.ju.parsed_tables['ex_01item']]
+        self.assertEqual(items, ['1|3.2|456|{"qty":2}', '2||789|'])
+
+    def test_parse_to_csv(self):
+        """ old engine keeps row shape, extras column is empty
+        """
+        self.ju.load_from_string(jstr = JSTR)
+        self.ju.parse_to_csv()
+        self.assertEqual(self.ju.parsed_tables['ex_01item'][0].split('|', 1)[1], '1|3.2|456|')
+
+    def test_old_index(self):
+        """ index compiled before extras column is compiled again
+        """
+        jmap = self.ju.map
+        index = compile_map(jmap)
+        del index["version"]
+        self.ju.map_index = index
+        self.assertIn("extrasPosition", self.ju.get_map_index())
+
+if __name__ == '__main__':
+    unittest.main()
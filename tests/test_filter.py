@@ -0,0 +1,87 @@
+"""
+Test record filter
+==================
+
+* **Program file**: test_filter.py
+* **Client**      : parse selected records only (conditions on root table, callable)
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_filter`
+"""
+import json
+import tempfile
+import unittest
+
+from jsonparse.jsonutils import JsonUtils, RecordFilter
+from jsonparse.cli import main
+
+def make_records(cnt):
+    """ sample JSON records
+    """
+    return [{"date": f"2021-07-{i % 28 + 1:02d}", "txn": {"store": i % 5, "item": [{"sku": str(j)} for j in range(i % 3)]}}
+            for i in range(cnt)]
+
+def even_store(record):
+    return record["txn"]["store"] % 2 == 0
+
+class TestFilter(unittest.TestCase):
+    def setUp(self):
+        self.ju = JsonUtils(csv_delim = '|', table_name_prefix = 'ex_')
+        self.ju.load_from_string(jstr = json.dumps(make_records(40)))
+        self.ju.compute_all_paths()
+        self.ju.table_plan_json()
+
+    def stores(self):
+        return sorted(set(r.split('|')[-1] for r in self.ju.parsed_tables['ex_00root']))
+
+    def test_conditions(self):
+        """ equality, IN and range on root table paths
+        """
+        self.ju.parse_use_pool(where = [('txn.store', '==', 3)])
+        self.assertEqual(self.stores(), ['3'])
+        self.assertEqual(len(self.ju.parsed_tables['ex_00root']), 8)
+        self.ju.parse_use_pool(where = [('txn.store', 'in', [1, 2]), ('date', '<', '2021-07-10')])
+        self.assertEqual(self.stores(), ['1', '2'])
+        self.assertEqual(len(self.ju.parsed_tables['ex_00root']), 7)
+        uuids = set(r.split('|')[0] for r in self.ju.parsed_tables['ex_00root'])
+        self.assertTrue(all(r.split('|')[0] in uuids for r in self.ju.parsed_tables['ex_01item']))
+
+    def test_callable(self):
+        """ callable for complex logic, same result with old engine
+        """
+        self.ju.parse_use_pool(record_filter = even_store)
+        pool = sorted(r.split('|', 1)[1] for r in self.ju.parsed_tables['ex_01item'])
+        self.assertEqual(self.stores(), ['0', '2', '4'])
+        self.ju.parse_to_csv(record_filter = even_store)
+        self.assertEqual(sorted(r.split('|', 1)[1] for r in self.ju.parsed_tables['ex_01item']), pool)
+
+    def test_missing_and_type(self):
+        """ missing path or not comparable value: condition is false
+        """
+        rf = RecordFilter([('txn.store', '>', 1)])
+        self.assertTrue(rf({"txn": {"store": 2}}))
+        self.assertFalse(rf({"txn": {}}))
+        self.assertFalse(rf({"txn": "x"}))
+        self.assertFalse(rf({"txn": {"store": "2"}}))
+        with self.assertRaises(ValueError):
+            RecordFilter([('txn.store', '~', 1)])
+        with self.assertRaises(ValueError):
+            self.ju.parse_use_pool(where = [('txn.item.sku', '==', '1')])
+
+    def test_cli(self):
+        """ parse sub command with --where, filtered records in statistics
+        """
+        with tempfile.TemporaryDirectory() as d:
+            self.ju.json_map_export(map_file = f"{d}/m.map")
+            with open(f"{d}/d.jsonl", 'w') as f:
+                f.write('\n'.join(json.dumps(r) for r in make_records(40)))
+            main(['parse', '--map', f"{d}/m.map", '--out-dir', f"{d}/out", '--where', 'txn.store in [0, 4]',
+                  '--stats', f"{d}/s.json", '--workers', '2', '--chunk-size', '7', f"{d}/d.jsonl"])
+            with open(f"{d}/out/ex_00root.txt", 'r') as f:
+                self.assertEqual(len(f.read().splitlines()), 16)
+            with open(f"{d}/s.json", 'r') as f:
+                self.assertEqual(json.load(f)["counters"]["filtered"], 24)
+
+if __name__ == '__main__':
+    unittest.main()
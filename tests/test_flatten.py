@@ -0,0 +1,104 @@
+"""
+Test flattened arrays
+=====================
+
+* **Program file**: test_flatten.py
+* **Client**      : arrays as positional, delimited or JSON columns of parent table instead of tables
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_flatten`
+"""
+import json
+import tempfile
+import unittest
+
+from jsonparse.jsonutils import JsonUtils
+from jsonparse.errors import MapError, UnmappedPathError
+from jsonparse.stream import table_columns
+from jsonparse.cli import main
+
+RECORDS = [
+    {"id": 1, "tags": ["a", "b"], "txn": {"item": [{"sku": "1", "amt": 2, "disc": [{"code": "X"}]}, {"sku": "2"}],
+                                          "pay": [{"type": "cash", "amt": 5}]}},
+    {"id": 2, "tags": ["c"], "txn": {"item": [{"sku": "3", "amt": 1}], "pay": [{"type": "card"}, {"type": "cash", "amt": 1}]}},
+]
+
+class TestFlatten(unittest.TestCase):
+    def setUp(self):
+        self.ju = JsonUtils(csv_delim = '|')
+        self.ju.load_from_string(jstr = json.dumps(RECORDS))
+        self.ju.compute_all_paths()
+
+    def columns(self, tbl_name):
+        tbl = [t for t in self.ju.map["tableList"] if t["tableName"] == tbl_name][0]
+        return table_columns(tbl)
+
+    def test_max_length(self):
+        """ max length of arrays found with paths
+        """
+        self.assertEqual(self.ju.array_max_length, {"tags": 2, "txn.item": 2, "txn.item.disc": 1, "txn.pay": 2})
+
+    def test_modes(self):
+        """ one table left; positional, delimited and JSON columns
+        """
+        self.ju.table_plan_json(flatten = {"tags": "positional", "txn.item": "json", "txn.pay": "delimited"})
+        self.assertEqual([t["tableName"] for t in self.ju.map["tableList"]], ["00root"])
+        self.assertEqual(self.columns("00root"), ["uuid", "id", "item", "pay_amt", "pay_type", "tags_1", "tags_2"])
+        self.ju.parse_use_pool()
+        rows = [r.split('|', 1)[1] for r in self.ju.parsed_tables["00root"]]
+        item = json.dumps(RECORDS[0]["txn"]["item"], separators = (',', ':'))
+        self.assertEqual(rows[0], f"1|{item}|5|cash|a|b")
+        self.assertTrue(rows[1].endswith("|,1|card,cash|c|"))
+        with self.assertRaises(MapError):
+            self.ju.parse_to_csv()
+
+    def test_positional_objects(self):
+        """ object elements with positions; longer array is unmapped; child table of flattened parent
+        """
+        with self.assertRaises(ValueError):
+            self.ju.table_plan_json(flatten = {"txn.item": "positional"}) # has sub array
+        self.ju.table_plan_json(flatten = {"txn.item.disc": "json", "txn.item": "positional", "txn.pay": "positional"},
+                                max_positions = 1)
+        self.assertIn("item_1_disc", self.columns("00root"))
+        self.assertNotIn("item_2_sku", self.columns("00root"))
+        with self.assertRaises(UnmappedPathError):
+            self.ju.parse_use_pool()
+        self.ju.parse_use_pool(unmapped = 'skip')
+        self.assertEqual(self.ju.unmapped_summary, {"txn.item.[2].sku": 1, "txn.pay.[2].type": 1, "txn.pay.[2].amt": 1})
+        row = dict(zip(self.columns("00root")[1:], self.ju.parsed_tables["00root"][0].split('|')[1:]))
+        self.assertEqual((row["item_1_sku"], row["item_1_amt"], row["item_1_disc"], row["pay_1_type"]),
+                         ("1", "2", '[{"code":"X"}]', "cash"))
+
+    def test_map_files_and_evolve(self):
+        """ setting is kept in CSV map; evolve skips paths in JSON arrays
+        """
+        self.ju.table_plan_json(flatten = {"txn.item": "json", "txn.pay": "delimited"})
+        with tempfile.TemporaryDirectory() as d:
+            self.ju.map_export_csv(map_csv = f"{d}/m.csv")
+            ju = JsonUtils()
+            ju.map_import_csv(map_csv = f"{d}/m.csv")
+            self.assertEqual(ju.map, self.ju.map)
+        self.ju.map_to_allpath()
+        self.assertIn("txn.pay.amt", self.ju.map_path)
+        self.assertIn("txn.item", self.ju.map_array)
+        self.ju.add_new_path_to_map(["txn.item.qty"])
+        self.assertNotIn("qty", self.columns("00root"))
+
+    def test_cli(self):
+        """ plan with --flatten, stream parse
+        """
+        with tempfile.TemporaryDirectory() as d:
+            with open(f"{d}/d.jsonl", 'w') as f:
+                f.write('\n'.join(json.dumps(r) for r in RECORDS))
+            self.assertEqual(main(['plan', '--map', f"{d}/m.map", '--flatten', 'tags=delimited', '--flatten', 'txn.pay=positional',
+                                   f"{d}/d.jsonl"]), 0)
+            self.assertEqual(main(['parse', '--map', f"{d}/m.map", '--out-dir', f"{d}/o", '--format', 'csv', '--header',
+                                   f"{d}/d.jsonl"]), 0)
+            with open(f"{d}/o/00root.csv", 'r') as f:
+                lines = f.read().splitlines()
+            self.assertEqual(lines[0], "uuid|id|pay_1_amt|pay_1_type|pay_2_amt|pay_2_type|tags")
+            self.assertTrue(lines[2].endswith("|2||card|1|cash|c"))
+
+if __name__ == '__main__':
+    unittest.main()
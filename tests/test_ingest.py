@@ -0,0 +1,141 @@
+"""
+Test file ingestion
+===================
+
+* **Program file**: test_ingest.py
+* **Client**      : folder and glob inputs, files read ahead in threads
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_ingest`
+"""
+import os
+import gzip
+import json
+import time
+import tempfile
+import threading
+import unittest
+
+from jsonparse.jsonutils import JsonUtils
+from jsonparse.ingest import expand_inputs, Prefetcher, input_size, read_input_bytes
+from jsonparse.errors import DecodeError
+from jsonparse.cli import main
+
+def make_records(day, cnt):
+    """ sample JSON records of one day
+    """
+    return [{"date": f"2021-07-{day:02d}", "txn": {"store": i, "item": [{"sku": str(j)} for j in range(i % 3)]}}
+            for i in range(cnt)]
+
+class TestIngest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        d = self.d = os.path.join(self.tmp.name, 'daily')
+        os.makedirs(d)
+        for day in range(1, 9):
+            recs = make_records(day, 5)
+            if day % 3 == 0:
+                with gzip.open(f"{d}/d{day:02d}.jsonl.gz", 'wt') as f:
+                    f.write('\n'.join(json.dumps(r) for r in recs))
+            elif day % 3 == 1:
+                with open(f"{d}/d{day:02d}.json", 'w') as f:
+                    json.dump(recs, f)
+            else:
+                with open(f"{d}/d{day:02d}.jsonl", 'w') as f:
+                    f.write('\n'.join(json.dumps(r) for r in recs))
+        with open(f"{d}/readme.txt", 'w') as f:
+            f.write('not data')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_expand(self):
+        """ folder and glob pattern give sorted data files
+        """
+        files = expand_inputs([self.d])
+        self.assertEqual([os.path.basename(fn) for fn in files][:3], ['d01.json', 'd02.jsonl', 'd03.jsonl.gz'])
+        self.assertEqual(len(files), 8)
+        self.assertEqual(expand_inputs([os.path.join(self.d, 'd0[12]*'), '-']), files[:2] + ['-'])
+
+    def test_order_and_cap(self):
+        """ files come out in order though later files load faster; cap limits files waiting
+        """
+        files = [f"{self.d}/d{day:02d}.json" for day in (1, 4, 7)] * 3
+        running = []
+        peak = [0]
+        lock = threading.Lock()
+        def load(fn):
+            with lock:
+                running.append(fn)
+                peak[0] = max(peak[0], len(running))
+            time.sleep(0.02 * (len(files) - files.index(fn)) / len(files))
+            with lock:
+                running.remove(fn)
+            return fn
+        self.assertEqual([fn for fn, content in Prefetcher(files, load, readahead = 4)], files)
+        self.assertGreater(peak[0], 1)
+        size = os.path.getsize(files[0])
+        peak[0] = 0
+        self.assertEqual([fn for fn, content in Prefetcher(files, load, readahead = 4, max_bytes = size)], files)
+        self.assertEqual(peak[0], 1)
+
+    def test_cap_gz(self):
+        """ cap counts decompressed size of '.gz' files, not size on disk
+        """
+        files = []
+        for i in range(4):
+            files.append(f"{self.d}/big{i}.jsonl.gz")
+            with gzip.open(files[-1], 'wt') as f:
+                f.write('\n'.join(json.dumps(r) for r in make_records(1, 2000)))
+        disk = os.path.getsize(files[0])
+        data = len(read_input_bytes(files[0]))
+        self.assertGreater(data, 10 * disk)
+        self.assertEqual(input_size(files[0]), data)
+        running = []
+        peak = [0]
+        lock = threading.Lock()
+        def load(fn):
+            with lock:
+                running.append(fn)
+                peak[0] = max(peak[0], len(running))
+            time.sleep(0.02)
+            content = read_input_bytes(fn)
+            with lock:
+                running.remove(fn)
+            return content
+        fetched = [(fn, len(content)) for fn, content in Prefetcher(files, load, readahead = 4, max_bytes = 4 * disk)]
+        self.assertEqual(fetched, [(fn, data) for fn in files])
+        self.assertEqual(peak[0], 1)
+        peak[0] = 0
+        self.assertEqual(len(list(Prefetcher(files, load, readahead = 4, max_bytes = 4 * data))), 4)
+        self.assertGreater(peak[0], 1)
+
+    def test_load_from_files(self):
+        """ same records as reading files one by one
+        """
+        ju = JsonUtils()
+        ju.load_from_files([self.d], readahead = 3)
+        self.assertEqual(ju.json_data, [r for day in range(1, 9) for r in make_records(day, 5)])
+        with open(f"{self.d}/d09.json", 'w') as f:
+            f.write('[{"a": ')
+        with self.assertRaises(DecodeError):
+            ju.load_from_files([self.d])
+
+    def test_cli(self):
+        """ parse folder with and without read ahead, same output
+        """
+        d = self.tmp.name
+        main(['plan', '--map', f"{d}/m.map", '--readahead', '2', self.d])
+        seed = '0b6c54a4-8e5d-4a4e-9a57-2b0d1d0b5a11'
+        main(['parse', '--map', f"{d}/m.map", '--out-dir', f"{d}/a", '--txn-seed', seed, self.d])
+        main(['parse', '--map', f"{d}/m.map", '--out-dir', f"{d}/b", '--txn-seed', seed, '--readahead', '3',
+              '--readahead-mb', '1', '--workers', '2', '--chunk-size', '3', self.d])
+        for fn in os.listdir(f"{d}/a"):
+            with open(f"{d}/a/{fn}", 'r') as fa, open(f"{d}/b/{fn}", 'r') as fb:
+                self.assertEqual(fa.read(), fb.read())
+        with open(f"{d}/a/00root.txt", 'r') as f:
+            self.assertEqual(len(f.read().splitlines()), 40)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+Test binary map format
+======================
+
+* **Program file**: test_mapbin.py
+* **Client**      : compact binary map, round trip with JSON and CSV format
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_mapbin`
+"""
+import os
+import tempfile
+import unittest
+
+from jsonparse.jsonutils import JsonUtils
+from jsonparse.errors import MapError
+
+JSTR = """
+[{"date": "2021-07-10", "txn": {"store": 123, "item": [{"sku":"456", "amt": 3.20, "disc": [{"code": "A"}]}, {"sku": "789"}]}}]
+"""
+
+class TestMapBin(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.ju = JsonUtils(csv_delim='|', table_name_prefix='ex_')
+        self.ju.load_from_string(jstr = JSTR)
+        self.ju.compute_all_paths()
+        self.ju.table_plan_json()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self, fn):
+        with open(fn, 'r') as f:
+            return f.read()
+
+    def test_round_trip(self):
+        """ JSON map -> binary map -> JSON/CSV map are same
+        """
+        d = self.tmp.name
+        self.ju.json_map_export(map_file = f"{d}/a.map")
+        self.ju.map_export_csv(map_csv = f"{d}/a.csv")
+        self.ju.map_export_bin(map_bin = f"{d}/a.bin")
+
+        ju = JsonUtils(csv_delim='|', table_name_prefix='ex_')
+        ju.map_import_bin(map_bin = f"{d}/a.bin")
+        self.assertEqual(ju.map, self.ju.map)
+        self.assertIsNotNone(ju.map_index)
+        ju.json_map_export(map_file = f"{d}/b.map")
+        ju.map_export_csv(map_csv = f"{d}/b.csv")
+        self.assertEqual(self.read(f"{d}/a.map"), self.read(f"{d}/b.map"))
+        self.assertEqual(self.read(f"{d}/a.csv"), self.read(f"{d}/b.csv"))
+
+        ju.map_import_csv(map_csv = f"{d}/a.csv")
+        ju.map_export_bin(map_bin = f"{d}/c.bin")
+        ju.map_import_bin(map_bin = f"{d}/c.bin")
+        self.assertEqual(ju.map, self.ju.map)
+
+    def test_parse_with_bin_map(self):
+        """ parse using map loaded from binary map file
+        """
+        d = self.tmp.name
+        self.ju.map_export_bin(map_bin = f"{d}/a.bin")
+        ju = JsonUtils(csv_delim='|', table_name_prefix='ex_')
+        ju.load_from_string(jstr = JSTR)
+        ju.map_import_bin(map_bin = f"{d}/a.bin")
+        ju.parse_use_pool()
+        self.ju.parse_use_pool()
+        strip = lambda tbls: {k: [r.split('|', 1)[1] for r in v] for k, v in tbls.items()}
+        self.assertEqual(strip(ju.parsed_tables), strip(self.ju.parsed_tables))
+
+    def test_bad_file(self):
+        """ not binary map file
+        """
+        fn = os.path.join(self.tmp.name, 'bad.bin')
+        with open(fn, 'wb') as f:
+            f.write(b'not a map')
+        with self.assertRaises(MapError):
+            self.ju.map_import_bin(map_bin = fn)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Test map cache
+==============
+
+* **Program file**: test_mapcache.py
+* **Client**      : map cache keyed by schema fingerprint
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_mapcache`
+"""
+import os
+import json
+import tempfile
+import unittest
+
+from jsonparse.jsonutils import JsonUtils
+from jsonparse.mapcache import MapCache, schema_fingerprint
+
+JSTR = """
+[{"date": "2021-07-10", "txn": {"store": 123, "item": [{"sku":"456", "amt": 3.20}, {"sku": "789"}]}}]
+"""
+JSTR_NEW = """
+[{"date": "2021-07-11", "clerk": "Amy", "txn": {"store": 123, "item": [{"sku":"456", "amt": 3.20, "qty": 2}]}}]
+"""
+
+class TestMapCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_fingerprint_order(self):
+        """ fingerprint does not depend on path order
+        """
+        fp1 = schema_fingerprint(['a', 'b.c'], ['b'])
+        fp2 = schema_fingerprint(['b.c', 'a'], ['b'])
+        self.assertEqual(fp1, fp2)
+        self.assertNotEqual(fp1, schema_fingerprint(['a', 'b.c'], []))
+
+    def test_cache_hit_keeps_user_edit(self):
+        """ second job with same schema uses (edited) cached map
+        """
+        ju = JsonUtils(table_name_prefix='ex_')
+        ju.load_from_string(jstr = JSTR)
+        fp = ju.plan_with_cache(map_cache = MapCache(self.cache_dir))
+        with open(os.path.join(self.cache_dir, f"{fp}.map"), 'r') as f:
+            jmap = json.load(f)
+        jmap["tableList"][0]["tableName"] = "ex_item_renamed"
+        with open(os.path.join(self.cache_dir, f"{fp}.map"), 'w') as f:
+            json.dump(jmap, f)
+
+        ju2 = JsonUtils(table_name_prefix='ex_')
+        ju2.load_from_string(jstr = JSTR)
+        self.assertEqual(ju2.plan_with_cache(map_cache = MapCache(self.cache_dir)), fp)
+        self.assertEqual(ju2.map["tableList"][0]["tableName"], "ex_item_renamed")
+
+    def test_cache_superset(self):
+        """ new paths are added to cached map instead of re-plan
+        """
+        ju = JsonUtils(table_name_prefix='ex_')
+        ju.load_from_string(jstr = JSTR)
+        ju.plan_with_cache(map_cache = MapCache(self.cache_dir))
+        ju.map["tableList"][0]["tableName"] = "ex_item_renamed"
+
+        ju2 = JsonUtils(table_name_prefix='ex_')
+        ju2.load_from_string(jstr = JSTR_NEW)
+        cache = MapCache(self.cache_dir)
+        fp = ju2.plan_with_cache(map_cache = cache)
+        self.assertEqual(len(cache.index["entries"]), 2)
+        ju2.map_to_allpath()
+        self.assertIn('txn.item.qty', ju2.map_path)
+        self.assertIn('clerk', ju2.map_path)
+        self.assertIsNotNone(cache.get(fp))
+
+    def test_lru_eviction(self):
+        """ least recently used map is removed
+        """
+        cache = MapCache(self.cache_dir, max_entries = 2)
+        jmap = {"tableNumber": 0, "tableList": []}
+        cache.put('a', jmap, ['x'], [])
+        cache.put('b', jmap, ['y'], [])
+        cache.get('a')
+        cache.put('c', jmap, ['z'], [])
+        self.assertEqual(sorted(cache.index["entries"]), ['a', 'c'])
+        self.assertFalse(os.path.exists(cache.map_file('b')))
+
+    def test_shared_folder(self):
+        """ jobs sharing cache folder keep entries of each other; index has size and time only, counted in size
+        """
+        import multiprocessing
+        jmap = {"tableNumber": 0, "tableList": []}
+        def job(n):
+            cache = MapCache(self.cache_dir)
+            for i in range(15):
+                cache.put(f"j{n}m{i}", jmap, [f"p{k}" for k in range(50)], [])
+        procs = [multiprocessing.get_context('fork').Process(target = job, args = (n,)) for n in range(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        cache = MapCache(self.cache_dir)
+        entries = cache.index["entries"]
+        self.assertEqual(len(entries), 60)
+        self.assertEqual(set(k for e in entries.values() for k in e), {"size", "mtime"})
+        self.assertEqual(cache.get_paths("j3m14")[0][:2], ["p0", "p1"])
+        files = sum(os.path.getsize(os.path.join(self.cache_dir, fn)) for fn in os.listdir(self.cache_dir))
+        self.assertEqual(cache.total_bytes(), files)
+        cache.max_bytes = files - os.path.getsize(os.path.join(self.cache_dir, "index.json")) # index counted
+        cache.evict()
+        self.assertLess(len(cache.index["entries"]), 60)
+        self.assertLessEqual(cache.total_bytes(), cache.max_bytes)
+
+    def test_old_index(self):
+        """ paths in index of older version move to their own file
+        """
+        with open(os.path.join(self.cache_dir, "a.map"), 'w') as f:
+            f.write("{}")
+        with open(os.path.join(self.cache_dir, "index.json"), 'w') as f:
+            json.dump({"tick": 1, "entries": {"a": {"paths": ["x"], "arrays": [], "size": 2, "created": 1.0,
+                                                    "lastUsed": 1}}}, f)
+        cache = MapCache(self.cache_dir)
+        self.assertEqual(cache.get_paths("a"), (["x"], []))
+        self.assertEqual(cache.get("a"), {})
+        self.assertEqual(cache.find_subset(["x", "y"], []), "a")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+"""
+Test package entry
+==================
+
+* **Program file**: test_package.py
+* **Client**      : light package import, names imported at first use
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_package`
+"""
+import os
+import sys
+import subprocess
+import unittest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+def modules_after(code):
+    """ run code in new process, return imported module names
+    """
+    code = f"{code}\nimport sys\nprint(' '.join(sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], cwd = ROOT, check = True,
+                         stdout = subprocess.PIPE, universal_newlines = True).stdout
+    return set(out.split())
+
+class TestPackage(unittest.TestCase):
+    def test_light_import(self):
+        """ import jsonparse does not import jsonutils or logzero
+        """
+        mods = modules_after("import jsonparse")
+        self.assertNotIn("jsonparse.jsonutils", mods)
+        self.assertNotIn("logzero", mods)
+
+    def test_lazy_name(self):
+        """ JsonUtils is imported at first use, logzero at first log
+        """
+        mods = modules_after("from jsonparse import JsonUtils\nju = JsonUtils()\nju.load_from_string(jstr='[]')")
+        self.assertIn("jsonparse.jsonutils", mods)
+        self.assertNotIn("logzero", mods)
+        import jsonparse
+        self.assertIs(jsonparse.JsonUtils, __import__("jsonparse.jsonutils").jsonutils.JsonUtils)
+        with self.assertRaises(AttributeError):
+            jsonparse.no_such_name
+
+if __name__ == '__main__':
+    unittest.main()
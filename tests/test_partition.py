@@ -0,0 +1,98 @@
+"""
+Test partitioned output
+=======================
+
+* **Program file**: test_partition.py
+* **Client**      : rows of all tables go to partition of root record, files rotate, open files capped
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_partition`
+"""
+import os
+import json
+import tempfile
+import unittest
+
+from jsonparse.jsonutils import JsonUtils
+from jsonparse.stream import PartitionedWriter
+from jsonparse.cli import main
+
+def make_records(cnt):
+    """ sample JSON records over 4 days
+    """
+    return [{"date": f"2021-07-{i % 4 + 1:02d}", "txn": {"store": i, "item": [{"sku": str(j)} for j in range(i % 3)]}}
+            for i in range(cnt)]
+
+def read_tree(d):
+    """ relative file path -> lines
+    """
+    out = dict()
+    for root, dirs, files in os.walk(d):
+        for fn in files:
+            with open(os.path.join(root, fn), 'r') as f:
+                out[os.path.relpath(os.path.join(root, fn), d)] = f.read().splitlines()
+    return out
+
+class TestPartition(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.d = self.tmp.name
+        self.ju = JsonUtils(csv_delim = '|')
+        self.ju.load_from_string(jstr = json.dumps(make_records(40)))
+        self.ju.compute_all_paths()
+        self.ju.table_plan_json()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_child_rows_follow_root(self):
+        """ child table rows are in partition of their root record
+        """
+        self.ju.write_partitioned(out_dir = f"{self.d}/p", partition_by = 'date')
+        tree = read_tree(f"{self.d}/p")
+        self.assertIn(os.path.join('00root', 'date=2021-07-01', 'part-00000.txt'), tree)
+        for day in range(1, 5):
+            part = f"date=2021-07-{day:02d}"
+            roots = tree[os.path.join('00root', part, 'part-00000.txt')]
+            uuids = set(r.split('|')[0] for r in roots)
+            self.assertTrue(all(r.split('|')[1] == f"2021-07-{day:02d}" for r in roots))
+            self.assertEqual(len(roots), 10)
+            items = tree.get(os.path.join('01item', part, 'part-00000.txt'), [])
+            self.assertTrue(all(r.split('|')[0] in uuids for r in items))
+        self.assertEqual(sum(len(v) for k, v in tree.items() if k.startswith('01item')), 39)
+
+    def test_rotation_and_lru(self):
+        """ small files rotate; few open files
+        """
+        self.ju.write_partitioned(out_dir = f"{self.d}/p", partition_by = 'date', max_file_bytes = 200,
+                                  max_open_files = 2, chunk_size = 3)
+        tree = read_tree(f"{self.d}/p")
+        parts = [k for k in tree if k.startswith(os.path.join('00root', 'date=2021-07-01'))]
+        self.assertGreater(len(parts), 1)
+        self.assertEqual(sum(len(v) for k, v in tree.items() if k.startswith('00root')), 40)
+        writer = PartitionedWriter(f"{self.d}/q", self.ju.map, max_open_files = 2)
+        writer.write({(0, 'a'): ['x'], (1, 'a'): ['y'], (1, 'b'): ['z'], (0, 'a'): ['w']})
+        self.assertLessEqual(len(writer.files), 2)
+        writer.close()
+
+    def test_cli_checkpoint(self):
+        """ parse sub command with partition, resumed run gives same files
+        """
+        d = self.d
+        self.ju.json_map_export(map_file = f"{d}/m.map")
+        with open(f"{d}/d.jsonl", 'w') as f:
+            f.write('\n'.join(json.dumps(r) for r in make_records(40)))
+        seed = '0b6c54a4-8e5d-4a4e-9a57-2b0d1d0b5a11'
+        args = ['parse', '--map', f"{d}/m.map", '--partition-by', 'date', '--format', 'csv', '--header',
+                '--txn-seed', seed, '--chunk-size', '5', '--max-file-mb', '1']
+        main(args + ['--out-dir', f"{d}/a", f"{d}/d.jsonl"])
+        main(args + ['--out-dir', f"{d}/b", '--checkpoint', f"{d}/c.json", '--checkpoint-every', '3', f"{d}/d.jsonl"])
+        main(args + ['--out-dir', f"{d}/b", '--checkpoint', f"{d}/c.json", f"{d}/d.jsonl"])
+        self.assertEqual(read_tree(f"{d}/a"), read_tree(f"{d}/b"))
+        lines = read_tree(f"{d}/a")[os.path.join('00root', 'date=2021-07-02', 'part-00000.csv')]
+        self.assertEqual(lines[0], 'uuid|date|store')
+        self.assertEqual(len(lines), 11)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+Test projection
+===============
+
+* **Program file**: test_projection.py
+* **Client**      : parse selected tables and columns only
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_projection`
+"""
+import json
+import tempfile
+import unittest
+
+from jsonparse.jsonutils import JsonUtils, RecordParser, project_map, project_map_index
+from jsonparse.cli import main
+
+def make_records(cnt):
+    """ sample JSON records: item (with disc) and pay arrays
+    """
+    rec_list = []
+    for i in range(cnt):
+        rec = {"date": "2021-07-10", "store": i % 5, "txn": {"id": i}}
+        rec["txn"]["item"] = [{"sku": str(j), "amt": j, "disc": [{"code": f"A{k}"} for k in range(j % 3)]} for j in range(i % 4)]
+        rec["pay"] = [{"type": "cash", "amt": i}]
+        rec_list.append(rec)
+    return rec_list
+
+class TestProjection(unittest.TestCase):
+    def setUp(self):
+        self.ju = JsonUtils(csv_delim = '|')
+        self.ju.load_from_string(jstr = json.dumps(make_records(30)))
+        self.ju.compute_all_paths()
+        self.ju.table_plan_json()
+        self.tables = {t["tableName"]: t for t in self.ju.map["tableList"]}
+
+    def full_parse(self):
+        self.ju.parse_use_pool()
+        return {k: [r.split('|', 1)[1] for r in v] for k, v in self.ju.parsed_tables.items()}
+
+    def test_tables(self):
+        """ selected tables only, same rows as full parse
+        """
+        full = self.full_parse()
+        disc = [nm for nm in self.tables if nm.endswith('disc')][0]
+        pay = [nm for nm in self.tables if nm.endswith('pay')][0]
+        self.ju.parse_use_pool(tables = [disc, pay])
+        self.assertEqual(sorted(self.ju.parsed_tables), sorted([disc, pay]))
+        for nm in [disc, pay]:
+            self.assertEqual([r.split('|', 1)[1] for r in self.ju.parsed_tables[nm]], full[nm])
+
+    def test_columns(self):
+        """ selected columns only, same as old engine
+        """
+        root = [nm for nm in self.tables if nm.endswith('root')][0]
+        self.ju.parse_use_pool(columns = {root: ['store']})
+        self.assertEqual(len(self.ju.parsed_tables), 4) # other tables keep all columns
+        self.ju.parse_use_pool(tables = [root], columns = {root: ['store']})
+        self.assertEqual(list(self.ju.parsed_tables), [root])
+        pool = [r.split('|', 1)[1] for r in self.ju.parsed_tables[root]]
+        self.assertEqual(pool[:3], ['0', '1', '2'])
+        self.ju.parse_to_csv(tables = [root], columns = {root: ['store']})
+        self.assertEqual([r.split('|', 1)[1] for r in self.ju.parsed_tables[root]], pool)
+        self.assertEqual([c["columnName"] for c in project_map(self.ju.map, tables = [root], columns = {root: ['store']})["tableList"][0]["columnList"]],
+                         ['store'])
+
+    def test_skip_subtree(self):
+        """ arrays which lead only to tables not selected are not visited
+        """
+        pay = [nm for nm in self.tables if nm.endswith('pay')][0]
+        full = RecordParser(self.ju.map)
+        proj = RecordParser(self.ju.map, project_map_index(self.ju.map, tables = [pay]))
+        for rec in make_records(30):
+            full.parse_record(rec, 'x')
+            proj.parse_record(rec, 'x')
+        self.assertLess(proj.scalar_count, full.scalar_count / 2)
+
+    def test_unknown_name(self):
+        """ unknown table or column is error
+        """
+        with self.assertRaises(ValueError):
+            self.ju.parse_use_pool(tables = ['nothing'])
+        with self.assertRaises(ValueError):
+            project_map(self.ju.map, columns = {list(self.tables)[0]: ['nothing']})
+
+    def test_cli(self):
+        """ parse sub command with --table and --columns
+        """
+        root = [nm for nm in self.tables if nm.endswith('root')][0]
+        pay = [nm for nm in self.tables if nm.endswith('pay')][0]
+        with tempfile.TemporaryDirectory() as d:
+            self.ju.json_map_export(map_file = f"{d}/m.map")
+            with open(f"{d}/d.jsonl", 'w') as f:
+                f.write('\n'.join(json.dumps(r) for r in make_records(30)))
+            main(['parse', '--map', f"{d}/m.map", '--out-dir', f"{d}/out", '--format', 'csv', '--header',
+                  '--table', pay, '--columns', f"{root}:store,date", '--workers', '2', f"{d}/d.jsonl"])
+            with open(f"{d}/out/{root}.csv", 'r') as f:
+                lines = f.read().splitlines()
+            self.assertEqual(lines[0], 'uuid|date|store')
+            self.assertEqual(len(lines), 31)
+
+if __name__ == '__main__':
+    unittest.main()
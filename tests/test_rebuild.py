@@ -0,0 +1,143 @@
+"""
+Test reverse parse
+==================
+
+* **Program file**: test_rebuild.py
+* **Client**      : nested JSON records rebuilt from parsed tables are same as input, and parse to same rows
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_rebuild`
+"""
+import io
+import csv
+import json
+import unittest
+
+from jsonparse.jsonutils import JsonUtils, RecordParser
+from jsonparse.rebuild import RecordBuilder, rebuild_records, cell_value
+from jsonparse.stream import table_columns
+
+def make_record(i):
+    """ record with two array levels, object in array, booleans and floats
+    """
+    rec = {"date": f"2021-07-{i % 28 + 1:02d}", "store": i % 5, "txn": {"id": i, "tot": i * 1.5}}
+    if i % 3:
+        rec["txn"]["item"] = [{"sku": f"s{j}", "amt": j * 0.5} for j in range(1, i % 4 + 2)]
+        for j, item in enumerate(rec["txn"]["item"], start = 1):
+            if j % 3:
+                item["disc"] = [{"code": f"A{k}", "v": k} for k in range(1, j % 3 + 1)]
+    if i % 4 == 1:
+        rec["pay"] = [{"type": "cash", "det": {"a": 1, "ok": True}}]
+    if i % 7 == 0:
+        rec["flag"] = False
+    return rec
+
+RECORDS = [make_record(i) for i in range(60)]
+
+def sorted_rows(parsed_tables):
+    return {nm: sorted(rows) for nm, rows in parsed_tables.items()}
+
+class TestRebuild(unittest.TestCase):
+    def setUp(self):
+        self.ju = JsonUtils(csv_delim = '|')
+        self.ju.load_from_string(jstr = json.dumps(RECORDS))
+        self.ju.compute_all_paths()
+
+    def reparse(self, rebuilt, unmapped='fail'):
+        """ parse rebuilt records again with their txn ids
+        """
+        parser = RecordParser(self.ju.map, self.ju.get_map_index(), unmapped = unmapped)
+        names = [tbl["tableName"] for tbl in self.ju.map["tableList"]] + [self.ju.overflow_table_name()]
+        tables = {nm: [] for nm in self.ju.parsed_tables}
+        for txn, rec in rebuilt.items():
+            for (tblIdx, row) in parser.parse_record(rec, txn):
+                tables[names[tblIdx]].append('|'.join(row))
+        return sorted_rows(tables)
+
+    def test_same_records(self):
+        """ records come back as input (no values lost by parsing in this data)
+        """
+        self.ju.table_plan_json()
+        self.ju.parse_use_pool()
+        rebuilt = self.ju.rebuild_json()
+        self.assertEqual(len(rebuilt), len(RECORDS))
+        self.assertEqual(list(rebuilt), sorted(rebuilt))
+        by_id = {rec["txn"]["id"]: rec for rec in rebuilt.values()}
+        self.assertEqual([by_id[i] for i in range(len(RECORDS))], RECORDS)
+        self.assertEqual(self.reparse(rebuilt), sorted_rows(self.ju.parsed_tables))
+
+    def test_flatten_extras_overflow(self):
+        """ flattened arrays, extras column and overflow table give same rows again
+        """
+        self.ju.table_plan_json(flatten = {"txn.item.disc": "json", "txn.item": "positional", "pay": "delimited"})
+        self.ju.add_extras_column(table_names = ["00root"])
+        for tbl in self.ju.map["tableList"]:
+            tbl["columnList"] = [clm for clm in tbl["columnList"] if clm["relativePath"] not in ("flag", "txn.tot")]
+        self.ju.map_index = None
+        self.ju.parse_use_pool()
+        rebuilt = self.ju.rebuild_json()
+        by_id = {rec["txn"]["id"]: rec for rec in rebuilt.values()}
+        self.assertEqual(by_id[2]["txn"]["item"], RECORDS[2]["txn"]["item"])
+        self.assertEqual(by_id[7], RECORDS[7])
+        self.assertEqual(self.reparse(rebuilt), sorted_rows(self.ju.parsed_tables))
+
+    def test_overflow_and_split(self):
+        """ unmapped values from overflow table; tables split by columns
+        """
+        self.ju.table_plan_json()
+        self.ju.split_wide_tables(max_columns = 4)
+        for tbl in self.ju.map["tableList"]:
+            tbl["columnList"] = [clm for clm in tbl["columnList"] if clm["relativePath"] != "txn.tot"]
+        self.ju.map_index = None
+        self.ju.parse_use_pool(unmapped = 'overflow')
+        self.assertGreater(len(self.ju.parsed_tables[self.ju.overflow_table_name()]), 0)
+        rebuilt = self.ju.rebuild_json()
+        by_id = {rec["txn"]["id"]: rec for rec in rebuilt.values()}
+        self.assertEqual([by_id[i] for i in range(len(RECORDS))], RECORDS)
+
+    def test_streams(self):
+        """ rows as csv reader lists and jsonl dictionaries; streams must be sorted by uuid
+        """
+        self.ju.table_plan_json()
+        self.ju.parse_use_pool()
+        streams = dict()
+        for idx, tbl in enumerate(self.ju.map["tableList"]):
+            nm = tbl["tableName"]
+            rows = self.ju.parsed_tables[nm]
+            rows = sorted(rows, key = lambda r: r.split('|', 1)[0])
+            if idx % 2 == 0:
+                buff = io.StringIO('\n'.join(rows))
+                streams[nm] = csv.reader(buff, delimiter = '|')
+            else:
+                streams[nm] = [dict(zip(table_columns(tbl), r.split('|'))) for r in rows]
+        rebuilt = dict(rebuild_records(self.ju.map, streams))
+        self.assertEqual(rebuilt, self.ju.rebuild_json())
+        # left out table: its values are not in records
+        streams = {"00root": sorted(self.ju.parsed_tables["00root"])}
+        rec = next(rebuild_records(self.ju.map, streams, csv_delim = '|'))[1]
+        self.assertNotIn("item", rec["txn"])
+        unsorted = {"00root": sorted(self.ju.parsed_tables["00root"], reverse = True)}
+        with self.assertRaises(ValueError):
+            list(rebuild_records(self.ju.map, unsorted, csv_delim = '|'))
+        with self.assertRaises(ValueError):
+            list(rebuild_records(self.ju.map, {"nosuch": []}))
+
+    def test_value_type(self):
+        """ values from text
+        """
+        self.assertEqual([cell_value(t) for t in ["12", "-3", "1.5", "1e-05", "True", "007", "1.50", "s1"]],
+                         [12, -3, 1.5, 1e-05, True, "007", "1.50", "s1"])
+        self.assertEqual(cell_value("12", 'text'), "12")
+        self.ju.table_plan_json()
+        self.ju.parse_use_pool()
+        builder = RecordBuilder(self.ju.map, csv_delim = '|', value_type = 'text')
+        rows = sorted(self.ju.parsed_tables["00root"])[:1]
+        (txn, rec) = next(builder.rebuild({"00root": rows}))
+        self.assertIsInstance(rec["store"], str)
+        self.assertEqual(builder.record_count, 1)
+        with self.assertRaises(ValueError):
+            RecordBuilder(self.ju.map, value_type = 'float')
+
+if __name__ == '__main__':
+    unittest.main()
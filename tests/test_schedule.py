@@ -0,0 +1,125 @@
+"""
+Test chunk sizing and scheduling
+================================
+
+* **Program file**: test_schedule.py
+* **Client**      : chunks cut by bytes or rows, a huge record does not block the others, chunk timing histogram
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_schedule`
+"""
+import json
+import collections
+import time
+import unittest
+
+from jsonparse.jsonutils import JsonUtils, RecordParser
+from jsonparse.stats import ParseStats, HISTOGRAM_BUCKETS
+from jsonparse.stream import ChunkParser, parse_chunks, iter_chunks, sized_chunks, line_weight
+
+SEED = '6f1f5a5e-3c2b-4b7e-9a59-1d1f0c5a7b21'
+
+def make_record(i, items=2):
+    return {"id": i, "item": [{"sku": f"s{k}", "lot": [{"n": n} for n in range(2)]} for k in range(items)]}
+
+class TestSchedule(unittest.TestCase):
+    def setUp(self):
+        self.records = [make_record(i, 5000 if i == 3 else 2) for i in range(40)]
+        self.lines = [json.dumps(r) for r in self.records]
+        ju = JsonUtils(csv_delim = '|')
+        ju.load_from_list(jsonlist = self.lines[:5])
+        ju.compute_all_paths()
+        ju.table_plan_json()
+        self.map = ju.map
+
+    def test_sized_chunks(self):
+        """ cut by records, bytes or estimated rows; (line, position) elements
+        """
+        sizes = [len(c) for c in sized_chunks(self.lines, 10)]
+        self.assertEqual(sizes, [10, 10, 10, 10])
+        chunks = list(sized_chunks(self.lines, 10, chunk_bytes = 500))
+        self.assertEqual([len(c) for c in chunks], [4, 5, 5, 5, 5, 5, 5, 5, 1]) # cut after huge record
+        self.assertEqual(sum(chunks, []), self.lines)
+        self.assertEqual(line_weight('{"a": [{"b": 1}, {"b": 2}]}', 'rows'), 3)
+        chunks = list(sized_chunks([(line, i) for i, line in enumerate(self.lines)], 10, chunk_rows = 30))
+        self.assertTrue(all(sum(line_weight(line, 'rows') for (line, pos) in c[:-1]) < 30 for c in chunks))
+        self.assertEqual([pos for c in chunks for (line, pos) in c], list(range(40)))
+        self.assertEqual([len(c) for c in iter_chunks(range(7), 3, 4, lambda e: e)], [3, 2, 1, 1])
+
+    def test_huge_record(self):
+        """ rows of an array with thousands of elements are found in linear time
+        """
+        parser = RecordParser(self.map)
+        start = time.perf_counter()
+        parsed = parser.parse_record(make_record(1, 20000), "t1")
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertEqual(sorted(collections.Counter(tblIdx for (tblIdx, row) in parsed).values()), [1, 20000, 40000])
+
+    def test_histogram(self):
+        """ seconds of each chunk in histogram, merged and exported
+        """
+        stats = ParseStats()
+        chunk_parser = ChunkParser(self.map, csv_delim = '|', txn_seed = SEED, stats = stats)
+        for parsed in parse_chunks(sized_chunks(self.lines, 10, chunk_bytes = 500), chunk_parser):
+            pass
+        (counts, total, top) = stats.histograms["chunk_seconds"]
+        self.assertEqual(len(counts), len(HISTOGRAM_BUCKETS) + 1)
+        self.assertEqual(sum(counts), 9)
+        other = ParseStats()
+        other.observe('chunk_seconds', 100)
+        stats.merge(other)
+        hist = stats.as_dict()["histograms"]["chunk_seconds"]
+        self.assertEqual((hist["count"], hist["buckets"]["inf"]), (10, 1))
+        self.assertEqual(hist["max"], 100)
+        prom = stats.to_prometheus()
+        self.assertIn('_chunk_seconds_bucket{le="+Inf"} 10', prom)
+        self.assertIn('_chunk_seconds_count 10', prom)
+
+    def test_workers_in_order(self):
+        """ results of workers in order of chunks, slow chunk does not change them; worker histograms merged
+        """
+        chunk_parser = ChunkParser(self.map, csv_delim = '|', txn_seed = SEED)
+        chunks = list(sized_chunks(self.lines, 4, chunk_bytes = 500))
+        expected = list(parse_chunks(chunks, chunk_parser))
+        chunk_parser.stats = ParseStats()
+        result = list(parse_chunks(chunks, chunk_parser, workers = 3, window = 2, max_pending = 3))
+        self.assertEqual(result, expected)
+        self.assertEqual(sum(chunk_parser.stats.histograms["chunk_seconds"][0]), len(chunks))
+
+    def test_spawned_workers(self):
+        """ spawned workers give same rows as this process
+        """
+        chunk_parser = ChunkParser(self.map, csv_delim = '|', txn_seed = SEED)
+        chunks = list(iter_chunks(self.lines[:12], 4))
+        expected = list(parse_chunks(chunks, chunk_parser))
+        self.assertEqual(list(parse_chunks(chunks, chunk_parser, workers = 2, start_method = 'spawn')), expected)
+
+    def test_inherited_map(self):
+        """ default workers inherit parser with map (not pickled), each is ready sooner than spawned one
+        """
+        import pickle
+        from jsonparse.stream import WorkerPool, worker_context
+        if worker_context().get_start_method() != 'fork':
+            self.skipTest("fork can not be used on this platform")
+        ju = JsonUtils(csv_delim = '|')
+        ju.load_from_list(jsonlist = [json.dumps(dict({f"f{j:05d}": j for j in range(2000)}, item = [{"sku": "s"}]))])
+        ju.compute_all_paths()
+        ju.table_plan_json()
+        line = json.dumps({"f00000": 1, "item": [{"sku": "t"}]})
+        chunk_parser = ChunkParser(ju.map, ju.get_map_index(), csv_delim = '|', txn_seed = SEED)
+        chunk_parser.record_filter = lambda js: "f00000" in js # can not be pickled
+        with self.assertRaises(Exception):
+            pickle.dumps(chunk_parser)
+        def ready_seconds(start_method):
+            start = time.perf_counter()
+            with WorkerPool(chunk_parser, 2, start_method) as pool:
+                parsed = list(pool.parse([[line]] * 2, window = 2))
+            return (time.perf_counter() - start, parsed)
+        (seconds, parsed) = ready_seconds(None)
+        self.assertEqual(parsed, [chunk_parser([line], i) for i in range(2)])
+        chunk_parser.record_filter = None
+        self.assertLess(seconds, ready_seconds('spawn')[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,245 @@
+"""
+Test parse service
+==================
+
+* **Program file**: test_service.py
+* **Client**      : long running service keeps maps, worker pools and database connections between batches
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_service`
+"""
+import io
+import os
+import json
+import socket
+import tempfile
+import threading
+import unittest
+
+from jsonparse.cli import main
+from jsonparse.jsonutils import JsonUtils
+from jsonparse.service import ParseService
+from jsonparse.stream import ChunkParser, parse_chunks, iter_chunks
+
+def make_records(cnt, kind='txn'):
+    return [{kind: {"store": i, "item": [{"sku": f"s{j}"} for j in range(i % 3)]}} for i in range(cnt)]
+
+class FakeConnection(object):
+    """ DB-API connection which keeps COPY statements and data
+    """
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.copies = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+        self.fail = False
+
+    def cursor(self):
+        conn = self
+        class Cursor(object):
+            def __enter__(self):
+                return self
+            def __exit__(self, *exc):
+                pass
+            def copy_expert(self, sql, f):
+                if conn.fail:
+                    raise OSError("connection lost")
+                conn.copies.append((sql, f.read()))
+        return Cursor()
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+class TestService(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.maps = dict()
+        for kind in ('txn', 'order', 'refund'):
+            ju = JsonUtils(csv_delim = '|', table_name_prefix = f"{kind}_")
+            ju.load_from_string(jstr = json.dumps(make_records(5, kind)))
+            ju.compute_all_paths()
+            ju.table_plan_json()
+            self.maps[kind] = os.path.join(self.tmp.name, f"{kind}.map")
+            ju.json_map_export(map_file = self.maps[kind])
+        self.connections = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def connect(self, dsn):
+        self.connections.append(FakeConnection(dsn))
+        return self.connections[-1]
+
+    def expected(self, kind, records):
+        ju = JsonUtils(csv_delim = '|')
+        ju.json_map_import(map_file = self.maps[kind])
+        chunk_parser = ChunkParser(ju.map, csv_delim = '|')
+        out = dict()
+        for parsed in parse_chunks(iter_chunks([json.dumps(r) for r in records], 4), chunk_parser):
+            for tblIdx, rows in parsed.items():
+                out.setdefault(chunk_parser.table_names[tblIdx], []).extend(r.split('|', 1)[1] for r in rows)
+        return {nm: sorted(rows) for nm, rows in out.items() if len(rows) > 0}
+
+    def tables(self, response):
+        self.assertTrue(response["ok"], response)
+        return {nm: sorted(r.split('|', 1)[1] for r in rows) for nm, rows in response["tables"].items()}
+
+    def test_warm_maps(self):
+        """ maps stay warm, least recently used is closed, changed map file is loaded again
+        """
+        with ParseService(self.maps, max_maps = 2, chunk_size = 4) as service:
+            records = make_records(9)
+            self.assertEqual(self.tables(service.handle({"feed": "txn", "records": records})),
+                             self.expected('txn', records))
+            warm = service.cache["txn"]
+            service.handle({"feed": "order", "records": make_records(2, 'order')})
+            self.assertIs(service.feed("txn"), warm)
+            service.handle({"feed": "refund", "records": make_records(2, 'refund')})
+            self.assertEqual(list(service.cache), ["txn", "refund"])
+            self.assertEqual(service.counters["evictions"], 1)
+            os.utime(self.maps["txn"], (1, 1))
+            self.assertIsNot(service.feed("txn"), warm)
+            self.assertEqual(service.counters["mapLoads"], 4)
+            response = service.handle({"feed": "order", "records": [json.dumps(r) for r in records[:1]]})
+            self.assertFalse(response["ok"])
+            self.assertTrue(response["error"].startswith("UnmappedPathError"), response["error"])
+            self.assertFalse(service.handle({"feed": "nosuch", "records": []})["ok"])
+            status = service.handle({"command": "status"})
+            self.assertEqual(status["counters"]["errors"], 2)
+            self.assertEqual(status["counters"]["batches"], 3)
+
+    def test_outputs(self):
+        """ batches append to table files; loaded into database with kept connection, rolled back on error
+        """
+        out_dir = os.path.join(self.tmp.name, "out", "txn")
+        records = make_records(7)
+        with ParseService(self.maps, connect = self.connect, out_root = os.path.join(self.tmp.name, "out")) as service:
+            for part in (records[:3], records[3:]):
+                response = service.handle({"feed": "txn", "records": part, "out_dir": "txn"})
+                self.assertNotIn("tables", response)
+            files = dict()
+            for fn in os.listdir(out_dir):
+                with open(os.path.join(out_dir, fn)) as f:
+                    files[fn[:-4]] = sorted(line.split('|', 1)[1] for line in f.read().splitlines())
+            self.assertEqual(files, self.expected('txn', records))
+            for part in (records[:3], records[3:]):
+                response = service.handle({"feed": "txn", "records": part, "dsn": "dbname=x", "schema": "gap"})
+                self.assertTrue(response["ok"], response)
+            conn = self.connections[0]
+            self.assertEqual((len(self.connections), conn.commits), (1, 2))
+            self.assertTrue(all(sql.startswith("copy gap.txn_") and "delimiter '|'" in sql for sql, data in conn.copies))
+            conn.fail = True
+            self.assertFalse(service.handle({"feed": "txn", "records": records, "dsn": "dbname=x"})["ok"])
+            self.assertEqual(conn.rollbacks, 1)
+        self.assertTrue(conn.closed)
+
+    def test_copy_quoted(self):
+        """ values with backslash, newline, CR, delimiter and quote are loaded by COPY as they are
+        """
+        import csv
+        skus = ["a\\b", "c\nd", "e\rf", "g|h", 'i"j\\N']
+        records = [{"txn": {"store": 1, "item": [{"sku": sku} for sku in skus]}}]
+        with ParseService(self.maps, connect = self.connect) as service:
+            self.assertTrue(service.handle({"feed": "txn", "records": records, "dsn": "dbname=x"})["ok"])
+            self.assertEqual(service.handle({"feed": "txn", "records": records})["rows"]["txn_01item"], 5)
+        copies = {sql.split()[1]: data for sql, data in self.connections[0].copies}
+        self.assertIn("format csv", self.connections[0].copies[0][0])
+        rows = list(csv.reader(io.StringIO(copies["txn_01item"], newline = ''), delimiter = '|'))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(sorted(row[-1] for row in rows), sorted(skus))
+
+    def test_untrusted_requests(self):
+        """ request can not give map file or write outside of out_root; TCP on loopback address only
+        """
+        out_root = os.path.join(self.tmp.name, "out")
+        os.makedirs(out_root)
+        os.symlink(self.tmp.name, os.path.join(out_root, "link"))
+        records = make_records(2)
+        with ParseService(self.maps, out_root = out_root) as service:
+            for request in ({"map": self.maps["txn"], "records": records},
+                            {"feed": self.maps["txn"], "records": records},
+                            {"feed": "txn", "records": records, "out_dir": "../x"},
+                            {"feed": "txn", "records": records, "out_dir": self.tmp.name},
+                            {"feed": "txn", "records": records, "out_dir": "link/x"}):
+                response = service.handle(request)
+                self.assertFalse(response["ok"], request)
+                self.assertTrue(response["error"].startswith("ValueError"), response["error"])
+            self.assertEqual(os.listdir(self.tmp.name).count("x"), 0)
+            self.assertTrue(service.handle({"feed": "txn", "records": records, "out_dir": "a/b"})["ok"])
+            self.assertTrue(os.path.exists(os.path.join(out_root, "a", "b", "txn_00root.csv")))
+            with self.assertRaises(ValueError):
+                service.serve_socket("0.0.0.0:0")
+        with ParseService(self.maps) as service:
+            self.assertFalse(service.handle({"feed": "txn", "records": records, "out_dir": "a"})["ok"])
+        from jsonparse.service import is_loopback
+        self.assertEqual([is_loopback(h) for h in ("localhost", "127.0.0.1", "::1", "", "0.0.0.0")],
+                         [True, True, True, False, False])
+
+    def test_serve(self):
+        """ request lines on standard input, one response line each, stop at shutdown
+        """
+        requests = [json.dumps({"feed": "txn", "records": make_records(2)}), "", "not json",
+                    json.dumps({"command": "shutdown"}), json.dumps({"command": "status"})]
+        out = io.StringIO()
+        with ParseService(self.maps, workers = 2) as service:
+            service.serve(io.StringIO('\n'.join(requests) + '\n'), out)
+            pool = service.cache["txn"].pool
+            service.handle({"feed": "txn", "records": make_records(3)})
+            self.assertIs(service.cache["txn"].pool, pool)
+        responses = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([r["ok"] for r in responses], [True, False, True])
+        self.assertEqual(responses[0]["rows"], {"txn_00root": 2, "txn_01item": 1})
+
+    def test_socket(self):
+        """ clients of Unix socket, one after another
+        """
+        address = os.path.join(self.tmp.name, "s.sock")
+        service = ParseService(self.maps)
+        server = threading.Thread(target = service.serve_socket, args = (address,))
+        server.start()
+        try:
+            responses = []
+            for request in ({"feed": "txn", "records": make_records(4)}, {"command": "shutdown"}):
+                for _ in range(100):
+                    if os.path.exists(address):
+                        break
+                    threading.Event().wait(0.05)
+                with socket.socket(socket.AF_UNIX) as client:
+                    client.connect(address)
+                    with client.makefile('rwb') as f:
+                        f.write((json.dumps(request) + '\n').encode('utf-8'))
+                        f.flush()
+                        responses.append(json.loads(f.readline()))
+        finally:
+            server.join(10)
+            service.close()
+        self.assertEqual(responses[0]["rows"], {"txn_00root": 4, "txn_01item": 3})
+        self.assertEqual(responses[1], {"ok": True})
+        self.assertFalse(os.path.exists(address))
+
+    def test_cli(self):
+        """ serve sub command reads standard input
+        """
+        import sys
+        requests = '\n'.join(json.dumps(r) for r in ({"feed": "txn", "records": make_records(2)}, {"command": "status"}))
+        (stdin, stdout) = (sys.stdin, sys.stdout)
+        sys.stdin = io.StringIO(requests)
+        sys.stdout = io.StringIO()
+        try:
+            self.assertEqual(main(['serve', '--feed', f"txn={self.maps['txn']}", '--max-maps', '1']), 0)
+            output = sys.stdout.getvalue()
+        finally:
+            (sys.stdin, sys.stdout) = (stdin, stdout)
+        status = json.loads(output.splitlines()[1])
+        self.assertEqual(status["counters"]["records"], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Test statistics
+===============
+
+* **Program file**: test_stats.py
+* **Client**      : stage timers, counters, Prometheus/JSON export and cProfile hook
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_stats`
+"""
+import json
+import tempfile
+import unittest
+
+from jsonparse.jsonutils import JsonUtils
+from jsonparse.stats import ParseStats, NULL_STATS
+from jsonparse.cli import main
+
+JSTR = """
+[{"date": "2021-07-10", "txn": {"store": 123, "item": [{"sku":"456", "amt": 3.20}, {"sku": "789"}]}},
+ {"date": "2021-07-11", "txn": {"store": 124}}]
+"""
+
+class TestStats(unittest.TestCase):
+    def test_default_off(self):
+        """ statistics are switched off by default
+        """
+        ju = JsonUtils()
+        self.assertIs(ju.stats, NULL_STATS)
+        ju.load_from_string(jstr = JSTR)
+        ju.compute_all_paths()
+        ju.table_plan_json()
+        ju.parse_use_pool()
+        self.assertFalse(ju.stats.enabled)
+
+    def test_stage_and_counter(self):
+        """ timers of stages and counters of parse
+        """
+        ju = JsonUtils(table_name_prefix = 'ex_')
+        stats = ju.enable_stats()
+        ju.load_from_string(jstr = JSTR)
+        ju.compute_all_paths()
+        ju.table_plan_json()
+        ju.parse_use_pool()
+        for stage in ['decode', 'discover', 'plan', 'parse']:
+            self.assertIn(stage, stats.timers)
+            self.assertEqual(stats.calls[stage], 1)
+        self.assertEqual(stats.counters["records"], 2)
+        self.assertEqual(stats.counters["scalars"], 7)
+        self.assertEqual(stats.table_rows, {"ex_01item": 2, "ex_00root": 2})
+        self.assertGreater(stats.peak_memory, 0)
+        prom = stats.to_prometheus()
+        self.assertIn('jsonparse_records_total 2', prom)
+        self.assertIn('jsonparse_rows_total{table="ex_01item"} 2', prom)
+        self.assertEqual(json.loads(stats.to_json())["counters"]["scalars"], 7)
+
+    def test_profile(self):
+        """ cProfile hook for selected stage
+        """
+        ju = JsonUtils()
+        stats = ju.enable_stats(profile = ['parse'])
+        ju.load_from_string(jstr = JSTR)
+        ju.compute_all_paths()
+        ju.table_plan_json()
+        ju.parse_use_pool()
+        self.assertEqual(list(stats.profiles), ['parse'])
+        self.assertIn('parse_record', stats.profile_report())
+
+    def test_merge(self):
+        """ statistics from workers are added
+        """
+        s1 = ParseStats()
+        s2 = ParseStats()
+        s1.count('records', 3)
+        s2.count('records', 4)
+        s2.add_rows('t', 5)
+        s1.merge(s2)
+        self.assertEqual(s1.counters['records'], 7)
+        self.assertEqual(s1.table_rows['t'], 5)
+
+    def test_cli_stats(self):
+        """ parse sub command writes statistics, with workers
+        """
+        with tempfile.TemporaryDirectory() as d:
+            with open(f"{d}/d.jsonl", 'w') as f:
+                f.write('\n'.join(json.dumps(r) for r in json.loads(JSTR) * 10))
+            main(['plan', '--map', f"{d}/m.map", f"{d}/d.jsonl"])
+            main(['parse', '--map', f"{d}/m.map", '--out-dir', f"{d}/out", '--workers', '2', '--chunk-size', '3',
+                  '--stats', f"{d}/s.json", f"{d}/d.jsonl"])
+            with open(f"{d}/s.json", 'r') as f:
+                stats = json.load(f)
+            self.assertEqual(stats["counters"]["records"], 20)
+            for stage in ['decode', 'parse', 'encode', 'write']:
+                self.assertIn(stage, stats["timers"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+Test unmapped paths
+===================
+
+* **Program file**: test_unmapped.py
+* **Client**      : parse data with new fields (not in map) by policy fail / skip / overflow
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_unmapped`
+"""
+import json
+import tempfile
+import unittest
+
+from jsonparse.jsonutils import JsonUtils, UnmappedPathError
+from jsonparse.cli import main
+
+JSTR = """
+[{"date": "2021-07-10", "txn": {"store": 123, "item": [{"sku":"456", "amt": 3.20}, {"sku": "789"}]}}]
+"""
+JSTR_NEW = """
+[{"date": "2021-07-10", "txn": {"store": 123, "item": [{"sku":"456", "amt": 3.20, "qty": 2}, {"sku": "789", "qty": 1}],
+  "promo": [{"code": "A"}]}},
+ {"date": "2021-07-11", "txn": {"store": 124}}]
+"""
+
+class TestUnmapped(unittest.TestCase):
+    def setUp(self):
+        self.ju = JsonUtils(csv_delim = '|', table_name_prefix = 'ex_')
+        self.ju.load_from_string(jstr = JSTR)
+        self.ju.compute_all_paths()
+        self.ju.table_plan_json()
+        self.ju.load_from_string(jstr = JSTR_NEW)
+
+    def test_fail(self):
+        """ default: stop at first path not in map
+        """
+        with self.assertRaises(UnmappedPathError) as cm:
+            self.ju.parse_use_pool()
+        self.assertIn(cm.exception.path, ['txn.item.qty', 'txn.promo'])
+        self.assertEqual(cm.exception.record_index, 0)
+        self.assertIsInstance(cm.exception, ValueError)
+
+    def test_skip(self):
+        """ skip values not in map, count paths
+        """
+        summary = self.ju.parse_use_pool(unmapped = 'skip')
+        self.assertEqual(summary, {'txn.item.qty': 2, 'txn.promo': 1})
+        self.assertEqual(len(self.ju.parsed_tables['ex_00root']), 2)
+        self.assertEqual([r.split('|', 1)[1] for r in self.ju.parsed_tables['ex_01item']], ['1|3.2|456', '2||789'])
+        self.assertNotIn('ex_unmapped', self.ju.parsed_tables)
+
+    def test_overflow(self):
+        """ values not in map go to overflow table as JSON
+        """
+        self.ju.parse_use_pool(unmapped = 'overflow')
+        rows = sorted(r.split('|', 1)[1] for r in self.ju.parsed_tables['ex_unmapped'])
+        self.assertEqual(rows, ['ex_00root||txn.promo|[{"code":"A"}]',
+                                'ex_01item|1|txn.item.qty|2',
+                                'ex_01item|2|txn.item.qty|1'])
+
+    def test_cli_overflow(self):
+        """ parse sub command with overflow table
+        """
+        with tempfile.TemporaryDirectory() as d:
+            self.ju.json_map_export(map_file = f"{d}/m.map")
+            with open(f"{d}/d.jsonl", 'w') as f:
+                f.write('\n'.join(json.dumps(r) for r in json.loads(JSTR_NEW)))
+            main(['parse', '--map', f"{d}/m.map", '--out-dir', f"{d}/out", '--unmapped', 'overflow',
+                  '--prefix', 'ex_', f"{d}/d.jsonl"])
+            with open(f"{d}/out/ex_unmapped.txt", 'r') as f:
+                self.assertEqual(len(f.read().splitlines()), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+"""
+Test wide tables
+================
+
+* **Program file**: test_wide.py
+* **Client**      : tables over column limit are split into tables sharing uuid and sequence keys
+
+Run this test under upper folder of `tests`
+
+`python -B -m unittest tests.test_wide`
+"""
+import json
+import tempfile
+import unittest
+
+from jsonparse.jsonutils import JsonUtils, split_wide_tables
+from jsonparse.stream import table_columns
+from jsonparse.cli import main
+
+def make_records(cnt):
+    """ root with 25 columns, items with 12 columns; some values missing
+    """
+    return [dict({f"r{c:02d}": f"{i}-{c}" for c in range(25) if (i + c) % 7 != 0},
+                 item = [{f"i{c:02d}": f"{i}-{j}-{c}" for c in range(12) if c < 6 or j > 0} for j in range(2)])
+            for i in range(cnt)]
+
+def join_parts(parsed_tables, names, key_cnt, delim='|'):
+    """ rows of split tables joined on key (uuid and sequences), as one row
+    """
+    rows = dict()
+    widths = []
+    for nm in names:
+        width = None
+        for r in parsed_tables[nm]:
+            vals = r.split(delim)
+            width = len(vals) - key_cnt
+            rows.setdefault(tuple(vals[:key_cnt]), dict())[nm] = vals[key_cnt:]
+        widths.append(width)
+    return {k: sum((v.get(nm, [''] * (w or 0)) for nm, w in zip(names, widths)), []) for k, v in rows.items()}
+
+class TestWide(unittest.TestCase):
+    def setUp(self):
+        self.ju = JsonUtils(csv_delim = '|', table_name_prefix = 'ex_')
+        self.ju.load_from_string(jstr = json.dumps(make_records(20)))
+        self.ju.compute_all_paths()
+        self.ju.table_plan_json()
+        self.full_map = json.loads(json.dumps(self.ju.map))
+
+    def test_split_map(self):
+        """ no table over limit, keys in each table, columns in map order
+        """
+        jmap = split_wide_tables(self.full_map, max_columns = 10)
+        names = [t["tableName"] for t in jmap["tableList"]]
+        self.assertEqual(names, ['ex_01item', 'ex_01item_p2', 'ex_00root', 'ex_00root_p2', 'ex_00root_p3'])
+        self.assertEqual(jmap["tableNumber"], 5)
+        for tbl in jmap["tableList"]:
+            self.assertLessEqual(len(table_columns(tbl)), 10)
+        self.assertEqual(table_columns(jmap["tableList"][1])[:2], ['uuid', 'seq_item'])
+        clms = [c["columnName"] for t in jmap["tableList"][2:] for c in t["columnList"]]
+        self.assertEqual(clms, [c["columnName"] for c in self.full_map["tableList"][1]["columnList"]])
+        self.assertIs(split_wide_tables(self.full_map)["tableList"][0], self.full_map["tableList"][0])
+        with self.assertRaises(ValueError):
+            split_wide_tables(self.full_map, max_columns = 2)
+
+    def test_parse_routes_columns(self):
+        """ joined rows of split tables are same as rows of wide table, both engines
+        """
+        self.ju.txn_seed = None
+        self.ju.parse_use_pool()
+        wide = {k: v for k, v in self.ju.parsed_tables.items()}
+        self.ju.split_wide_tables(max_columns = 10)
+        self.ju.parse_use_pool()
+        split_pool = self.ju.parsed_tables
+        strip = lambda rows: sorted(tuple(k[1:]) + tuple(v) for k, v in rows.items())
+        for (nm, names, key_cnt) in [('ex_00root', ['ex_00root', 'ex_00root_p2', 'ex_00root_p3'], 1),
+                                     ('ex_01item', ['ex_01item', 'ex_01item_p2'], 2)]:
+            self.assertEqual(strip(join_parts(split_pool, names, key_cnt)), strip(join_parts(wide, [nm], key_cnt)))
+        # second part of items is empty for first element: no row
+        self.assertEqual(len(split_pool['ex_01item']), 40)
+        self.assertEqual(len(split_pool['ex_01item_p2']), 20)
+        self.ju.parse_to_csv()
+        for nm in split_pool:
+            self.assertEqual(sorted(r.split('|', 1)[1] for r in self.ju.parsed_tables[nm]),
+                             sorted(r.split('|', 1)[1] for r in split_pool[nm]), nm)
+
+    def test_extras_and_projection(self):
+        """ extras column in last part; one part can be parsed alone
+        """
+        self.ju.add_extras_column()
+        self.ju.split_wide_tables(max_columns = 10)
+        self.assertEqual([t.get("extrasColumn", None) for t in self.ju.map["tableList"]],
+                         [None, 'extras', None, None, 'extras'])
+        self.ju.load_from_string(jstr = json.dumps([dict(make_records(1)[0], extra_tag = 5)]))
+        self.assertEqual(self.ju.parse_use_pool(), {})
+        last = self.ju.parsed_tables['ex_00root_p3'][0].split('|')
+        self.assertEqual(json.loads(last[-1]), {"extra_tag": 5})
+        self.ju.parse_use_pool(tables = ['ex_00root_p2'], columns = {'ex_00root_p2': ['r09']})
+        self.assertEqual(list(self.ju.parsed_tables), ['ex_00root_p2'])
+        self.assertEqual([r.split('|', 1)[1] for r in self.ju.parsed_tables['ex_00root_p2']], ['0-9'])
+
+    def test_ddl_and_evolve(self):
+        """ DDL of split tables; new column goes to last part, split again
+        """
+        with tempfile.TemporaryDirectory() as d:
+            self.ju.postgres_ddl(sql_file = f"{d}/m.sql", schema_name = 's', max_columns = 10)
+            with open(f"{d}/m.sql", 'r') as f:
+                ddl = f.read()
+        self.assertEqual(ddl.count('create table'), 5)
+        self.assertIn("-- The 4-th table ex_00root_p2\ndrop table if exists s.ex_00root_p2;\n"
+                      "create table s.ex_00root_p2 (\n    uuid text\n    , r09 text\n", ddl)
+        self.ju.map_to_allpath()
+        self.assertEqual(self.ju.map_array, ['item'])
+        self.ju.add_new_path_to_map(['r99', 'r98', 'r97'])
+        self.assertEqual([c["columnName"] for c in self.ju.map["tableList"][4]["columnList"]][-3:], ['r99', 'r98', 'r97'])
+        self.assertEqual(self.ju.split_wide_tables(max_columns = 10), ['ex_00root_p4'])
+        self.assertEqual(len(self.ju.map["tableList"][4]["columnList"]), 9)
+
+    def test_ddl_format(self):
+        """ DDL text of table is same as before
+        """
+        ju = JsonUtils()
+        ju.map = {"tableNumber": 1, "tableList": [{"tableName": "t", "rootPath": "a", "seqList": [{"columnName": "seq_a"}],
+                  "columnList": [{"columnName": "x", "relativePath": "x"}, {"columnName": "y", "relativePath": "y"}]}]}
+        with tempfile.TemporaryDirectory() as d:
+            ju.postgres_ddl(sql_file = f"{d}/m.sql", schema_name = 's')
+            with open(f"{d}/m.sql", 'r') as f:
+                self.assertEqual(f.read(), "-- The 1-th table t\ndrop table if exists s.t;\ncreate table s.t (\n"
+                                 "    uuid text\n    , seq_a int\n    , x text\n    , y text\n    );\n\n")
+
+    def test_cli(self):
+        """ plan with --max-columns, stream parse writes file of each part
+        """
+        with tempfile.TemporaryDirectory() as d:
+            with open(f"{d}/d.jsonl", 'w') as f:
+                f.write('\n'.join(json.dumps(r) for r in make_records(20)))
+            self.assertEqual(main(['plan', '--map', f"{d}/m.map", '--ddl', f"{d}/m.sql", '--max-columns', '10',
+                                   f"{d}/d.jsonl"]), 0)
+            self.assertEqual(main(['parse', '--map', f"{d}/m.map", '--out-dir', f"{d}/out", f"{d}/d.jsonl"]), 0)
+            with open(f"{d}/out/00root_p3.txt", 'r') as f:
+                rows = f.read().splitlines()
+            self.assertEqual(len(rows), 20)
+            self.assertEqual(len(rows[0].split('|')), 8)
+
+if __name__ == '__main__':
+    unittest.main()